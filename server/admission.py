@@ -0,0 +1,224 @@
+import itertools
+import math
+import os
+import threading
+import time
+
+from metrics import ADMISSION_WAIT_SECONDS, ADMISSIONS
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a generation can't even be queued. retry_after is a hint in seconds.
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """
+    One generation's claim on an upstream slot. It is admitted once the
+    controller grants it a slot, and must be released when the generation
+    ends, or when the caller stops waiting.
+    """
+
+    def __init__(self, controller, client, tag):
+        self.controller = controller
+        self.client = client
+        self.tag = tag
+        self.requested_at = time.monotonic()
+        self.admitted_at = None
+        self.released = False
+        self._admitted = threading.Event()
+
+    @property
+    def admitted(self):
+        return self._admitted.is_set()
+
+    @property
+    def position(self):
+        """
+        Place in the wait queue (1 is next), or 0 once admitted
+        """
+        return self.controller.position(self)
+
+    def wait(self, timeout=None):
+        """
+        Wait up to `timeout` seconds for a slot. Returns whether the ticket is admitted.
+        """
+        if not self._admitted.wait(timeout):
+            # A backoff that has run out frees slots without any release to notice it
+            self.controller.dispatch()
+        return self.admitted
+
+    def release(self):
+        self.controller.release(self)
+
+    def holding(self, frames):
+        """
+        Iterate over frames, releasing the ticket once they run out or fail
+        """
+        try:
+            yield from frames
+        finally:
+            self.release()
+
+
+class AdmissionController:
+    """
+    Caps how many generations call the model at once and shares the slots
+    fairly between clients.
+
+    At most `max_active` tickets hold a slot, and at most `per_client` of
+    them belong to the same client. Tickets that can't start yet wait in a
+    queue ordered by weighted fair queuing: each gets a virtual finish tag
+    of max(virtual time, the client's last tag) + 1 / weight, and free slots
+    go to the lowest tag whose client is under its limit. A client that
+    sends a burst therefore takes turns with everyone else instead of going
+    first. Once `max_waiting` tickets are queued, or a client has
+    `client_queue` of its own waiting, request() raises AdmissionRejected
+    with a Retry-After estimate. backoff() holds back new admissions for a
+    while, e.g. after the model reports it is being throttled.
+    """
+
+    def __init__(self, max_active=8, per_client=4, max_waiting=16, client_queue=4, weights=None):
+        self.max_active = max_active
+        self.per_client = per_client
+        self.max_waiting = max_waiting
+        self.client_queue = client_queue
+        self.weights = weights or {}
+        self.rejected = 0
+        self._active = {}  # client -> admitted tickets
+        self._waiting = []
+        self._last_tag = {}  # client -> finish tag of its latest ticket
+        self._virtual_time = 0.0
+        self._hold_seconds = 10.0  # moving average of how long a slot is held
+        self._paused_until = 0.0
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def request(self, client):
+        """
+        Queue a ticket for the client and admit it straight away if a slot is free
+        """
+        with self._lock:
+            client_waiting = sum(1 for ticket in self._waiting if ticket.client == client)
+            if len(self._waiting) >= self.max_waiting or client_waiting >= self.client_queue:
+                self.rejected += 1
+                ADMISSIONS.inc(outcome='rejected')
+                scope = 'your' if client_waiting >= self.client_queue else 'the'
+                raise AdmissionRejected(f"Too many generations are waiting in {scope} queue", self._retry_after())
+
+            weight = self.weights.get(client, 1.0)
+            tag = max(self._virtual_time, self._last_tag.get(client, 0.0)) + 1.0 / weight
+            self._last_tag[client] = tag
+            ticket = Ticket(self, client, (tag, next(self._sequence)))
+            self._waiting.append(ticket)
+            self._dispatch()
+            ADMISSIONS.inc(outcome='admitted' if ticket.admitted else 'queued')
+        if not ticket.admitted:
+            print(f"Generation for {client} queued at position {ticket.position}")
+        return ticket
+
+    def position(self, ticket):
+        with self._lock:
+            if ticket.admitted or ticket not in self._waiting:
+                return 0
+            return 1 + sum(1 for other in self._waiting if other.tag < ticket.tag)
+
+    def release(self, ticket):
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket.admitted:
+                self._active[ticket.client].remove(ticket)
+                if not self._active[ticket.client]:
+                    del self._active[ticket.client]
+                held = time.monotonic() - ticket.admitted_at
+                self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * held
+            else:
+                self._waiting.remove(ticket)
+                ADMISSIONS.inc(outcome='abandoned')
+            if not self._waiting and not self._active:
+                # Idle: tags restart so a long-gone burst doesn't count against anyone
+                self._last_tag.clear()
+                self._virtual_time = 0.0
+            self._dispatch()
+
+    def backoff(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        print(f"Holding back new generations for {seconds}s")
+
+    def dispatch(self):
+        with self._lock:
+            self._dispatch()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active': sum(len(tickets) for tickets in self._active.values()),
+                'waiting': len(self._waiting),
+                'clients': len(self._active),
+                'max_active': self.max_active,
+                'max_waiting': self.max_waiting,
+                'rejected': self.rejected,
+                'paused_seconds': round(max(0.0, self._paused_until - time.monotonic()), 1)
+            }
+
+    def _dispatch(self):
+        if time.monotonic() < self._paused_until:
+            return
+        active = sum(len(tickets) for tickets in self._active.values())
+        while active < self.max_active:
+            eligible = [ticket for ticket in self._waiting if len(self._active.get(ticket.client, ())) < self.per_client]
+            if not eligible:
+                return
+            ticket = min(eligible, key=lambda candidate: candidate.tag)
+            self._waiting.remove(ticket)
+            self._active.setdefault(ticket.client, []).append(ticket)
+            self._virtual_time = ticket.tag[0]
+            ticket.admitted_at = time.monotonic()
+            ADMISSION_WAIT_SECONDS.observe(ticket.admitted_at - ticket.requested_at)
+            ticket._admitted.set()
+            active += 1
+
+    def _retry_after(self):
+        """
+        Seconds until a slot is likely to be free for a new request, from the average hold time
+        """
+        paused = max(0.0, self._paused_until - time.monotonic())
+        rounds = (len(self._waiting) + 1) / max(self.max_active, 1)
+        return max(1, math.ceil(paused + self._hold_seconds * rounds))
+
+
+def parse_weights(value):
+    """
+    Client weights from 'client=weight' pairs separated by commas
+    """
+    weights = {}
+    for pair in (value or '').split(','):
+        client, _, weight = pair.partition('=')
+        if client.strip() and weight.strip():
+            weights[client.strip()] = float(weight)
+    return weights
+
+
+def create_admission_controller_from_env():
+    """
+    Build the process-wide controller from ADMISSION_* environment variables,
+    or return None if ADMISSION_MAX_ACTIVE is 0.
+    """
+    max_active = int(os.getenv('ADMISSION_MAX_ACTIVE', '8'))
+    if max_active <= 0:
+        return None
+    return AdmissionController(
+        max_active=max_active,
+        per_client=int(os.getenv('ADMISSION_PER_CLIENT', '4')),
+        max_waiting=int(os.getenv('ADMISSION_MAX_WAITING', '16')),
+        client_queue=int(os.getenv('ADMISSION_CLIENT_QUEUE', '4')),
+        weights=parse_weights(os.getenv('ADMISSION_CLIENT_WEIGHTS'))
+    )
@@ -1,12 +1,35 @@
 from flask import Flask, request, jsonify, Response, redirect
 from flask_cors import CORS
 import os
-import google.generativeai as genai
 from dotenv import load_dotenv
 import json
+import math
 import traceback
-import requests
 import random
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from itertools import chain
+from image_cache import ImageCache, create_image_cache_from_env
+from image_catalog import create_image_catalog_from_env, image_from_result
+from unsplash_client import create_unsplash_client_from_env
+from topics import extract_topics
+from fence_parser import FenceParser
+from framing import FrameCoalescer, accepts_gzip, gzip_frames, with_ticks
+from minify import FencedMinifier, compact_site, estimate_tokens
+from continuation import Stitcher, build_continuation_prompt, chunk_text, continued_texts, finish_reason
+from broadcast import SingleFlight, create_replay_store_from_env
+from admission import AdmissionRejected, create_admission_controller_from_env
+from artifacts import PatchError, apply_patch, complete_patch, create_artifact_store_from_env
+from generation_cache import create_generation_cache_from_env
+from hedging import create_hedge_policy_from_env, hedged
+from routing import create_router_from_env, observed
+from jobs import FINISHED_STATUSES, PRIORITIES as JOB_PRIORITIES, QueueFull, create_job_queue_from_env
+from metrics import (
+    CATALOG_SECONDS, CHUNK_GAP_SECONDS, ERRORS, FIRST_CHUNK_SECONDS, GENERATION_CACHE_LOOKUPS, MINIFIED_BYTES_SAVED,
+    PROMPT_CHARS_SAVED, REQUESTS, STREAM_BYTES, STREAM_CHUNKS, STREAM_FRAMES, STREAM_SECONDS, UNSPLASH_SECONDS, RequestTimer, registry
+)
 
 load_dotenv()
 
@@ -14,8 +37,103 @@ load_dotenv()
 GITHUB_REPO_URL = "https://github.com/VEDANTSHEGAONKAR/instn-main"
 
 # Unsplash API configuration
-# Using the Unsplash demo key for both development and production
+# Using the Unsplash demo key for both development and production, unless UNSPLASH_ACCESS_KEY is set.
+# Requests are rationed to the key's hourly quota (UNSPLASH_HOURLY_LIMIT, see unsplash_client.py)
 UNSPLASH_DEMO_KEY = "ab3411e4ac868c2646c0ed488dfd919ef612b04c264f3374c97fff98ed253dc9"
+UNSPLASH_ACCESS_KEY = os.getenv('UNSPLASH_ACCESS_KEY') or UNSPLASH_DEMO_KEY
+
+# Image lookups for a request run in parallel and must finish within this many seconds,
+# otherwise generation starts without the missing images
+IMAGE_FETCH_DEADLINE = float(os.getenv('IMAGE_FETCH_DEADLINE', '4.0'))
+IMAGE_FETCH_WORKERS = int(os.getenv('IMAGE_FETCH_WORKERS', '8'))
+
+# Shared pool so concurrent requests don't each spin up their own threads
+image_fetch_executor = ThreadPoolExecutor(max_workers=IMAGE_FETCH_WORKERS, thread_name_prefix='unsplash')
+
+# Pooled keep-alive client with timeouts, retries, a circuit breaker and a quota bucket (see unsplash_client.py).
+# Created on first use by get_unsplash_client
+unsplash_client = None
+
+# Generated sites, so modifications can send a siteId instead of the full code (see artifacts.py)
+artifact_store = create_artifact_store_from_env()
+
+# Unsplash results are cached per normalized query (see image_cache.py)
+image_cache = create_image_cache_from_env()
+
+# Local full-text catalog of images (see image_catalog.py). IMAGE_SOURCE picks how it is used:
+# 'unsplash' never, 'catalog' first with Unsplash for misses, 'fallback' (default) when Unsplash has nothing
+IMAGE_SOURCE = os.getenv('IMAGE_SOURCE', 'fallback').strip().lower()
+image_catalog = create_image_catalog_from_env() if IMAGE_SOURCE in ('catalog', 'fallback') else None
+
+# 'raw' relays model text chunks, 'sections' sends parsed html/css/js deltas (see fence_parser.py)
+RESPONSE_MODES = ('raw', 'sections')
+
+# /api/generate-batch takes at most BATCH_MAX_ITEMS descriptions and generates BATCH_CONCURRENCY at a time
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '20'))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '3'))
+
+# Completed generations are cached by description similarity (see generation_cache.py). GENERATION_CACHE_MODE
+# 'replay' streams a close enough match straight back, 'seed' gives it to the model as a starting point, 'off' disables it
+GENERATION_CACHE_MODE = os.getenv('GENERATION_CACHE_MODE', 'off').strip().lower()
+generation_cache = create_generation_cache_from_env(GENERATION_CACHE_MODE) if GENERATION_CACHE_MODE in ('replay', 'seed') else None
+
+# Generations calling the model are capped and share the slots fairly between clients (see admission.py).
+# Clients are told apart by the ADMISSION_CLIENT_HEADER header (e.g. an API key) when set, otherwise by IP address
+admission = create_admission_controller_from_env()
+ADMISSION_CLIENT_HEADER = os.getenv('ADMISSION_CLIENT_HEADER', '').strip()
+
+# How many reverse proxies in front of the app append to X-Forwarded-For. Clients can send the header
+# themselves, so only the address added by the outermost trusted proxy is used, and with 0 the peer address
+ADMISSION_TRUSTED_PROXIES = int(os.getenv('ADMISSION_TRUSTED_PROXIES', '0'))
+
+# A queued generation gives up after this many seconds
+ADMISSION_MAX_WAIT = float(os.getenv('ADMISSION_MAX_WAIT', '30'))
+
+# When Gemini reports we are throttled, new generations are held back for this many seconds
+GEMINI_THROTTLE_BACKOFF = float(os.getenv('GEMINI_THROTTLE_BACKOFF', '5'))
+
+# With HEDGING on, a Gemini stream with no chunk after HEDGE_DELAY seconds (or, if unset, the HEDGE_PERCENTILE of
+# recent first-chunk times) is raced against a second call, within a HEDGE_BUDGET share of calls (see hedging.py)
+hedge_policy = create_hedge_policy_from_env()
+
+# Concurrent identical generation requests share one upstream stream (see broadcast.py)
+SINGLE_FLIGHT = os.getenv('SINGLE_FLIGHT', 'True').lower() == 'true'
+
+# Generated text is coalesced into SSE events of at least SSE_COALESCE_BYTES, or flushed after
+# SSE_FLUSH_INTERVAL seconds, whichever comes first; 0 bytes sends every chunk as its own event (see framing.py)
+SSE_COALESCE_BYTES = int(os.getenv('SSE_COALESCE_BYTES', '256'))
+SSE_FLUSH_INTERVAL = float(os.getenv('SSE_FLUSH_INTERVAL', '0.05'))
+
+# Seconds without events before a comment heartbeat keeps proxies from closing the stream; 0 disables
+SSE_HEARTBEAT = float(os.getenv('SSE_HEARTBEAT', '15'))
+
+# Gzip event streams for clients that send Accept-Encoding: gzip
+SSE_GZIP = os.getenv('SSE_GZIP', 'False').lower() == 'true'
+
+# Generated code is minified as it streams to the client; the artifact store keeps it as generated (see minify.py)
+STREAM_MINIFY = os.getenv('STREAM_MINIFY', 'False').lower() == 'true'
+
+# The current site is minified before it goes into a modify prompt (see minify.py)
+COMPACT_PROMPTS = os.getenv('COMPACT_PROMPTS', 'True').lower() == 'true'
+
+# Modify requests whose site is larger than this many input tokens are rejected up front. Full
+# regenerations get an output budget in proportion to the site, and are rejected if that exceeds the cap
+MODIFY_MAX_INPUT_TOKENS = int(os.getenv('MODIFY_MAX_INPUT_TOKENS', '30000'))
+MODIFY_MAX_OUTPUT_TOKENS = int(os.getenv('MODIFY_MAX_OUTPUT_TOKENS', '8192'))
+
+# Output cut off by max_output_tokens (or ending inside a code fence) is continued in the same stream,
+# up to this many times, with the last CONTINUATION_TAIL_CHARS characters as context (see continuation.py)
+MAX_CONTINUATIONS = int(os.getenv('MAX_CONTINUATIONS', '2'))
+CONTINUATION_TAIL_CHARS = int(os.getenv('CONTINUATION_TAIL_CHARS', '2000'))
+
+# Generations keep running when the client drops and can be resumed by id (see broadcast.py)
+replay_store = create_replay_store_from_env()
+
+# In pipelined mode, generation starts without whatever images haven't resolved by this many seconds
+PIPELINE_DEADLINE = float(os.getenv('PIPELINE_DEADLINE', '1.5'))
+
+# Where image search topics come from: 'local' keyword extraction (default) or a 'gemini' call
+TOPIC_SOURCE = os.getenv('TOPIC_SOURCE', 'local').strip().lower()
 
 # We'll use a text description of the CSS rules instead of actual CSS code to avoid Python parsing issues
 
@@ -27,61 +145,148 @@ origins_list = [origin.strip() for origin in allowed_origins.split(',')]
 CORS(app, resources={
     r"/api/*": {
         "origins": origins_list,
-        "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"],
-        "expose_headers": ["Content-Type"],
+        "methods": ["GET", "POST", "DELETE", "OPTIONS"],
+        "allow_headers": ["Content-Type", "Authorization", "Last-Event-ID"],
+        "expose_headers": ["Content-Type", "Server-Timing", "Retry-After"],
         "supports_credentials": True
     }
 })
 
-# Initialize Gemini client with error handling
-try:
-    api_key = os.getenv('GOOGLE_API_KEY')
-    if not api_key:
-        raise ValueError("GOOGLE_API_KEY not found in environment variables")
+# The Gemini client is created on first use (see get_model), so importing the app stays cheap.
+# Tests and benchmarks can assign a stand-in to `model` directly; it then serves every routed model.
+GEMINI_MODEL_NAME = os.getenv('GEMINI_MODEL', 'gemini-2.0-flash')
+model = None
+_models = {}  # model name -> GenerativeModel created by get_model
+_client_lock = threading.Lock()
+
+# Each model call gets a model and output budget for its task and input size, learned from truncation
+# (see routing.py). GEMINI_FAST_MODEL and GEMINI_LARGE_MODEL name the models for small edits and large jobs
+router = create_router_from_env(GEMINI_MODEL_NAME)
+
+def get_model(name=None):
+    """
+    Return the Gemini model (or the named one, for a routed call), configuring the client on first use.
+    Raises if it can't be created, so callers fail with the real reason.
+    """
+    global model
+    name = name or GEMINI_MODEL_NAME
+    if model is not None and (name == GEMINI_MODEL_NAME or model is not _models.get(GEMINI_MODEL_NAME)):
+        return model
+    if name not in _models:
+        with _client_lock:
+            if name not in _models:
+                started = time.perf_counter()
+                # google.generativeai takes most of the app's import time, so it is only loaded here
+                import google.generativeai as genai
+
+                api_key = os.getenv('GOOGLE_API_KEY')
+                if not api_key:
+                    raise ValueError("GOOGLE_API_KEY not found in environment variables")
+                genai.configure(api_key=api_key)
+                _models[name] = genai.GenerativeModel(name)
+                if name == GEMINI_MODEL_NAME:
+                    model = _models[name]
+                print(f"Gemini client for {name} initialized in {round((time.perf_counter() - started) * 1000)}ms")
+    return _models[name]
+
+def get_unsplash_client():
+    global unsplash_client
+    if unsplash_client is None:
+        with _client_lock:
+            if unsplash_client is None:
+                unsplash_client = create_unsplash_client_from_env(UNSPLASH_ACCESS_KEY)
+    return unsplash_client
+
+def gemini_generation_config(**settings):
+    import google.generativeai as genai
+
+    return genai.types.GenerationConfig(**settings)
+
+def routed_generation_config(route):
+    return gemini_generation_config(max_output_tokens=route.max_output_tokens, **route.settings)
+
+def normalize_query(query):
+    """
+    Clean up a search query to make it more search-friendly
+    """
+    clean_query = query.strip().lower()
+
+    # If the query is a phrase, try to extract the most meaningful parts
+    if len(clean_query.split()) > 2:
+        # Remove common words that don't add much to image search
+        stop_words = ['the', 'and', 'or', 'a', 'an', 'in', 'on', 'at', 'by', 'for', 'with', 'about', 'website', 'page']
+        query_words = [word for word in clean_query.split() if word not in stop_words]
+        if query_words:
+            clean_query = ' '.join(query_words[:3])  # Use up to 3 most relevant words
 
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel('gemini-2.0-flash')
-except Exception as e:
-    print(f"Error initializing Gemini client: {str(e)}")
-    traceback.print_exc()
+    return clean_query
 
 def get_unsplash_image(query, count=1):
     """
-    Fetch images from Unsplash API based on a search query
+    Fetch images from Unsplash API based on a search query, going through the image cache
+    and the local image catalog (see IMAGE_SOURCE)
     """
     try:
-        # Clean up the query to make it more search-friendly
-        clean_query = query.strip().lower()
+        clean_query = normalize_query(query)
+        if IMAGE_SOURCE == 'catalog':
+            images = catalog_images(clean_query, count)
+            if images:
+                return images
 
-        # If the query is a phrase, try to extract the most meaningful parts
-        if len(clean_query.split()) > 2:
-            # Remove common words that don't add much to image search
-            stop_words = ['the', 'and', 'or', 'a', 'an', 'in', 'on', 'at', 'by', 'for', 'with', 'about', 'website', 'page']
-            query_words = [word for word in clean_query.split() if word not in stop_words]
-            if query_words:
-                clean_query = ' '.join(query_words[:3])  # Use up to 3 most relevant words
+        cache_key = ImageCache.make_key(clean_query, count)
 
-        print(f"Searching Unsplash for: '{clean_query}'")
+        cached, state = image_cache.get(cache_key)
+        if state == 'fresh':
+            return cached
+        if state == 'stale':
+            # Serve the stale images now and refresh them in the background
+            image_cache.refresh(cache_key, lambda: search_unsplash(clean_query, count, background=True))
+            return cached
 
-        url = "https://api.unsplash.com/search/photos"
-        headers = {
-            "Authorization": f"Client-ID {UNSPLASH_DEMO_KEY}"
-        }
-        params = {
-            "query": clean_query,
-            "per_page": max(count * 3, 10),  # Request more images to have better selection
-            "orientation": "landscape",
-            "content_filter": "high"
-        }
+        images = search_unsplash(clean_query, count)
+        if images:
+            image_cache.set(cache_key, images)
+        elif IMAGE_SOURCE == 'fallback':
+            # Unsplash failed, had nothing, or the quota is spent
+            images = catalog_images(clean_query, count)
+        return images
+    except Exception as e:
+        print(f"Error in get_unsplash_image: {str(e)}")
+        traceback.print_exc()
+        return None
+
+def catalog_images(clean_query, count=1):
+    started = time.perf_counter()
+    images = image_catalog.search(clean_query, count)
+    CATALOG_SECONDS.observe(time.perf_counter() - started, outcome='hit' if images else 'miss')
+    return images
+
+def search_unsplash(clean_query, count=1, background=False):
+    """
+    Query the Unsplash search API for an already normalized query.
+    Returns None straight away once the hourly quota is used up.
+    """
+    try:
+        print(f"Searching Unsplash for: '{clean_query}'")
 
-        response = requests.get(url, headers=headers, params=params)
-        data = response.json()
+        started = time.perf_counter()
+        data = get_unsplash_client().search_photos(
+            clean_query,
+            per_page=max(count * 3, 10),  # Request more images to have better selection
+            background=background,
+            orientation="landscape",
+            content_filter="high"
+        )
+        UNSPLASH_SECONDS.observe(time.perf_counter() - started, outcome='ok' if data is not None else 'failed')
 
-        if response.status_code == 200 and data.get('results'):
+        if data and data.get('results'):
             # If we got results, select the most relevant ones
             results = data['results']
 
+            if image_catalog is not None:
+                # Seed the local catalog, which starts out empty unless it was built ahead of time
+                image_catalog.add_results(results, clean_query)
+
             # Sort by relevance (Unsplash already does this, but we can prioritize certain attributes)
             # For example, prioritize images with descriptions that match our query
             if len(results) > count:
@@ -111,39 +316,737 @@ def get_unsplash_image(query, count=1):
             else:
                 results = results[:count]
 
-            images = []
-            for img in results:
-                # Use smaller image sizes to prevent oversized images
-                images.append({
-                    "url": img['urls']['small'],  # Use small size by default (max 400px wide)
-                    "regular_url": img['urls']['regular'],  # Keep regular size as an option
-                    "thumb_url": img['urls']['thumb'],  # Thumbnail size (max 200px wide)
-                    "alt": img.get('alt_description', clean_query) or clean_query,
-                    "credit": f"Photo by {img['user']['name']} on Unsplash",
-                    "download_url": img['links']['download'],
-                    "topic": clean_query
-                })
-            return images
+            # Use smaller image sizes to prevent oversized images
+            return [image_from_result(img, clean_query) for img in results]
         else:
-            print(f"Error fetching Unsplash images: {data}")
+            # Upstream errors are logged by the client; an open circuit or a spent quota fails fast to no images
             return None
     except Exception as e:
-        print(f"Error in get_unsplash_image: {str(e)}")
+        print(f"Error in search_unsplash: {str(e)}")
         traceback.print_exc()
         return None
 
-def stream_response(response):
+def fetch_images_for_topics(topics, deadline=None):
+    """
+    Fetch one Unsplash image per topic in parallel.
+    Lookups still running when the deadline passes are skipped, and the
+    result keeps the order of the topics that did resolve.
+    """
+    if not topics:
+        return []
+
+    if deadline is None:
+        deadline = IMAGE_FETCH_DEADLINE
+
+    futures = [image_fetch_executor.submit(get_unsplash_image, topic, 1) for topic in topics]
+    done, not_done = wait(futures, timeout=deadline)
+
+    if not_done:
+        print(f"Skipping {len(not_done)} image lookup(s) that missed the {deadline}s deadline")
+        for future in not_done:
+            # Lookups that haven't started yet don't need to run at all
+            future.cancel()
+
+    image_data = []
+    for topic, future in zip(topics, futures):
+        if future not in done:
+            continue
+        images = future.result()
+        if images:
+            image_data.append({
+                'topic': topic,
+                'image': images[0]
+            })
+    return image_data
+
+def get_image_topics(text, max_topics, topic_prompt):
+    """
+    Pick image search topics for a description or modification request.
+    Uses the local keyword extractor unless TOPIC_SOURCE=gemini, in which case
+    the local extractor is the fallback when the Gemini call fails.
+    """
+    if TOPIC_SOURCE == 'gemini':
+        try:
+            route = router.route('topics', temperature=0.2)  # Low temperature for more deterministic results
+            topic_response = get_model(route.model).generate_content(
+                topic_prompt, generation_config=routed_generation_config(route)
+            )
+            router.observe(route, finish_reason(topic_response) == 'MAX_TOKENS')
+
+            # Parse the response to get image topics
+            if hasattr(topic_response, 'text'):
+                image_topics = [topic.strip() for topic in topic_response.text.strip().split(',') if topic.strip()]
+                if image_topics:
+                    print(f"Generated image topics: {image_topics}")
+                    return image_topics[:max_topics]
+        except Exception as e:
+            print(f"Error generating image topics: {str(e)}")
+
+    image_topics = extract_topics(text, max_topics=max_topics)
+    print(f"Extracted image topics: {image_topics}")
+    return image_topics
+
+def sse_event(payload):
+    return f"data: {json.dumps(payload)}\n\n"
+
+def wants_timings(data):
+    """
+    Whether the client asked for a trailing timings event (optional timings field)
+    """
+    return bool((data or {}).get('timings'))
+
+def server_timing_headers(timer):
+    """
+    Server-Timing header for the phases that finished before the response started
+    """
+    return {'Server-Timing': timer.server_timing()} if timer.phases else {}
+
+def event_stream_response(frames, headers=None):
+    """
+    Wrap SSE frames in a streaming Response, gzipped when SSE_GZIP is on and the client accepts it
+    """
+    headers = dict(headers or {})
+    if SSE_GZIP and accepts_gzip(request.headers.get('Accept-Encoding')):
+        frames = gzip_frames(frames)
+        headers.update({'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'})
+    return Response(frames, mimetype='text/event-stream', headers=headers)
+
+def get_response_mode(data):
+    """
+    Read the optional responseMode field, returning None if it isn't supported
+    """
+    response_mode = (data or {}).get('responseMode', 'raw')
+    return response_mode if response_mode in RESPONSE_MODES else None
+
+def stream_response(response, response_mode='raw', site_id=None, timer=None, emit_timings=False, continue_with=None,
+                    cache_as=None):
+    """
+    Relay a Gemini stream as SSE (see stream_text). With continue_with (see
+    continuation_request), output that is cut short is continued in the same stream.
+    """
+    texts = gemini_texts(response, timer, continue_with)
+    # Ticks let coalesced text go out on time while the model is slow to send the next chunk
+    texts = with_ticks(texts, SSE_FLUSH_INTERVAL if SSE_COALESCE_BYTES else None)
+    return stream_text(texts, response_mode, site_id, timer, emit_timings, cache_as)
+
+def gemini_texts(response, timer=None, continue_with=None):
+    """
+    Texts of a Gemini stream, continued while the output is cut short if continue_with is given
+    """
+    if continue_with and MAX_CONTINUATIONS:
+        stitcher = Stitcher(MAX_CONTINUATIONS, CONTINUATION_TAIL_CHARS, timer.endpoint if timer else 'stream')
+        return continued_texts(response, stitcher, continue_with)
+    return (chunk.text for chunk in response if hasattr(chunk, 'text'))
+
+def open_gemini_stream(prompt, route, endpoint):
+    """
+    Start a streaming Gemini call on the route's model, hedged when HEDGING is on.
+    Whether it stops at the route's budget is reported back to the router.
+    """
+    generation_config = routed_generation_config(route)
+    start = lambda: get_model(route.model).generate_content(prompt, generation_config=generation_config, stream=True)
+    response = hedged(start, hedge_policy, endpoint) if hedge_policy else start()
+    return observed(response, router, route)
+
+def continuation_request(prompt, route):
+    """
+    Start a Gemini stream that carries on from the tail of a cut-off output
+    """
+    generation_config = routed_generation_config(route)
+    return lambda tail: get_model(route.model).generate_content(
+        build_continuation_prompt(prompt, tail), generation_config=generation_config, stream=True
+    )
+
+class StreamEncoder:
+    """
+    Turns generated text into SSE frames. 'raw' forwards each text chunk
+    as-is, 'sections' parses the code fences on the server and sends typed
+    section_start / delta / section_end events instead.
+
+    On close the parsed site is saved to the artifact store (as a new
+    version of site_id if given, and kept as `site`) and announced in a
+    final siteId event, so later modifications can refer to it. Both the WSGI generators and the
+    ASGI handlers (asgi.py) push text through this class.
+
+    Text is coalesced into fewer events (see FrameCoalescer), so feed() may
+    return nothing; flush() sends whatever is pending.
+
+    Chunk timings, chunk and byte counts are recorded against the request's
+    timer (see metrics.py). With emit_timings the per-phase timings are sent
+    as a last timings event.
+
+    Events are written as SSE frames unless another `encode` is given (the
+    batch endpoint writes NDJSON lines).
+
+    With cache_as=(kind, description), a generation that ends with all its
+    code blocks closed is added to the generation cache.
+
+    With STREAM_MINIFY on, text goes through a FencedMinifier on its way to
+    the client, and a minified event before siteId reports the bytes saved
+    and the time spent. The artifact (and so the base that later patches
+    must match) is saved from the text as generated.
+    """
+
+    def __init__(self, response_mode='raw', site_id=None, timer=None, emit_timings=False, encode=sse_event,
+                 cache_as=None):
+        self.response_mode = response_mode
+        self.encode = encode
+        self.cache_as = cache_as
+        self.site_id = site_id
+        self.site = None  # the artifact record saved on close
+        self.timer = timer or RequestTimer('stream')
+        self.emit_timings = emit_timings
+        self.parser = FenceParser()
+        self.minifier = FencedMinifier() if STREAM_MINIFY else None
+        self.coalescer = FrameCoalescer(SSE_COALESCE_BYTES, SSE_FLUSH_INTERVAL)
+        self.sections = {}
+        # Sections of the text as generated, which only differ from what the client gets when it is minified
+        self.source = FenceParser() if self.minifier else None
+        self.source_sections = {} if self.minifier else self.sections
+        self.last_chunk_at = None
+
+    @property
+    def pending(self):
+        return bool(self.coalescer.pending)
+
+    def feed(self, text):
+        self._observe_chunk()
+        if self.minifier:
+            collect_sections(self.source.feed(text), self.source_sections)
+            text = self.minifier.feed(text)
+        self._add(text)
+        now = time.perf_counter()
+        return self.flush() if self.coalescer.due(now) else []
+
+    def flush(self):
+        return self._count([self.encode(event) for event in self.coalescer.flush()])
+
+    def close(self):
+        if self.minifier:
+            self._add(self.minifier.close())
+            collect_sections(self.source.close(), self.source_sections)
+        complete = not self.parser.unterminated
+        events = self.parser.close()
+        collect_sections(events, self.sections)
+        if self.response_mode == 'sections':
+            for event in events:
+                self.coalescer.add(event, time.perf_counter())
+        frames = [self.encode(event) for event in self.coalescer.flush()]
+        if self.minifier:
+            frames.append(self.encode({'minified': self._minify_report()}))
+
+        if self.source_sections.get('html', '').strip():
+            site = self.site = artifact_store.save(
+                self.source_sections['html'].strip(),
+                self.source_sections.get('css', '').strip(),
+                self.source_sections.get('js', '').strip(),
+                self.site_id
+            )
+            frames.append(self.encode({'siteId': site['site_id'], 'contentHash': site['content_hash'], 'version': site['version']}))
+            if self.cache_as and complete and generation_cache is not None:
+                kind, description = self.cache_as
+                generation_cache.add(kind, description, site)
+
+        duration = self.timer.since('gemini_call')
+        STREAM_SECONDS.observe(duration, endpoint=self.timer.endpoint)
+        self.timer.record('stream', duration, observe=False)
+        if self.emit_timings:
+            frames.append(self.encode({'timings': self.timer.as_dict()}))
+        return self._count(frames)
+
+    def fail(self, error):
+        print(f"Error in stream_response: {str(error)}")
+        traceback.print_exc()
+        ERRORS.inc(endpoint=self.timer.endpoint, stage='stream')
+        # Text that was already generated still goes out ahead of the error
+        if self.minifier:
+            self._add(self.minifier.close())
+        return self.flush() + self._count([self.encode({'error': str(error)})])
+
+    def _add(self, text):
+        events = self.parser.feed(text)
+        collect_sections(events, self.sections)
+        now = time.perf_counter()
+        for event in events if self.response_mode == 'sections' else [{'text': text}] if text else []:
+            self.coalescer.add(event, now)
+
+    def _minify_report(self):
+        minifier = self.minifier
+        saved = minifier.bytes_in - minifier.bytes_out
+        MINIFIED_BYTES_SAVED.inc(saved, endpoint=self.timer.endpoint)
+        self.timer.record('minify', minifier.seconds)
+        print(f"Minified stream from {minifier.bytes_in} to {minifier.bytes_out} bytes "
+              f"in {round(minifier.seconds * 1000, 1)}ms")
+        return {
+            'bytesIn': minifier.bytes_in,
+            'bytesOut': minifier.bytes_out,
+            'savedPct': round(saved / minifier.bytes_in * 100, 1) if minifier.bytes_in else 0.0,
+            'ms': round(minifier.seconds * 1000, 2)
+        }
+
+    def _observe_chunk(self):
+        now = time.perf_counter()
+        endpoint = self.timer.endpoint
+        if self.last_chunk_at is None:
+            first_chunk = self.timer.since('gemini_call')
+            FIRST_CHUNK_SECONDS.observe(first_chunk, endpoint=endpoint)
+            self.timer.record('first_chunk', first_chunk, observe=False)
+            print(f"First Gemini chunk after {round(first_chunk * 1000)}ms")  # Debug log
+        else:
+            CHUNK_GAP_SECONDS.observe(now - self.last_chunk_at, endpoint=endpoint)
+        self.last_chunk_at = now
+        STREAM_CHUNKS.inc(endpoint=endpoint)
+
+    def _count(self, frames):
+        STREAM_FRAMES.inc(len(frames), endpoint=self.timer.endpoint)
+        STREAM_BYTES.inc(sum(len(frame.encode('utf-8')) for frame in frames), endpoint=self.timer.endpoint)
+        return frames
+
+def stream_text(texts, response_mode='raw', site_id=None, timer=None, emit_timings=False, cache_as=None):
+    """
+    Stream generated text as SSE frames (see StreamEncoder)
+    """
+    encoder = StreamEncoder(response_mode, site_id, timer, emit_timings, cache_as=cache_as)
     try:
-        for chunk in response:
-            if hasattr(chunk, 'text'):
-                yield f"data: {json.dumps({'text': chunk.text})}\n\n"
+        for text in texts:
+            # None is a tick from with_ticks: nothing new arrived in time, so send what is pending
+            yield from encoder.flush() if text is None else encoder.feed(text)
+        yield from encoder.close()
     except Exception as e:
-        print(f"Error in stream_response: {str(e)}")
+        yield from encoder.fail(e)
+
+def collect_sections(events, sections):
+    for event in events:
+        if 'delta' in event:
+            sections[event['section']] = sections.get(event['section'], '') + event['delta']
+
+def format_site(sections):
+    """
+    Render a site in the same fenced format the model is asked to produce
+    """
+    return (
+        f"```html\n{sections['html']}\n```\n"
+        f"```css\n{sections['css']}\n```\n"
+        f"```javascript\n{sections['js']}\n```\n"
+    )
+
+def is_application_request(description):
+    """
+    Check if this is a request for a game, simulation, or interactive application rather than a website
+    """
+    application_keywords = [
+        # Games
+        'game', 'snake game', 'tetris', 'puzzle game', 'chess', 'tic tac toe', 'memory game', 'pong',
+        # Physics simulations
+        'simulation', 'physics simulation', 'solar system', 'planetary model', 'physics model',
+        'particle simulation', 'gravity simulation', 'pendulum simulation', 'wave simulation',
+        # Interactive models
+        'interactive model', '3d model', 'interactive visualization', 'interactive demo',
+        # Other interactive applications
+        'calculator', 'drawing app', 'paint app', 'clock', 'timer', 'stopwatch', 'todo app',
+        'weather app', 'music player', 'drum machine', 'synthesizer', 'piano'
+    ]
+
+    # Action words that indicate the user wants something interactive
+    action_words = ['create', 'make', 'build', 'develop', 'simulate', 'model', 'interactive']
+
+    description_lower = description.lower()
+
+    # Check if the description contains any of the application keywords
+    contains_app_keyword = any(keyword in description_lower for keyword in application_keywords)
+
+    # Check if the description contains action words followed by relevant terms
+    contains_action_phrase = False
+    for action in action_words:
+        if action in description_lower:
+            # Look for phrases like "create a solar system" or "build a physics model"
+            action_index = description_lower.find(action)
+            after_action = description_lower[action_index + len(action):]
+            if any(keyword in after_action for keyword in ['simulation', 'model', 'system', 'visualization', 'interactive']):
+                contains_action_phrase = True
+                break
+
+    # The description explicitly asks for an interactive application and doesn't mention 'website'
+    return (contains_app_keyword or contains_action_phrase) and 'website' not in description_lower
+
+def choose_image_topics(description):
+    """
+    Pick 3-5 image topics for a new website, padded with general topics if needed
+    """
+    # Extract relevant image topics from the description
+    image_topics = get_image_topics(description, max_topics=5, topic_prompt=f"""
+    Based on this website description: "{description}"
+
+    Extract 3-5 specific keywords that would make good search terms for relevant images.
+    Focus on concrete objects, scenes, or themes that would be visually represented on the website.
+
+    Return only a comma-separated list of single words or short phrases, nothing else.
+    Example: "mountains, hiking, adventure gear, camping, nature"
+    """)
+
+    # Add some general topics based on common website needs if we don't have enough
+    if not image_topics:
+        general_topics = ['business', 'nature', 'technology', 'people', 'food']
+        image_topics = random.sample(general_topics, 3)
+    elif len(image_topics) < 3:
+        general_topics = ['business', 'nature', 'technology', 'people', 'food']
+        additional_topics = random.sample(general_topics, 3 - len(image_topics))
+        image_topics.extend(additional_topics)
+
+    return image_topics
+
+def build_image_references(image_data, intro):
+    """
+    Describe the fetched images for the prompt
+    """
+    image_references = ""
+    if image_data:
+        image_references = f"\n{intro}\n"
+        for i, data in enumerate(image_data):
+            topic = data['image'].get('topic', 'general')
+            image_references += f"Image {i+1} (Topic: {topic}):\n"
+            image_references += f"- Small (recommended): {data['image']['url']}\n"
+            image_references += f"- Thumbnail: {data['image']['thumb_url']}\n"
+            image_references += f"- Regular: {data['image']['regular_url']}\n"
+            image_references += f"Description: {data['image']['alt']}\n"
+            image_references += f"Credit: {data['image']['credit']}\n\n"
+    return image_references
+
+def build_website_prompt(description, image_references):
+    # Prompt engineering for website generation
+    prompt = f"""
+    Create a website based on this description: {description}
+
+    {image_references}
+
+    IMPORTANT INSTRUCTIONS FOR IMAGES:
+    1. Instead of using placeholder images or lorem ipsum, use the provided Unsplash images.
+    2. Match each image to the most appropriate section of the website based on its topic and description.
+    3. Make sure to include the photographer credit in the website footer or directly below/near each image.
+    4. Use the images in a way that enhances the website's content and purpose.
+    5. ALWAYS include CSS for ALL images to ensure they are responsive and properly sized with these rules:
+       - Set max-width: 100% and height: auto on all images
+       - Add display: block and appropriate margins
+       - Limit content images to max-width: 600px
+       - Add a photo-credit class with smaller font size (12px) and italic style
+    6. Keep images reasonably sized - use the small or thumbnail versions when appropriate.
+    7. If you need additional images beyond what's provided, use descriptive alt text instead of placeholder URLs.
+
+    Return only the HTML, CSS, and JavaScript code without any explanations.
+    Format the response exactly as:
+    ```html
+    [HTML code here]
+    ```
+    ```css
+    [CSS code here]
+    ```
+    ```javascript
+    [JavaScript code here]
+    ```
+    Make sure the code is complete, functional, and properly handles user interactions.
+    The JavaScript code should be properly scoped and not interfere with the parent window.
+    """
+    return prompt
+
+def website_route(description):
+    return router.route('website', estimate_tokens(description), temperature=0.7, top_p=0.8, top_k=40)
+
+single_flight = SingleFlight(
+    error_frame=lambda e: sse_event({'error': str(e)}),
+    replay_store=replay_store,
+    announce=lambda generation_id: sse_event({'generationId': generation_id}),
+    heartbeat=SSE_HEARTBEAT
+)
+
+def stream_pipelined_website(description, response_mode='raw', timer=None):
+    """
+    Generate a website while reporting progress as it goes.
+
+    The client gets an 'accepted' event straight away. Topic and image
+    resolution run in the background under PIPELINE_DEADLINE, and generation
+    starts as soon as they finish or the deadline passes. Every phase emits
+    its own event, and a final 'done' event carries per-phase timings in ms.
+    """
+    started = time.perf_counter()
+    deadline_at = started + PIPELINE_DEADLINE
+    timings = {}
+    timer = timer or RequestTimer('website')
+
+    def elapsed_ms():
+        return round((time.perf_counter() - started) * 1000, 1)
+
+    yield sse_event({'phase': 'accepted', 'elapsed_ms': elapsed_ms()})
+
+    # Topics and images resolve in the background while this generator keeps the stream alive
+    def resolve_images(events):
+        image_topics = choose_image_topics(description)
+        events.put({'phase': 'topics', 'topics': image_topics, 'elapsed_ms': elapsed_ms()})
+        return fetch_images_for_topics(image_topics, deadline=max(0.0, deadline_at - time.perf_counter()))
+
+    events = queue.Queue()
+    resolution = Future()
+
+    def resolve():
+        try:
+            resolution.set_result(resolve_images(events))
+        except Exception as e:
+            resolution.set_exception(e)
+
+    # Not on image_fetch_executor: this waits on lookups queued there, and enough pipelined
+    # requests holding every worker would leave none to run them
+    threading.Thread(target=resolve, name='pipeline-images', daemon=True).start()
+
+    image_data = []
+    while True:
+        remaining = deadline_at - time.perf_counter()
+        try:
+            event = events.get(timeout=min(max(remaining, 0.0), 0.05))
+            timings[event['phase']] = event['elapsed_ms']
+            yield sse_event(event)
+            continue
+        except queue.Empty:
+            pass
+
+        if resolution.done():
+            image_data = resolution.result() or []
+            break
+        if remaining <= 0:
+            print(f"Image resolution missed the {PIPELINE_DEADLINE}s pipeline deadline, generating without images")
+            break
+
+    timings['images'] = elapsed_ms()
+    yield sse_event({'phase': 'images', 'count': len(image_data), 'elapsed_ms': timings['images']})
+
+    image_references = build_image_references(
+        image_data,
+        "Use the following Unsplash images in your website, matching each image to the most appropriate context:"
+    )
+    prompt = build_website_prompt(description, image_references)
+
+    try:
+        timer.mark('gemini_call')
+        route = website_route(description)
+        response = open_gemini_stream(prompt, route, timer.endpoint)
+    except Exception as e:
+        print(f"Error starting pipelined generation: {str(e)}")
         traceback.print_exc()
-        yield f"data: {json.dumps({'error': str(e)})}\n\n"
+        ERRORS.inc(endpoint=timer.endpoint, stage='gemini')
+        yield sse_event({'error': str(e)})
+        return
+
+    timings['generation_started'] = elapsed_ms()
+    yield sse_event({'phase': 'generation_started', 'elapsed_ms': timings['generation_started']})
+
+    continue_with = continuation_request(prompt, route)
+    for frame in stream_response(response, response_mode, timer=timer, continue_with=continue_with,
+                                 cache_as=('website', description)):
+        if 'first_token' not in timings:
+            timings['first_token'] = elapsed_ms()
+            yield sse_event({'phase': 'first_token', 'elapsed_ms': timings['first_token']})
+        yield frame
+
+    timings['done'] = elapsed_ms()
+    print(f"Pipelined generation timings (ms): {timings}")
+    yield sse_event({'phase': 'done', 'timings': timings})
+
+def build_website_request(description, timer=None, image_data=None):
+    """
+    Resolve images and build the prompt and model route for a website.
+    Images that were already looked up (by a batch) can be passed in as image_data.
+    """
+    timer = timer or RequestTimer('website')
+    if image_data is None:
+        with timer.phase('topics'):
+            image_topics = choose_image_topics(description)
+
+        # Fetch images for all topics in parallel
+        with timer.phase('images'):
+            image_data = fetch_images_for_topics(image_topics)
+
+    # Create image references for the prompt
+    with timer.phase('prompt_build'):
+        image_references = build_image_references(
+            image_data,
+            "Use the following Unsplash images in your website, matching each image to the most appropriate context:"
+        )
+        prompt = build_website_prompt(description, image_references)
+
+    return prompt, website_route(description)
+
+def wants_cache(data):
+    """
+    Whether the request may be answered from the generation cache (optional cache field, true by default)
+    """
+    return (data or {}).get('cache', True) is not False
+
+def lookup_generation(kind, description, use_cache, timer):
+    """
+    A cached generation close enough to reuse for this description, or None
+    """
+    if generation_cache is None:
+        return None
+    if not use_cache:
+        GENERATION_CACHE_LOOKUPS.inc(kind=kind, outcome='bypass')
+        return None
+    with timer.phase('cache_lookup'):
+        match = generation_cache.lookup(kind, description)
+    GENERATION_CACHE_LOOKUPS.inc(kind=kind, outcome=GENERATION_CACHE_MODE if match else 'miss')
+    if match:
+        print(f"Generation cache {GENERATION_CACHE_MODE} from '{match['description']}' "
+              f"(similarity {match['similarity']})")  # Debug log
+    return match
+
+def build_seeded_prompt(prompt, match):
+    return f"""{prompt}
+
+    A site was already generated for a similar description: "{match['description']}".
+    Start from its code below and change whatever this description needs:
+{format_site(match['sections'])}
+    """
+
+def replay_generation(match, response_mode, timer=None, emit_timings=False):
+    """
+    Stream a cached generation as if it had just been generated, after a cache event naming its description
+    """
+    yield sse_event({'cache': {'description': match['description'], 'similarity': match['similarity']}})
+    yield from stream_text([format_site(match['sections'])], response_mode, timer=timer, emit_timings=emit_timings)
+
+def prepare_website(description, response_mode, timer=None, emit_timings=False, use_cache=True):
+    """
+    Start the Gemini stream for a website, or replay a cached one for a similar description
+    """
+    timer = timer or RequestTimer('website')
+    match = lookup_generation('website', description, use_cache, timer)
+    if match and GENERATION_CACHE_MODE == 'replay':
+        return replay_generation(match, response_mode, timer, emit_timings)
+
+    prompt, route = build_website_request(description, timer)
+    if match:
+        prompt = build_seeded_prompt(prompt, match)
+
+    print("Sending request to Gemini...")  # Debug log
+
+    timer.mark('gemini_call')
+    response = open_gemini_stream(prompt, route, timer.endpoint)
+
+    # The first chunk is logged by the StreamEncoder when it actually arrives
+    print(f"Gemini stream opened in {round(timer.since('gemini_call') * 1000)}ms")  # Debug log
+
+    return stream_response(
+        response, response_mode, timer=timer, emit_timings=emit_timings,
+        continue_with=continuation_request(prompt, route), cache_as=('website', description)
+    )
+
+def normalize_description(description):
+    """
+    Canonical form of a description for spotting identical requests
+    """
+    return ' '.join(description.lower().split())
+
+def client_id(headers, remote_addr):
+    """
+    The key a client's generations are scheduled under: its ADMISSION_CLIENT_HEADER
+    value, or else the address the outermost of ADMISSION_TRUSTED_PROXIES proxies
+    saw in X-Forwarded-For, or the peer address
+    """
+    if ADMISSION_CLIENT_HEADER and headers.get(ADMISSION_CLIENT_HEADER.lower()):
+        return f"key:{headers.get(ADMISSION_CLIENT_HEADER.lower())}"
+    address = remote_addr
+    if ADMISSION_TRUSTED_PROXIES:
+        # Each proxy appends the address it received from, so entries further left came from the client
+        hops = [hop.strip() for hop in headers.get('x-forwarded-for', '').split(',') if hop.strip()]
+        if len(hops) >= ADMISSION_TRUSTED_PROXIES:
+            address = hops[-ADMISSION_TRUSTED_PROXIES]
+    return f"ip:{address or 'unknown'}"
+
+def is_throttling_error(error):
+    """
+    Whether the model refused a call because we are over its rate limit (HTTP 429, RESOURCE_EXHAUSTED)
+    """
+    return type(error).__name__ in ('ResourceExhausted', 'TooManyRequests') or getattr(error, 'code', None) == 429
+
+def note_throttling(error):
+    if admission is not None and is_throttling_error(error):
+        admission.backoff(GEMINI_THROTTLE_BACKOFF)
+
+def is_overload(error):
+    return isinstance(error, AdmissionRejected) or is_throttling_error(error)
+
+def overload_details(error):
+    """
+    Message and Retry-After seconds for a full admission queue or a throttled model
+    """
+    if isinstance(error, AdmissionRejected):
+        return str(error), error.retry_after
+    return 'The model is busy, please retry shortly', math.ceil(GEMINI_THROTTLE_BACKOFF)
+
+def overload_response(error):
+    """
+    A 429 with Retry-After in place of a 500 with a traceback (see overload_details)
+    """
+    message, retry_after = overload_details(error)
+    print(f"Turning away a generation: {message} (retry after {retry_after}s)")
+    response = jsonify({'error': message, 'retryAfter': retry_after})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
+
+def admitted(prepare, client):
+    """
+    Wrap a generation's prepare() so the model is only called while holding
+    an upstream slot. Raises AdmissionRejected if the wait queue is full. A
+    generation that has to wait streams queue events with its position until
+    it starts, or an error once ADMISSION_MAX_WAIT has passed.
+    """
+    if admission is None:
+        return prepare
+
+    def run():
+        ticket = admission.request(client)
+        if not ticket.admitted:
+            return ticket.holding(queued_frames(ticket, prepare))
+        try:
+            frames = prepare()
+        except Exception as e:
+            ticket.release()
+            note_throttling(e)
+            raise
+        return ticket.holding(frames)
+
+    return run
+
+def queued_frames(ticket, prepare):
+    position = ticket.position
+    yield sse_event({'queue': {'position': position}})
+    while not ticket.wait(0.25):
+        waited = time.monotonic() - ticket.requested_at
+        if waited >= ADMISSION_MAX_WAIT:
+            print(f"Gave up waiting for an upstream slot after {round(waited, 1)}s")
+            yield sse_event({'error': 'Timed out waiting for a free generation slot, please retry'})
+            return
+        if ticket.position != position:
+            position = ticket.position
+            yield sse_event({'queue': {'position': position}})
+    yield sse_event({'queue': {'position': 0, 'waited_ms': round((ticket.admitted_at - ticket.requested_at) * 1000, 1)}})
+    try:
+        frames = prepare()
+    except Exception as e:
+        note_throttling(e)
+        raise
+    yield from frames
+
+def generation_stream(key, prepare):
+    """
+    Run prepare() and return its SSE frames, tagged with event ids and
+    preceded by a generationId event so a dropped client can resume them.
+    With SINGLE_FLIGHT enabled, concurrent requests with the same key share
+    one upstream generation. A key of None is never shared.
+    """
+    return single_flight.run(key if SINGLE_FLIGHT else None, prepare)
 
 @app.route('/api/generate-website', methods=['POST'])
 def generate_website():
+    timer = RequestTimer('website')
+    REQUESTS.inc(endpoint='website')
     try:
         data = request.json
         if not data:
@@ -153,183 +1056,43 @@ def generate_website():
         if not description:
             return jsonify({'error': 'No description provided'}), 400
 
+        response_mode = get_response_mode(data)
+        if not response_mode:
+            return jsonify({'error': f"responseMode must be one of: {', '.join(RESPONSE_MODES)}"}), 400
+
         print(f"Received description: {description}")  # Debug log
 
-        # Check if this is a request for a game, simulation, or interactive application rather than a website
-        application_keywords = [
-            # Games
-            'game', 'snake game', 'tetris', 'puzzle game', 'chess', 'tic tac toe', 'memory game', 'pong',
-            # Physics simulations
-            'simulation', 'physics simulation', 'solar system', 'planetary model', 'physics model',
-            'particle simulation', 'gravity simulation', 'pendulum simulation', 'wave simulation',
-            # Interactive models
-            'interactive model', '3d model', 'interactive visualization', 'interactive demo',
-            # Other interactive applications
-            'calculator', 'drawing app', 'paint app', 'clock', 'timer', 'stopwatch', 'todo app',
-            'weather app', 'music player', 'drum machine', 'synthesizer', 'piano'
-        ]
-
-        # Action words that indicate the user wants something interactive
-        action_words = ['create', 'make', 'build', 'develop', 'simulate', 'model', 'interactive']
-
-        description_lower = description.lower()
-
-        # Check if the description contains any of the application keywords
-        contains_app_keyword = any(keyword in description_lower for keyword in application_keywords)
-
-        # Check if the description contains action words followed by relevant terms
-        contains_action_phrase = False
-        for action in action_words:
-            if action in description_lower:
-                # Look for phrases like "create a solar system" or "build a physics model"
-                action_index = description_lower.find(action)
-                after_action = description_lower[action_index + len(action):]
-                if any(keyword in after_action for keyword in ['simulation', 'model', 'system', 'visualization', 'interactive']):
-                    contains_action_phrase = True
-                    break
-
-        # If the description explicitly asks for an interactive application and doesn't mention 'website'
-        if (contains_app_keyword or contains_action_phrase) and 'website' not in description_lower:
+        with timer.phase('intent'):
+            is_application = is_application_request(description)
+        if is_application:
             print(f"Detected interactive application request: {description}")
-            return generate_application(description)
-
-
-        # Use Gemini to extract relevant image topics from the description
-        topic_prompt = f"""
-        Based on this website description: "{description}"
-
-        Extract 3-5 specific keywords that would make good search terms for relevant images.
-        Focus on concrete objects, scenes, or themes that would be visually represented on the website.
-
-        Return only a comma-separated list of single words or short phrases, nothing else.
-        Example: "mountains, hiking, adventure gear, camping, nature"
-        """
-
-        try:
-            topic_response = model.generate_content(
-                topic_prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=0.2,  # Low temperature for more deterministic results
-                    max_output_tokens=100,
+        if data.get('job'):
+            return submit_job('application' if is_application else 'website', description, response_mode, data)
+        if is_application:
+            return generate_application(description, response_mode, timer)
+
+        # Pipelined mode starts streaming progress events before images are resolved
+        client = client_id(request.headers, request.remote_addr)
+        if data.get('pipelined'):
+            return event_stream_response(
+                generation_stream(
+                    ('pipelined-website', response_mode, normalize_description(description)),
+                    admitted(lambda: stream_pipelined_website(description, response_mode, timer), client)
                 )
             )
 
-            # Parse the response to get image topics
-            if hasattr(topic_response, 'text'):
-                image_topics_text = topic_response.text.strip()
-                image_topics = [topic.strip() for topic in image_topics_text.split(',') if topic.strip()]
-                print(f"Generated image topics: {image_topics}")
-            else:
-                # Fallback to basic keyword extraction
-                image_topics = []
-                keywords = description.split()
-                potential_topics = [word for word in keywords if len(word) > 4]  # Simple heuristic for meaningful words
-
-                # Select up to 3 random topics if we have enough
-                if len(potential_topics) > 3:
-                    image_topics = random.sample(potential_topics, 3)
-                else:
-                    image_topics = potential_topics
-        except Exception as e:
-            print(f"Error generating image topics: {str(e)}")
-            # Fallback to basic extraction
-            image_topics = []
-            keywords = description.split()
-            potential_topics = [word for word in keywords if len(word) > 4]
-            if len(potential_topics) > 3:
-                image_topics = random.sample(potential_topics, 3)
-            else:
-                image_topics = potential_topics
-
-        # Add some general topics based on common website needs if we don't have enough
-        if not image_topics:
-            general_topics = ['business', 'nature', 'technology', 'people', 'food']
-            image_topics = random.sample(general_topics, 3)
-        elif len(image_topics) < 3:
-            general_topics = ['business', 'nature', 'technology', 'people', 'food']
-            additional_topics = random.sample(general_topics, 3 - len(image_topics))
-            image_topics.extend(additional_topics)
-
-        # Fetch images for each topic
-        image_data = []
-        for topic in image_topics:
-            images = get_unsplash_image(topic, 1)
-            if images:
-                image_data.append({
-                    'topic': topic,
-                    'image': images[0]
-                })
-
-        # Create image references for the prompt
-        image_references = ""
-        if image_data:
-            image_references = "\nUse the following Unsplash images in your website, matching each image to the most appropriate context:\n"
-            for i, data in enumerate(image_data):
-                topic = data['image'].get('topic', 'general')
-                image_references += f"Image {i+1} (Topic: {topic}):\n"
-                image_references += f"- Small (recommended): {data['image']['url']}\n"
-                image_references += f"- Thumbnail: {data['image']['thumb_url']}\n"
-                image_references += f"- Regular: {data['image']['regular_url']}\n"
-                image_references += f"Description: {data['image']['alt']}\n"
-                image_references += f"Credit: {data['image']['credit']}\n\n"
-
-        # Use the responsive_image_css defined at the top of the file
-
-        # Prompt engineering for website generation
-        prompt = f"""
-        Create a website based on this description: {description}
-
-        {image_references}
-
-        IMPORTANT INSTRUCTIONS FOR IMAGES:
-        1. Instead of using placeholder images or lorem ipsum, use the provided Unsplash images.
-        2. Match each image to the most appropriate section of the website based on its topic and description.
-        3. Make sure to include the photographer credit in the website footer or directly below/near each image.
-        4. Use the images in a way that enhances the website's content and purpose.
-        5. ALWAYS include CSS for ALL images to ensure they are responsive and properly sized with these rules:
-           - Set max-width: 100% and height: auto on all images
-           - Add display: block and appropriate margins
-           - Limit content images to max-width: 600px
-           - Add a photo-credit class with smaller font size (12px) and italic style
-        6. Keep images reasonably sized - use the small or thumbnail versions when appropriate.
-        7. If you need additional images beyond what's provided, use descriptive alt text instead of placeholder URLs.
-
-        Return only the HTML, CSS, and JavaScript code without any explanations.
-        Format the response exactly as:
-        ```html
-        [HTML code here]
-        ```
-        ```css
-        [CSS code here]
-        ```
-        ```javascript
-        [JavaScript code here]
-        ```
-        Make sure the code is complete, functional, and properly handles user interactions.
-        The JavaScript code should be properly scoped and not interfere with the parent window.
-        """
-
-        print("Sending request to Gemini...")  # Debug log
-
-        response = model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(
-                temperature=0.7,
-                top_p=0.8,
-                top_k=40,
-                max_output_tokens=2048,
-            ),
-            stream=True
-        )
-
-        print("Received response from Gemini")  # Debug log
-
-        return Response(
-            stream_response(response),
-            mimetype='text/event-stream'
+        emit_timings = wants_timings(data)
+        use_cache = wants_cache(data)
+        stream = generation_stream(
+            ('website', response_mode, emit_timings, use_cache, normalize_description(description)),
+            admitted(lambda: prepare_website(description, response_mode, timer, emit_timings, use_cache), client)
         )
+        return event_stream_response(stream, server_timing_headers(timer))
 
     except Exception as e:
+        if is_overload(e):
+            return overload_response(e)
+        ERRORS.inc(endpoint=timer.endpoint, stage='request')
         print(f"Error in generate_website: {str(e)}")
         traceback.print_exc()
         return jsonify({
@@ -337,8 +1100,244 @@ def generate_website():
             'traceback': traceback.format_exc()
         }), 500
 
+def build_modify_prompt(modification, current_html, current_css, current_js, image_references):
+    # Reuse the responsive image CSS from above
+    prompt = f"""
+    Modify this website according to this description: {modification}
+
+    Current HTML:
+    ```html
+    {current_html}
+    ```
+
+    Current CSS:
+    ```css
+    {current_css}
+    ```
+
+    Current JavaScript:
+    ```javascript
+    {current_js}
+    ```
+
+    {image_references}
+
+    IMPORTANT INSTRUCTIONS FOR IMAGES:
+    1. Preserve all existing Unsplash image credits and attributions in the current website
+    2. If adding new images, use the provided Unsplash images with proper attribution
+    3. Match each new image to the most appropriate section based on its topic and description
+    4. Include the photographer credit directly below/near each image or in the footer
+    5. Only replace existing images if specifically requested in the modification
+    6. Use the images in a way that enhances the website's content and purpose
+    7. ALWAYS include CSS for ALL images to ensure they are responsive and properly sized with these rules:
+       - Set max-width: 100% and height: auto on all images
+       - Add display: block and appropriate margins
+       - Limit content images to max-width: 600px
+       - Add a photo-credit class with smaller font size (12px) and italic style
+    8. Keep images reasonably sized - use the small or thumbnail versions when appropriate
+    9. If you need additional images beyond what's provided, use descriptive alt text instead of placeholder URLs
+
+    Return only the modified HTML, CSS, and JavaScript code without any explanations.
+    Format the response exactly as:
+    ```html
+    [Modified HTML code here]
+    ```
+    ```css
+    [Modified CSS code here]
+    ```
+    ```javascript
+    [Modified JavaScript code here]
+    ```
+    Make sure the code is complete, functional, and properly handles user interactions.
+    The JavaScript code should be properly scoped and not interfere with the parent window.
+    """
+    return prompt
+
+def build_patch_prompt(modification, site, image_references):
+    """
+    Ask for targeted SEARCH/REPLACE edits instead of the whole site
+    """
+    prompt = f"""
+    Modify this website according to this description: {modification}
+
+    Current HTML:
+    ```html
+    {site['html']}
+    ```
+
+    Current CSS:
+    ```css
+    {site['css']}
+    ```
+
+    Current JavaScript:
+    ```javascript
+    {site['js']}
+    ```
+
+    {image_references}
+
+    IMPORTANT INSTRUCTIONS:
+    1. Do NOT return the whole website. Return only the edits needed, as SEARCH/REPLACE blocks.
+    2. Each block must use exactly this format, where SECTION is html, css or javascript:
+    <<<<<<< SEARCH SECTION
+    [exact lines copied from the current code]
+    =======
+    [the lines that replace them]
+    >>>>>>> REPLACE
+    3. The SEARCH part must match the current code exactly, including indentation, and be unique.
+       Include a few surrounding lines if needed to make it unique.
+    4. To add code at the end of a section, leave the SEARCH part empty.
+    5. Preserve all existing Unsplash image credits and attributions.
+    6. If adding new images, use the provided Unsplash images and include the photographer credit near each image.
+    7. Return nothing except the SEARCH/REPLACE blocks.
+    """
+    return prompt
+
+def compact_modify_inputs(html, css, js):
+    """
+    Minify the current site for a modify prompt, with token estimates before and after
+    """
+    if COMPACT_PROMPTS:
+        return compact_site(html, css, js)
+    tokens = estimate_tokens((html or '') + (css or '') + (js or ''))
+    chars = sum(len(part or '') for part in (html, css, js))
+    return {'html': html or '', 'css': css or '', 'js': js or '', 'stats': {
+        'original_chars': chars, 'compacted_chars': chars,
+        'original_tokens': tokens, 'compacted_tokens': tokens, 'saved_pct': 0.0
+    }}
+
+def modify_output_budget(site_tokens):
+    """
+    Output tokens a full regeneration needs at least, for a site of this size (see routing.py)
+    """
+    return router.base_budget('modify', site_tokens)
+
+def check_modify_size(site_tokens, full_regeneration):
+    """
+    Return an error message if a site is too large to modify, otherwise None
+    """
+    if site_tokens > MODIFY_MAX_INPUT_TOKENS:
+        return f"Site is too large to modify (about {site_tokens} tokens, the limit is {MODIFY_MAX_INPUT_TOKENS})"
+    if full_regeneration and modify_output_budget(site_tokens) > MODIFY_MAX_OUTPUT_TOKENS:
+        return (f"Site is too large to regenerate in one response (about {site_tokens} tokens). "
+                "Modify it by siteId with editMode 'patch' instead.")
+    return None
+
+def build_compacted_modify_request(modification, compacted, image_references, timer):
+    """
+    Build the full-regeneration prompt from a compacted site, and report the savings
+    """
+    stats = compacted['stats']
+    route = router.route(
+        'modify', stats['compacted_tokens'], ceiling=MODIFY_MAX_OUTPUT_TOKENS, temperature=0.7, top_p=0.8, top_k=40
+    )
+    max_output_tokens = route.max_output_tokens
+    with timer.phase('prompt_build'):
+        prompt = build_modify_prompt(modification, compacted['html'], compacted['css'], compacted['js'], image_references)
+
+    PROMPT_CHARS_SAVED.inc(stats['original_chars'] - stats['compacted_chars'], endpoint=timer.endpoint)
+    print(f"Compacted site from ~{stats['original_tokens']} to ~{stats['compacted_tokens']} tokens "
+          f"({stats['saved_pct']}% saved), output budget {max_output_tokens}")
+    event = sse_event({
+        'phase': 'compacted',
+        'originalTokens': stats['original_tokens'],
+        'compactedTokens': stats['compacted_tokens'],
+        'savedPct': stats['saved_pct'],
+        'maxOutputTokens': max_output_tokens
+    })
+    return prompt, route, event
+
+def patch_route(site):
+    return router.route(
+        'patch', estimate_tokens(site['html'] + site['css'] + site['js']),
+        temperature=0.2  # Edits need to copy the current code exactly
+    )
+
+def build_modification_image_references(modification, timer=None):
+    """
+    Fetch images for a modification request and describe them for the prompt
+    """
+    timer = timer or RequestTimer('modify')
+    # Extract relevant image topics from the modification request
+    with timer.phase('topics'):
+        image_topics = get_image_topics(modification, max_topics=3, topic_prompt=f"""
+    Based on this website modification request: "{modification}"
+
+    Extract 2-3 specific keywords that would make good search terms for relevant images.
+    Focus on concrete objects, scenes, or themes that would be visually represented on the website.
+
+    Return only a comma-separated list of single words or short phrases, nothing else.
+    Example: "mountains, hiking, adventure gear"
+    """)
+
+    # Fetch images for all topics in parallel
+    with timer.phase('images'):
+        image_data = fetch_images_for_topics(image_topics)
+
+    # Create image references for the prompt
+    return build_image_references(
+        image_data,
+        "You can use these additional Unsplash images in your modifications, matching each image to the most appropriate context:"
+    )
+
+def stream_patched_site(site, modification, image_references, response_mode, timer=None, emit_timings=False):
+    """
+    Modify a stored site by asking the model for a patch and applying it.
+    The patched site is streamed in full, like a regular generation.
+    Falls back to full regeneration if the patch doesn't apply.
+    """
+    started = time.perf_counter()
+    timer = timer or RequestTimer('modify')
+    yield sse_event({'phase': 'patching', 'siteId': site['site_id']})
+
+    try:
+        timer.mark('gemini_call')
+        response = open_gemini_stream(
+            build_patch_prompt(modification, site, image_references), patch_route(site), timer.endpoint
+        )
+        parts, reason = [], None
+        for chunk in response:
+            reason = finish_reason(chunk) or reason
+            parts.append(chunk_text(chunk))
+        sections, edit_count = apply_patch(site, complete_patch(''.join(parts), reason))
+    except PatchError as e:
+        print(f"Patch for site {site['site_id']} did not apply, regenerating: {str(e)}")
+        ERRORS.inc(endpoint=timer.endpoint, stage='patch')
+        yield sse_event({'phase': 'patch_failed', 'reason': str(e)})
+
+        compacted = compact_modify_inputs(site['html'], site['css'], site['js'])
+        size_error = check_modify_size(compacted['stats']['compacted_tokens'], full_regeneration=True)
+        if size_error:
+            yield sse_event({'error': size_error})
+            return
+        prompt, route, compaction_event = build_compacted_modify_request(
+            modification, compacted, image_references, timer
+        )
+        yield compaction_event
+        timer.mark('gemini_call')
+        response = open_gemini_stream(prompt, route, timer.endpoint)
+        yield from stream_response(
+            response, response_mode, site['site_id'], timer, emit_timings, continuation_request(prompt, route)
+        )
+        return
+    except Exception as e:
+        print(f"Error in stream_patched_site: {str(e)}")
+        traceback.print_exc()
+        ERRORS.inc(endpoint=timer.endpoint, stage='gemini')
+        yield sse_event({'error': str(e)})
+        return
+
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+    timer.record('patch', time.perf_counter() - started)
+    print(f"Applied {edit_count} edit(s) to site {site['site_id']} in {elapsed_ms}ms")
+    yield sse_event({'phase': 'patch_applied', 'edits': edit_count, 'elapsed_ms': elapsed_ms})
+    yield from stream_text([format_site(sections)], response_mode, site['site_id'], timer, emit_timings)
+
 @app.route('/api/modify-website', methods=['POST'])
 def modify_website():
+    timer = RequestTimer('modify')
+    REQUESTS.inc(endpoint='modify')
     try:
         data = request.json
         if not data:
@@ -349,147 +1348,73 @@ def modify_website():
         current_css = data.get('currentCss')
         current_js = data.get('currentJs', '')  # Optional JavaScript code
 
-        if not all([modification, current_html, current_css]):
+        # A siteId refers to a site stored by an earlier generation, so the code doesn't need re-uploading
+        site_id = data.get('siteId')
+        site = None
+        if site_id and not current_html:
+            site = artifact_store.get(site_id)
+            if site is None:
+                return jsonify({'error': 'Unknown or expired siteId'}), 404
+            if not modification:
+                return jsonify({'error': 'Missing required fields'}), 400
+        elif not all([modification, current_html, current_css]):
             return jsonify({'error': 'Missing required fields'}), 400
 
-        # Use Gemini to extract relevant image topics from the modification request
-        topic_prompt = f"""
-        Based on this website modification request: "{modification}"
-
-        Extract 2-3 specific keywords that would make good search terms for relevant images.
-        Focus on concrete objects, scenes, or themes that would be visually represented on the website.
+        response_mode = get_response_mode(data)
+        if not response_mode:
+            return jsonify({'error': f"responseMode must be one of: {', '.join(RESPONSE_MODES)}"}), 400
 
-        Return only a comma-separated list of single words or short phrases, nothing else.
-        Example: "mountains, hiking, adventure gear"
-        """
-
-        try:
-            topic_response = model.generate_content(
-                topic_prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=0.2,  # Low temperature for more deterministic results
-                    max_output_tokens=100,
-                )
+        # Oversized sites are rejected before any image lookup or model call
+        patch_mode = site is not None and data.get('editMode', 'patch') == 'patch'
+        if patch_mode:
+            # Patches must quote the stored code exactly, so the site goes into the prompt as it is
+            size_error = check_modify_size(estimate_tokens(site['html'] + site['css'] + site['js']), False)
+        else:
+            if site is not None:
+                current_html, current_css, current_js = site['html'], site['css'], site['js']
+            with timer.phase('compaction'):
+                compacted = compact_modify_inputs(current_html, current_css, current_js)
+            size_error = check_modify_size(compacted['stats']['compacted_tokens'], full_regeneration=True)
+        if size_error:
+            return jsonify({'error': size_error}), 413
+
+        image_references = build_modification_image_references(modification, timer)
+        emit_timings = wants_timings(data)
+
+        client = client_id(request.headers, request.remote_addr)
+
+        if patch_mode:
+            return event_stream_response(
+                generation_stream(
+                    None, admitted(
+                        lambda: stream_patched_site(site, modification, image_references, response_mode, timer, emit_timings),
+                        client
+                    )
+                ),
+                server_timing_headers(timer)
             )
 
-            # Parse the response to get image topics
-            if hasattr(topic_response, 'text'):
-                image_topics_text = topic_response.text.strip()
-                image_topics = [topic.strip() for topic in image_topics_text.split(',') if topic.strip()]
-                print(f"Generated image topics for modification: {image_topics}")
-            else:
-                # Fallback to basic keyword extraction
-                image_topics = []
-                keywords = modification.split()
-                potential_topics = [word for word in keywords if len(word) > 4]  # Simple heuristic for meaningful words
-
-                # Select up to 2 random topics if we have enough
-                if len(potential_topics) > 2:
-                    image_topics = random.sample(potential_topics, 2)
-                else:
-                    image_topics = potential_topics
-        except Exception as e:
-            print(f"Error generating image topics for modification: {str(e)}")
-            # Fallback to basic extraction
-            image_topics = []
-            keywords = modification.split()
-            potential_topics = [word for word in keywords if len(word) > 4]
-            if len(potential_topics) > 2:
-                image_topics = random.sample(potential_topics, 2)
-            else:
-                image_topics = potential_topics
-
-        # Fetch images for each topic
-        image_data = []
-        for topic in image_topics:
-            images = get_unsplash_image(topic, 1)
-            if images:
-                image_data.append({
-                    'topic': topic,
-                    'image': images[0]
-                })
-
-        # Create image references for the prompt
-        image_references = ""
-        if image_data:
-            image_references = "\nYou can use these additional Unsplash images in your modifications, matching each image to the most appropriate context:\n"
-            for i, data in enumerate(image_data):
-                topic = data['image'].get('topic', 'general')
-                image_references += f"Image {i+1} (Topic: {topic}):\n"
-                image_references += f"- Small (recommended): {data['image']['url']}\n"
-                image_references += f"- Thumbnail: {data['image']['thumb_url']}\n"
-                image_references += f"- Regular: {data['image']['regular_url']}\n"
-                image_references += f"Description: {data['image']['alt']}\n"
-                image_references += f"Credit: {data['image']['credit']}\n\n"
-
-        # Reuse the responsive image CSS from above
-        prompt = f"""
-        Modify this website according to this description: {modification}
-
-        Current HTML:
-        ```html
-        {current_html}
-        ```
-
-        Current CSS:
-        ```css
-        {current_css}
-        ```
-
-        Current JavaScript:
-        ```javascript
-        {current_js}
-        ```
-
-        {image_references}
-
-        IMPORTANT INSTRUCTIONS FOR IMAGES:
-        1. Preserve all existing Unsplash image credits and attributions in the current website
-        2. If adding new images, use the provided Unsplash images with proper attribution
-        3. Match each new image to the most appropriate section based on its topic and description
-        4. Include the photographer credit directly below/near each image or in the footer
-        5. Only replace existing images if specifically requested in the modification
-        6. Use the images in a way that enhances the website's content and purpose
-        7. ALWAYS include CSS for ALL images to ensure they are responsive and properly sized with these rules:
-           - Set max-width: 100% and height: auto on all images
-           - Add display: block and appropriate margins
-           - Limit content images to max-width: 600px
-           - Add a photo-credit class with smaller font size (12px) and italic style
-        8. Keep images reasonably sized - use the small or thumbnail versions when appropriate
-        9. If you need additional images beyond what's provided, use descriptive alt text instead of placeholder URLs
-
-        Return only the modified HTML, CSS, and JavaScript code without any explanations.
-        Format the response exactly as:
-        ```html
-        [Modified HTML code here]
-        ```
-        ```css
-        [Modified CSS code here]
-        ```
-        ```javascript
-        [Modified JavaScript code here]
-        ```
-        Make sure the code is complete, functional, and properly handles user interactions.
-        The JavaScript code should be properly scoped and not interfere with the parent window.
-        """
+        if site is None and site_id and artifact_store.get(site_id) is None:
+            # Only ever update sites this server created
+            site_id = None
 
-        response = model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(
-                temperature=0.7,
-                top_p=0.8,
-                top_k=40,
-                max_output_tokens=2048,
-            ),
-            stream=True
+        prompt, route, compaction_event = build_compacted_modify_request(
+            modification, compacted, image_references, timer
         )
 
-        return Response(
-            stream_response(response),
-            mimetype='text/event-stream'
-        )
+        def prepare():
+            timer.mark('gemini_call')
+            response = open_gemini_stream(prompt, route, timer.endpoint)
+            return chain([compaction_event], stream_response(
+                response, response_mode, site_id, timer, emit_timings, continuation_request(prompt, route)
+            ))
+
+        return event_stream_response(generation_stream(None, admitted(prepare, client)), server_timing_headers(timer))
 
     except Exception as e:
+        if is_overload(e):
+            return overload_response(e)
+        ERRORS.inc(endpoint=timer.endpoint, stage='request')
         print(f"Error in modify_website: {str(e)}")
         traceback.print_exc()
         return jsonify({
@@ -521,8 +1446,191 @@ def get_unsplash_images():
             'traceback': traceback.format_exc()
         }), 500
 
+@app.route('/api/health', methods=['GET'])
+def health():
+    # Clients that haven't been used yet are reported as such rather than created here
+    unsplash = unsplash_client.snapshot() if unsplash_client else None
+    return jsonify({
+        # Image lookups are best effort, so an open circuit degrades rather than fails the service
+        'status': 'ok' if unsplash is None or unsplash['circuit']['state'] == 'closed' else 'degraded',
+        'clients': {'gemini': model is not None, 'unsplash': unsplash_client is not None},
+        'image_cache': image_cache.stats(),
+        'image_catalog': dict(image_catalog.stats(), source=IMAGE_SOURCE) if image_catalog else {'source': IMAGE_SOURCE},
+        'unsplash': unsplash,
+        'single_flight': single_flight.stats(),
+        'replay': replay_store.stats(),
+        'artifacts': artifact_store.stats(),
+        'admission': admission.stats() if admission else None,
+        'hedging': hedge_policy.snapshot() if hedge_policy else None,
+        'routing': router.snapshot(),
+        'generation_cache': dict(generation_cache.stats(), mode=GENERATION_CACHE_MODE) if generation_cache else {'mode': GENERATION_CACHE_MODE},
+        'jobs': job_queue.stats()
+    })
+
+@app.route('/api/warmup', methods=['GET', 'POST'])
+def warmup():
+    """
+    Create the Gemini and Unsplash clients ahead of the first real request,
+    e.g. from a deploy hook or a scheduled ping after a cold start
+    """
+    timings = {}
+    errors = {}
+    for name, initialize in (('gemini', get_model), ('unsplash', get_unsplash_client)):
+        started = time.perf_counter()
+        try:
+            initialize()
+        except Exception as e:
+            print(f"Error warming up the {name} client: {str(e)}")
+            traceback.print_exc()
+            errors[name] = str(e)
+        timings[name] = round((time.perf_counter() - started) * 1000, 1)
+
+    body = {'status': 'error' if errors else 'ok', 'timings_ms': timings}
+    if errors:
+        body['errors'] = errors
+    return jsonify(body), 500 if errors else 200
+
+@app.route('/api/streams/<generation_id>', methods=['GET'])
+def resume_stream(generation_id):
+    """
+    Resume a generation after the Last-Event-ID header (or lastEventId query
+    parameter) without calling the model again. The generation may still be running.
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('lastEventId') or '0'
+    try:
+        last_event_id = int(last_event_id)
+    except ValueError:
+        return jsonify({'error': 'Last-Event-ID must be an integer'}), 400
+
+    broadcast = replay_store.get(generation_id)
+    if broadcast is None:
+        return jsonify({'error': 'Unknown or expired generation'}), 404
+    if not broadcast.can_resume(last_event_id):
+        # The frames after last_event_id were already dropped from the replay buffer
+        return jsonify({'error': 'Stream can no longer be resumed from this event'}), 410
+
+    print(f"Resuming generation {generation_id} after event {last_event_id}")
+    return event_stream_response(broadcast.subscribe(last_event_id, SSE_HEARTBEAT))
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """
+    Latency histograms and counters in the Prometheus text format
+    """
+    return Response(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def build_application_request(description, timer=None):
+    """
+    Build the prompt and model route for a game, simulation or interactive application
+    """
+    print(f"Generating application: {description}")  # Debug log
+    timer = timer or RequestTimer('application')
+    started = time.perf_counter()
+
+    # Determine the type of application being requested
+    description_lower = description.lower()
+    is_game = any(keyword in description_lower for keyword in ['game', 'tetris', 'chess', 'tic tac toe', 'pong'])
+    is_simulation = any(keyword in description_lower for keyword in ['simulation', 'solar system', 'physics', 'model'])
+
+    # Customize the prompt based on the type of application
+    specific_instructions = ""
+    if is_game:
+        specific_instructions = """
+        For this game:
+        - Include proper game mechanics, scoring, and win/lose conditions
+        - Add keyboard/mouse controls that are intuitive and responsive
+        - Include game state management (start, pause, restart, game over)
+        - Add sound effects if appropriate (with mute option)
+        """
+    elif is_simulation:
+        specific_instructions = """
+        For this simulation:
+        - Create a visually accurate and scientifically correct simulation
+        - Use appropriate physics formulas and calculations
+        - Add interactive controls to adjust parameters (speed, gravity, etc.)
+        - Include animations that accurately represent the physical phenomena
+        - For solar system or planetary models, use correct relative sizes and orbital mechanics
+        - Add informational tooltips or labels to explain what's happening
+        """
+    else:  # General interactive application
+        specific_instructions = """
+        For this interactive application:
+        - Create a clean, intuitive user interface
+        - Ensure all interactive elements work correctly
+        - Add appropriate feedback for user actions
+        - Include error handling for invalid inputs
+        - Make sure the application state is maintained correctly
+        """
+
+    # Prompt engineering for application/game/simulation generation
+    prompt = f"""
+    Create a standalone, functional {description} using HTML, CSS, and JavaScript.
+
+    IMPORTANT INSTRUCTIONS:
+    1. Focus on creating a WORKING, INTERACTIVE application, not just a website about it.
+    2. The JavaScript should contain all the application logic and functionality.
+    3. Use canvas for graphics if appropriate for the application.
+    4. Include clear instructions for the user on how to use the application.
+    5. Make sure the code is complete, functional, and properly handles user interactions.
+    6. The application should work entirely in the browser without requiring any server-side code.
+    7. The JavaScript code should be properly scoped and not interfere with the parent window.
+    8. Do not include any placeholder functionality - everything should actually work.
+    9. Use requestAnimationFrame for smooth animations where appropriate.
+    10. Ensure the application is responsive and works on different screen sizes.
+
+    {specific_instructions}
+
+    Return only the HTML, CSS, and JavaScript code without any explanations.
+    Format the response exactly as:
+    ```html
+    [HTML code here]
+    ```
+    ```css
+    [CSS code here]
+    ```
+    ```javascript
+    [JavaScript code here]
+    ```
+    """
+
+    # Simulations get the largest budget, since they tend to need more complex code (see routing.py)
+    task = 'simulation' if is_simulation else 'game' if is_game else 'application'
+    route = router.route(task, estimate_tokens(description), temperature=0.7, top_p=0.8, top_k=40)
+    timer.record('prompt_build', time.perf_counter() - started)
+    return prompt, route
+
+def prepare_application(description, response_mode, timer=None, emit_timings=False, use_cache=True):
+    """
+    Start the Gemini stream for a game, simulation or interactive application,
+    or replay a cached one for a similar description
+    """
+    timer = timer or RequestTimer('application')
+    match = lookup_generation('application', description, use_cache, timer)
+    if match and GENERATION_CACHE_MODE == 'replay':
+        return replay_generation(match, response_mode, timer, emit_timings)
+
+    prompt, route = build_application_request(description, timer)
+    if match:
+        prompt = build_seeded_prompt(prompt, match)
+
+    print("Sending application generation request to Gemini...")  # Debug log
+
+    timer.mark('gemini_call')
+    response = open_gemini_stream(prompt, route, timer.endpoint)
+
+    # The first chunk is logged by the StreamEncoder when it actually arrives
+    print(f"Gemini application stream opened in {round(timer.since('gemini_call') * 1000)}ms")  # Debug log
+
+    return stream_response(
+        response, response_mode, timer=timer, emit_timings=emit_timings,
+        continue_with=continuation_request(prompt, route), cache_as=('application', description)
+    )
+
 @app.route('/api/generate-application', methods=['POST'])
-def generate_application(description=None):
+def generate_application(description=None, response_mode=None, timer=None):
+    if timer is None:
+        timer = RequestTimer('application')
+        REQUESTS.inc(endpoint='application')
     try:
         # If description is not provided as a parameter, get it from the request
         if description is None:
@@ -534,109 +1642,346 @@ def generate_application(description=None):
             if not description:
                 return jsonify({'error': 'No description provided'}), 400
 
-        print(f"Generating application: {description}")  # Debug log
-
-        # Determine the type of application being requested
-        description_lower = description.lower()
-        is_game = any(keyword in description_lower for keyword in ['game', 'tetris', 'chess', 'tic tac toe', 'pong'])
-        is_simulation = any(keyword in description_lower for keyword in ['simulation', 'solar system', 'physics', 'model'])
-
-        # Customize the prompt based on the type of application
-        specific_instructions = ""
-        if is_game:
-            specific_instructions = """
-            For this game:
-            - Include proper game mechanics, scoring, and win/lose conditions
-            - Add keyboard/mouse controls that are intuitive and responsive
-            - Include game state management (start, pause, restart, game over)
-            - Add sound effects if appropriate (with mute option)
-            """
-        elif is_simulation:
-            specific_instructions = """
-            For this simulation:
-            - Create a visually accurate and scientifically correct simulation
-            - Use appropriate physics formulas and calculations
-            - Add interactive controls to adjust parameters (speed, gravity, etc.)
-            - Include animations that accurately represent the physical phenomena
-            - For solar system or planetary models, use correct relative sizes and orbital mechanics
-            - Add informational tooltips or labels to explain what's happening
-            """
-        else:  # General interactive application
-            specific_instructions = """
-            For this interactive application:
-            - Create a clean, intuitive user interface
-            - Ensure all interactive elements work correctly
-            - Add appropriate feedback for user actions
-            - Include error handling for invalid inputs
-            - Make sure the application state is maintained correctly
-            """
-
-        # Prompt engineering for application/game/simulation generation
-        prompt = f"""
-        Create a standalone, functional {description} using HTML, CSS, and JavaScript.
-
-        IMPORTANT INSTRUCTIONS:
-        1. Focus on creating a WORKING, INTERACTIVE application, not just a website about it.
-        2. The JavaScript should contain all the application logic and functionality.
-        3. Use canvas for graphics if appropriate for the application.
-        4. Include clear instructions for the user on how to use the application.
-        5. Make sure the code is complete, functional, and properly handles user interactions.
-        6. The application should work entirely in the browser without requiring any server-side code.
-        7. The JavaScript code should be properly scoped and not interfere with the parent window.
-        8. Do not include any placeholder functionality - everything should actually work.
-        9. Use requestAnimationFrame for smooth animations where appropriate.
-        10. Ensure the application is responsive and works on different screen sizes.
-
-        {specific_instructions}
-
-        Return only the HTML, CSS, and JavaScript code without any explanations.
-        Format the response exactly as:
-        ```html
-        [HTML code here]
-        ```
-        ```css
-        [CSS code here]
-        ```
-        ```javascript
-        [JavaScript code here]
-        ```
-        """
+            response_mode = get_response_mode(data)
+            if not response_mode:
+                return jsonify({'error': f"responseMode must be one of: {', '.join(RESPONSE_MODES)}"}), 400
+
+            if data.get('job'):
+                return submit_job('application', description, response_mode, data)
+
+        response_mode = response_mode or 'raw'
+        emit_timings = wants_timings(request.get_json(silent=True))
+        use_cache = wants_cache(request.get_json(silent=True))
+        stream = generation_stream(
+            ('application', response_mode, emit_timings, use_cache, normalize_description(description)),
+            admitted(
+                lambda: prepare_application(description, response_mode, timer, emit_timings, use_cache),
+                client_id(request.headers, request.remote_addr)
+            )
+        )
+        return event_stream_response(stream, server_timing_headers(timer))
 
-        print("Sending application generation request to Gemini...")  # Debug log
+    except Exception as e:
+        if is_overload(e):
+            return overload_response(e)
+        ERRORS.inc(endpoint=timer.endpoint, stage='request')
+        print(f"Error in generate_application: {str(e)}")
+        traceback.print_exc()
+        return jsonify({
+            'error': str(e),
+            'traceback': traceback.format_exc()
+        }), 500
 
-        # Set a higher token limit for simulations which might need more complex code
-        max_tokens = 6144 if is_simulation else 4096
+def ndjson_line(payload):
+    return f"{json.dumps(payload)}\n"
 
-        response = model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(
-                temperature=0.7,
-                top_p=0.8,
-                top_k=40,
-                max_output_tokens=max_tokens,  # Increased token limit for more complex applications
-            ),
-            stream=True
-        )
+def resolve_batch_images(descriptions, kinds, timer):
+    """
+    Pick image topics for every website in a batch and look each distinct topic up once.
+    Returns the image data per item index, and how many topics and images there were.
+    """
+    with timer.phase('topics'):
+        item_topics = {
+            index: choose_image_topics(description)
+            for index, description in enumerate(descriptions) if kinds[index] == 'website'
+        }
+    topics = list(dict.fromkeys(topic for topics in item_topics.values() for topic in topics))
 
-        print("Received application response from Gemini")  # Debug log
+    with timer.phase('images'):
+        found = {entry['topic']: entry for entry in fetch_images_for_topics(topics)}
+    image_data = {index: [found[topic] for topic in topics if topic in found] for index, topics in item_topics.items()}
+    return image_data, len(topics), len(found)
 
-        return Response(
-            stream_response(response),
-            mimetype='text/event-stream'
-        )
+def run_batch_item(index, description, kind, image_data, response_mode, emit, cancelled):
+    """
+    Generate one batch item, passing its NDJSON lines to emit(). Returns True if it completed.
+    """
+    timer = RequestTimer(kind)
+    REQUESTS.inc(endpoint=kind)
+    encode = lambda payload: ndjson_line(dict(payload, index=index))
+    emit(encode({'status': 'started', 'kind': kind}))
 
+    try:
+        if kind == 'application':
+            prompt, route = build_application_request(description, timer)
+        else:
+            prompt, route = build_website_request(description, timer, image_data or [])
+        timer.mark('gemini_call')
+        response = open_gemini_stream(prompt, route, timer.endpoint)
     except Exception as e:
-        print(f"Error in generate_application: {str(e)}")
+        print(f"Error starting batch item {index}: {str(e)}")
+        traceback.print_exc()
+        ERRORS.inc(endpoint=kind, stage='gemini')
+        emit(encode({'error': str(e)}))
+        return False
+
+    encoder = StreamEncoder(response_mode, timer=timer, encode=encode, cache_as=(kind, description))
+    try:
+        for text in gemini_texts(response, timer, continuation_request(prompt, route)):
+            if cancelled.is_set():
+                print(f"Batch cancelled, stopping item {index}")
+                return False
+            frames = encoder.feed(text)
+            if frames:
+                emit(''.join(frames))
+        emit(''.join(encoder.close()))
+    except Exception as e:
+        emit(''.join(encoder.fail(e)))
+        return False
+    emit(encode({'status': 'done'}))
+    return True
+
+def stream_batch(descriptions, response_mode, concurrency, timer):
+    """
+    Generate a batch and multiplex every item's events onto one NDJSON stream.
+
+    Each description goes through the same intent routing as
+    /api/generate-website. Image topics for all websites are looked up
+    together first, so topics shared between items cost one lookup. Items
+    then run `concurrency` at a time, and every line they produce carries
+    the item's index. If the client goes away, items that haven't started
+    are dropped and running ones stop at their next chunk.
+    """
+    started = time.perf_counter()
+    kinds = ['application' if is_application_request(description) else 'website' for description in descriptions]
+    yield ndjson_line({'status': 'accepted', 'items': len(descriptions), 'kinds': kinds})
+
+    image_data, topic_count, image_count = resolve_batch_images(descriptions, kinds, timer)
+    yield ndjson_line({
+        'phase': 'images', 'topics': topic_count, 'images': image_count,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)
+    })
+
+    lines = queue.Queue()
+    cancelled = threading.Event()
+
+    def work(index, description):
+        try:
+            return run_batch_item(index, description, kinds[index], image_data.get(index), response_mode, lines.put, cancelled)
+        except Exception as e:
+            print(f"Error in batch item {index}: {str(e)}")
+            traceback.print_exc()
+            lines.put(ndjson_line({'index': index, 'error': str(e)}))
+            return False
+        finally:
+            lines.put(None)
+
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='batch')
+    futures = [executor.submit(work, index, description) for index, description in enumerate(descriptions)]
+    executor.shutdown(wait=False)
+    try:
+        finished = 0
+        while finished < len(futures):
+            line = lines.get()
+            if line is None:
+                finished += 1
+                continue
+            yield line
+        failed = sum(1 for future in futures if not future.result())
+        print(f"Batch of {len(descriptions)} finished with {failed} failure(s)")
+        yield ndjson_line({
+            'status': 'complete', 'items': len(descriptions), 'failed': failed,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)
+        })
+    finally:
+        cancelled.set()
+        for future in futures:
+            future.cancel()
+
+@app.route('/api/generate-batch', methods=['POST'])
+def generate_batch():
+    timer = RequestTimer('batch')
+    REQUESTS.inc(endpoint='batch')
+    try:
+        data = request.json
+        if not data:
+            return jsonify({'error': 'No JSON data received'}), 400
+
+        descriptions = data.get('descriptions')
+        if not isinstance(descriptions, list) or not descriptions \
+                or not all(isinstance(description, str) and description.strip() for description in descriptions):
+            return jsonify({'error': 'descriptions must be a non-empty list of descriptions'}), 400
+        if len(descriptions) > BATCH_MAX_ITEMS:
+            return jsonify({'error': f"A batch can have at most {BATCH_MAX_ITEMS} descriptions"}), 400
+
+        response_mode = get_response_mode(data)
+        if not response_mode:
+            return jsonify({'error': f"responseMode must be one of: {', '.join(RESPONSE_MODES)}"}), 400
+
+        concurrency = data.get('concurrency', BATCH_CONCURRENCY)
+        if not isinstance(concurrency, int) or concurrency < 1:
+            return jsonify({'error': 'concurrency must be a positive integer'}), 400
+        concurrency = min(concurrency, BATCH_CONCURRENCY, len(descriptions))
+
+        print(f"Received batch of {len(descriptions)} descriptions, {concurrency} at a time")  # Debug log
+        return Response(stream_batch(descriptions, response_mode, concurrency, timer), mimetype='application/x-ndjson')
+
+    except Exception as e:
+        ERRORS.inc(endpoint=timer.endpoint, stage='request')
+        print(f"Error in generate_batch: {str(e)}")
         traceback.print_exc()
         return jsonify({
             'error': str(e),
             'traceback': traceback.format_exc()
         }), 500
 
+def run_job(job, publish, cancelled):
+    """
+    Generate a queued job in a job worker (see jobs.py). Its SSE frames are
+    published as they are produced, and the finished site is the job's result.
+    """
+    kind = job['kind']
+    description = job['request']['description']
+    timer = RequestTimer(kind)
+    if kind == 'application':
+        prompt, route = build_application_request(description, timer)
+    else:
+        prompt, route = build_website_request(description, timer)
+
+    timer.mark('gemini_call')
+    response = open_gemini_stream(prompt, route, timer.endpoint)
+
+    encoder = StreamEncoder(job['request']['response_mode'], timer=timer, cache_as=(kind, description))
+    try:
+        for text in gemini_texts(response, timer, continuation_request(prompt, route)):
+            if cancelled.is_set():
+                # Leaving the stream unread stops the generation
+                print(f"Job {job['job_id']} cancelled, stopping its stream")
+                for frame in encoder.flush():
+                    publish(frame)
+                return None
+            for frame in encoder.feed(text):
+                publish(frame)
+        frames = encoder.close()
+    except Exception as e:
+        for frame in encoder.fail(e):
+            publish(frame)
+        raise
+    for frame in frames:
+        publish(frame)
+
+    result = {name: encoder.source_sections.get(name, '').strip() for name in ('html', 'css', 'js')}
+    if encoder.site:
+        result.update(siteId=encoder.site['site_id'], contentHash=encoder.site['content_hash'], version=encoder.site['version'])
+    return result
+
+# Generations submitted as jobs run in JOB_WORKERS background threads, with their records in JOB_DB (see jobs.py).
+# Recovery and the workers wait for job_queue.start(): server startup, or the first job request
+job_queue = create_job_queue_from_env(run_job, replay_store, sse_event)
+
+def job_summary(record):
+    """
+    A job record as the API returns it
+    """
+    summary = {
+        'jobId': record['job_id'],
+        'kind': record['kind'],
+        'priority': record['priority'],
+        'status': record['status'],
+        'createdAt': record['created_at'],
+        'startedAt': record['started_at'],
+        'finishedAt': record['finished_at'],
+        'events': f"/api/jobs/{record['job_id']}/events"
+    }
+    if record.get('position') is not None:
+        summary['position'] = record['position']
+    if record['error']:
+        summary['error'] = record['error']
+    if record['result'] is not None:
+        summary['result'] = record['result']
+    return summary
+
+def submit_job(kind, description, response_mode, data):
+    """
+    Queue a generation and answer with its job id straight away (202)
+    """
+    priority = data.get('priority', 'normal')
+    if priority not in JOB_PRIORITIES:
+        return jsonify({'error': f"priority must be one of: {', '.join(JOB_PRIORITIES)}"}), 400
+    try:
+        record = job_queue.submit(kind, {'description': description, 'response_mode': response_mode}, priority)
+    except QueueFull as e:
+        return jsonify({'error': f"Job queue is full: {str(e)}"}), 503
+    print(f"Queued {priority} priority {kind} job {record['job_id']}")  # Debug log
+    return jsonify(job_summary(job_queue.get(record['job_id']))), 202
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    timer = RequestTimer('jobs')
+    REQUESTS.inc(endpoint='jobs')
+    try:
+        data = request.json
+        if not data:
+            return jsonify({'error': 'No JSON data received'}), 400
+
+        description = data.get('description')
+        if not description:
+            return jsonify({'error': 'No description provided'}), 400
+
+        response_mode = get_response_mode(data)
+        if not response_mode:
+            return jsonify({'error': f"responseMode must be one of: {', '.join(RESPONSE_MODES)}"}), 400
+
+        kind = 'application' if is_application_request(description) else 'website'
+        return submit_job(kind, description, response_mode, data)
+
+    except Exception as e:
+        ERRORS.inc(endpoint=timer.endpoint, stage='request')
+        print(f"Error in create_job: {str(e)}")
+        traceback.print_exc()
+        return jsonify({
+            'error': str(e),
+            'traceback': traceback.format_exc()
+        }), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    record = job_queue.get(job_id)
+    if record is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    return jsonify(job_summary(record))
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    status = job_queue.cancel(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    if status in ('done', 'failed'):
+        return jsonify({'error': f"Job already {status}", 'status': status}), 409
+    return jsonify({'jobId': job_id, 'status': status})
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """
+    Follow a job as SSE after the Last-Event-ID header (or lastEventId query
+    parameter), replaying what was sent before. Once the events of a
+    finished job have expired, one event with its final record is sent instead.
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('lastEventId') or '0'
+    try:
+        last_event_id = int(last_event_id)
+    except ValueError:
+        return jsonify({'error': 'Last-Event-ID must be an integer'}), 400
+
+    record = job_queue.get(job_id)
+    if record is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+
+    broadcast = replay_store.get(record['generation_id'])
+    if broadcast is not None and broadcast.can_resume(last_event_id):
+        return event_stream_response(broadcast.subscribe(last_event_id, SSE_HEARTBEAT))
+    if record['status'] in FINISHED_STATUSES:
+        return event_stream_response([sse_event(job_summary(record))])
+    return jsonify({'error': 'Job events can no longer be resumed from this event'}), 410
+
 # For local development
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 3001))
-    app.run(host='0.0.0.0', port=port, debug=os.getenv('FLASK_DEBUG', 'True').lower() == 'true')
+    debug = os.getenv('FLASK_DEBUG', 'True').lower() == 'true'
+    # With the reloader, only the child process that serves requests resumes queued jobs
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        job_queue.start()
+    app.run(host='0.0.0.0', port=port, debug=debug)
 
 # Add GitHub redirect route before the main block
 @app.route('/github')
@@ -0,0 +1,225 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+
+SECTIONS = ('html', 'css', 'js')
+
+# Fence languages the model may use in a patch, mapped to artifact sections
+_PATCH_SECTIONS = {'html': 'html', 'css': 'css', 'javascript': 'js', 'js': 'js'}
+
+_PATCH_BLOCK_RE = re.compile(
+    r"<{5,9}[ \t]*SEARCH[ \t]+([A-Za-z]+)[ \t]*\r?\n(.*?)^={5,9}[ \t]*\r?\n(.*?)^>{5,9}[ \t]*REPLACE[ \t]*$",
+    re.DOTALL | re.MULTILINE
+)
+
+
+class PatchError(Exception):
+    """
+    Raised when a model patch can't be parsed or doesn't match the current site
+    """
+
+
+def content_hash(html, css, js):
+    digest = hashlib.sha256()
+    for part in (html, css, js):
+        digest.update((part or '').encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()[:16]
+
+
+class ArtifactStore:
+    """
+    Keeps the latest html/css/js of each generated site under a site id,
+    so modifications can refer to a site instead of re-uploading it.
+
+    Sites live in an in-process LRU with a TTL and can optionally be
+    persisted to an SQLite file.
+    """
+
+    def __init__(self, max_sites=500, ttl=86400, db_path=None):
+        self.max_sites = max_sites
+        self.ttl = ttl
+        self._sites = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_lock = threading.Lock()
+
+        if db_path:
+            try:
+                self._db = sqlite3.connect(db_path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS sites ("
+                    "site_id TEXT PRIMARY KEY, record TEXT NOT NULL, updated_at REAL NOT NULL)"
+                )
+                self._db.commit()
+            except Exception as e:
+                print(f"Error opening artifact database {db_path}: {str(e)}")
+                traceback.print_exc()
+                self._db = None
+
+    def save(self, html, css, js, site_id=None):
+        """
+        Store a new site, or a new version of an existing one, and return its record
+        """
+        now = time.time()
+        previous = self.get(site_id) if site_id else None
+        record = {
+            'site_id': site_id or uuid.uuid4().hex,
+            'html': html or '',
+            'css': css or '',
+            'js': js or '',
+            'content_hash': content_hash(html, css, js),
+            'version': previous['version'] + 1 if previous else 1,
+            'updated_at': now
+        }
+
+        with self._lock:
+            self._sites[record['site_id']] = record
+            self._sites.move_to_end(record['site_id'])
+            while len(self._sites) > self.max_sites:
+                self._sites.popitem(last=False)
+
+        if self._db is not None:
+            try:
+                with self._db_lock:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO sites (site_id, record, updated_at) VALUES (?, ?, ?)",
+                        (record['site_id'], json.dumps(record), now)
+                    )
+                    self._db.commit()
+            except Exception as e:
+                print(f"Error saving site {record['site_id']}: {str(e)}")
+        return record
+
+    def get(self, site_id):
+        now = time.time()
+        with self._lock:
+            record = self._sites.get(site_id)
+            if record is not None:
+                if now - record['updated_at'] < self.ttl:
+                    self._sites.move_to_end(site_id)
+                    return record
+                del self._sites[site_id]
+
+        if self._db is None:
+            return None
+        try:
+            with self._db_lock:
+                row = self._db.execute("SELECT record FROM sites WHERE site_id = ?", (site_id,)).fetchone()
+        except Exception as e:
+            print(f"Error loading site {site_id}: {str(e)}")
+            return None
+        if not row:
+            return None
+        record = json.loads(row[0])
+        if now - record['updated_at'] >= self.ttl:
+            return None
+        with self._lock:
+            self._sites[site_id] = record
+        return record
+
+    def stats(self):
+        with self._lock:
+            return {'sites': len(self._sites), 'persistent': self._db is not None}
+
+
+def parse_patch(text):
+    """
+    Parse SEARCH/REPLACE blocks into a list of (section, search, replace)
+    """
+    edits = []
+    for match in _PATCH_BLOCK_RE.finditer(text):
+        section = _PATCH_SECTIONS.get(match.group(1).lower())
+        if not section:
+            raise PatchError(f"Unknown patch section '{match.group(1)}'")
+        search, replace = match.group(2), match.group(3)
+        # The newline before the divider belongs to the block syntax, not the code
+        edits.append((section, search[:-1] if search.endswith('\n') else search,
+                      replace[:-1] if replace.endswith('\n') else replace))
+    if not edits and 'NO CHANGES' not in text.upper():
+        raise PatchError('No edit blocks found in the model output')
+    return edits
+
+
+def complete_patch(text, finish_reason):
+    """
+    The patch text, or PatchError if the response stopped at its output
+    budget: the blocks before the cut may apply, but the rest of the edit
+    would be lost without anyone noticing.
+    """
+    if finish_reason == 'MAX_TOKENS':
+        raise PatchError('Patch was cut off at the output token limit')
+    return text
+
+
+def _ambiguous(section, search, count):
+    preview = search.strip().split('\n')[0][:80]
+    return PatchError(f"SEARCH text matches {count} places in {section}: {preview!r}")
+
+
+def _replace_loosely(section, content, search, replace):
+    """
+    Replace the run of lines that matches `search` when whitespace
+    differences are ignored. Returns None if there is no such run, and
+    raises PatchError if there is more than one.
+    """
+    search_lines = [' '.join(line.split()) for line in search.strip('\n').split('\n')]
+    content_lines = content.split('\n')
+    stripped = [' '.join(line.split()) for line in content_lines]
+    span = len(search_lines)
+    starts = [start for start in range(len(content_lines) - span + 1) if stripped[start:start + span] == search_lines]
+    if not starts:
+        return None
+    if len(starts) > 1:
+        raise _ambiguous(section, search, len(starts))
+    start = starts[0]
+    replacement = replace.rstrip('\n').split('\n') if replace.strip() else []
+    return '\n'.join(content_lines[:start] + replacement + content_lines[start + span:])
+
+
+def apply_patch(site, text):
+    """
+    Apply the model's SEARCH/REPLACE blocks to a stored site. Each SEARCH
+    text must match exactly one place in its section.
+    Returns (sections dict, number of edits) or raises PatchError.
+    """
+    sections = {name: site[name] for name in SECTIONS}
+    edits = parse_patch(text)
+
+    for section, search, replace in edits:
+        content = sections[section]
+        if not search.strip():
+            # An empty SEARCH appends to the section
+            sections[section] = content.rstrip('\n') + '\n' + replace.rstrip('\n') if content else replace.rstrip('\n')
+            continue
+        matches = content.count(search)
+        if matches > 1:
+            raise _ambiguous(section, search, matches)
+        if matches:
+            sections[section] = content.replace(search, replace, 1)
+            continue
+        patched = _replace_loosely(section, content, search, replace)
+        if patched is None:
+            preview = search.strip().split('\n')[0][:80]
+            raise PatchError(f"SEARCH text not found in {section}: {preview!r}")
+        sections[section] = patched
+
+    return sections, len(edits)
+
+
+def create_artifact_store_from_env():
+    """
+    Build the process-wide store from ARTIFACT_* environment variables.
+    """
+    return ArtifactStore(
+        max_sites=int(os.getenv('ARTIFACT_STORE_SIZE', '500')),
+        ttl=float(os.getenv('ARTIFACT_TTL', '86400')),
+        db_path=os.getenv('ARTIFACT_DB') or None
+    )
@@ -0,0 +1,688 @@
+"""
+asyncio serving mode for the generation endpoints.
+
+Under WSGI every open SSE stream holds a worker thread for the whole
+generation. Here /api/generate-website, /api/generate-application and
+/api/modify-website are served by async handlers that await the Gemini
+stream (generate_content_async), so one process can hold thousands of
+streams open. Blocking set-up work (topic extraction, Unsplash lookups)
+runs on a thread pool so it never stalls the event loop.
+
+The SSE format is the same as the Flask app's because frames go through
+the same StreamEncoder. Frames are also published to the shared replay
+store, and a generation runs to the end even if its client disconnects, so
+it can be resumed through /api/streams/<generation_id>. With SINGLE_FLIGHT
+on, identical website and application requests share one upstream stream
+here too: later ones follow the first one's broadcast. Every other route,
+including /api/streams, pipelined website requests and job submissions are
+passed through to the Flask app, on a pool of their own.
+
+Run locally with:  uvicorn asgi:asgi_app --port 3001
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from io import BytesIO
+
+import app as backend
+from broadcast import tag_frame
+from continuation import Stitcher, acontinued_texts, build_continuation_prompt, chunk_text, finish_reason
+from framing import HEARTBEAT_FRAME, GzipStream, accepts_gzip
+from hedging import ahedged
+from metrics import ERRORS, REQUESTS, RequestTimer
+from minify import estimate_tokens
+from routing import aobserved
+
+# Responses passed through to Flask are read on their own pool, one thread per open response, so long
+# event streams can't take over the default executor that blocking set-up work runs on
+ASGI_PASSTHROUGH_THREADS = int(os.getenv('ASGI_PASSTHROUGH_THREADS', '64'))
+_passthrough_executor = ThreadPoolExecutor(max_workers=ASGI_PASSTHROUGH_THREADS, thread_name_prefix='flask-passthrough')
+
+# Single-flight key -> future of the leading request's Broadcast, or of None if it failed before streaming
+_flights = {}
+
+# Put on a passthrough queue once the Flask app has called start_response
+_STARTED = object()
+
+
+class _Request:
+    def __init__(self, scope, receive):
+        self.scope = scope
+        self.receive = receive
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+        self.disconnected = asyncio.Event()
+        self.response_started = False
+        self.emit_timings = False
+        self.use_cache = True
+        self.client = None
+        self.ticket = None
+        self.broadcast = None
+        self.flight = None
+        self.gzip = None
+
+    async def body(self):
+        chunks = []
+        while True:
+            message = await self.receive()
+            if message['type'] == 'http.disconnect':
+                self.disconnected.set()
+                break
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        return b''.join(chunks)
+
+    async def watch_disconnect(self):
+        # Once the body is read, the only message left to receive is the disconnect
+        while not self.disconnected.is_set():
+            message = await self.receive()
+            if message['type'] == 'http.disconnect':
+                self.disconnected.set()
+
+
+def _cors_headers(request):
+    origin = request.headers.get('origin')
+    if not origin or ('*' not in backend.origins_list and origin not in backend.origins_list):
+        return []
+    return [
+        (b'access-control-allow-origin', origin.encode('latin-1')),
+        (b'access-control-allow-credentials', b'true'),
+        (b'access-control-expose-headers', b'Content-Type, Server-Timing, Retry-After'),
+        (b'vary', b'Origin')
+    ]
+
+
+async def _send_json(send, request, payload, status):
+    body = json.dumps(payload).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+                   + _cors_headers(request)
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _start_event_stream(send, request, timer=None):
+    if request.broadcast is not None:
+        # Already started while the request waited for an upstream slot
+        return
+    await _send_stream_headers(send, request, timer)
+    request.broadcast = backend.replay_store.create()
+    if request.flight is not None and not request.flight.done():
+        # Identical requests that arrived in the meantime follow this broadcast from here on
+        request.flight.set_result(request.broadcast)
+    await _send_frames(send, request, [backend.sse_event({'generationId': request.broadcast.generation_id})])
+
+
+async def _send_stream_headers(send, request, timer=None):
+    request.response_started = True
+    headers = [(b'content-type', b'text/event-stream; charset=utf-8'), (b'cache-control', b'no-cache')]
+    if timer is not None and timer.phases:
+        headers.append((b'server-timing', timer.server_timing().encode('latin-1')))
+    if backend.SSE_GZIP and accepts_gzip(request.headers.get('accept-encoding')):
+        request.gzip = GzipStream()
+        headers += [(b'content-encoding', b'gzip'), (b'vary', b'Accept-Encoding')]
+    await send({'type': 'http.response.start', 'status': 200, 'headers': headers + _cors_headers(request)})
+
+
+async def _send_frames(send, request, frames):
+    """
+    Publish frames to the request's replay buffer and send them while the client is still connected
+    """
+    tagged = [tag_frame(request.broadcast.publish(frame), frame) for frame in frames]
+    if tagged:
+        await _send_text(send, request, ''.join(tagged))
+
+
+async def _send_text(send, request, text):
+    if request.disconnected.is_set():
+        return
+    body = request.gzip.compress(text) if request.gzip else text.encode('utf-8')
+    await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+
+
+async def _finish_stream(send, request):
+    request.broadcast.finish()
+    if not request.disconnected.is_set():
+        await send({'type': 'http.response.body', 'body': request.gzip.finish() if request.gzip else b''})
+
+
+async def _send_overload(send, request, error):
+    message, retry_after = backend.overload_details(error)
+    print(f"Turning away a generation: {message} (retry after {retry_after}s)")
+    body = json.dumps({'error': message, 'retryAfter': retry_after}).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': 429,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()),
+                    (b'retry-after', str(retry_after).encode())] + _cors_headers(request)
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _admit(send, request, timer):
+    """
+    Take an upstream slot for the request (see admission.py). While it waits,
+    the event stream is started and reports the queue position. Returns
+    False if the request gave up: the wait ran out or the client went away.
+    A full queue raises AdmissionRejected before anything is sent.
+    """
+    if backend.admission is None:
+        return True
+    ticket = request.ticket = backend.admission.request(request.client)
+    if ticket.admitted:
+        return True
+
+    await _start_event_stream(send, request, timer)
+    position = ticket.position
+    await _send_frames(send, request, [backend.sse_event({'queue': {'position': position}})])
+    watcher = asyncio.ensure_future(request.watch_disconnect())
+    try:
+        while not ticket.wait(0):
+            if request.disconnected.is_set():
+                ticket.release()
+                return False
+            if time.monotonic() - ticket.requested_at >= backend.ADMISSION_MAX_WAIT:
+                await _send_frames(send, request, [
+                    backend.sse_event({'error': 'Timed out waiting for a free generation slot, please retry'})
+                ])
+                ticket.release()
+                return False
+            if ticket.position != position:
+                position = ticket.position
+                await _send_frames(send, request, [backend.sse_event({'queue': {'position': position}})])
+            await asyncio.sleep(0.1)
+    finally:
+        watcher.cancel()
+    waited_ms = round((ticket.admitted_at - ticket.requested_at) * 1000, 1)
+    await _send_frames(send, request, [backend.sse_event({'queue': {'position': 0, 'waited_ms': waited_ms}})])
+    return True
+
+
+async def _run_blocking(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(None, partial(func, *args))
+
+
+async def _open_stream(prompt, route, endpoint):
+    """
+    Start an async Gemini stream on the route's model, hedged when HEDGING is on (see hedging.py and routing.py)
+    """
+    generation_config = backend.routed_generation_config(route)
+    start = lambda: backend.get_model(route.model).generate_content_async(
+        prompt, generation_config=generation_config, stream=True
+    )
+    if backend.hedge_policy:
+        response = await ahedged(start, backend.hedge_policy, endpoint)
+    else:
+        response = await start()
+    return aobserved(response, backend.router, route)
+
+
+async def _chunk_texts(response):
+    async for chunk in response:
+        if hasattr(chunk, 'text'):
+            yield chunk.text
+
+
+def _generated_texts(response, prompt, route, timer):
+    """
+    Texts of an async Gemini stream, continued while the output is cut short (see continuation.py)
+    """
+    if not backend.MAX_CONTINUATIONS:
+        return _chunk_texts(response)
+
+    generation_config = backend.routed_generation_config(route)
+
+    def continue_with(tail):
+        return backend.get_model(route.model).generate_content_async(
+            build_continuation_prompt(prompt, tail), generation_config=generation_config, stream=True
+        )
+
+    stitcher = Stitcher(backend.MAX_CONTINUATIONS, backend.CONTINUATION_TAIL_CHARS, timer.endpoint)
+    return acontinued_texts(response, stitcher, continue_with)
+
+
+async def _relay(send, request, texts, encoder):
+    """
+    Push generated texts (see _generated_texts) through the encoder to the client.
+    Keeps reading upstream after the client goes away, so the client can resume.
+
+    While waiting for the next chunk, coalesced text is flushed after
+    SSE_FLUSH_INTERVAL and a heartbeat comment is sent after SSE_HEARTBEAT.
+    The pending read is never cancelled, so waiting doesn't disturb the stream.
+    """
+    texts = texts.__aiter__()
+    try:
+        while True:
+            next_text = asyncio.ensure_future(texts.__anext__())
+            while not next_text.done():
+                timeout = backend.SSE_FLUSH_INTERVAL if encoder.pending else (backend.SSE_HEARTBEAT or None)
+                await asyncio.wait({next_text}, timeout=timeout)
+                if next_text.done():
+                    break
+                if encoder.pending:
+                    await _send_frames(send, request, encoder.flush())
+                else:
+                    await _send_text(send, request, HEARTBEAT_FRAME)
+            try:
+                text = next_text.result()
+            except StopAsyncIteration:
+                break
+            await _send_frames(send, request, encoder.feed(text))
+        await _send_frames(send, request, encoder.close())
+    except Exception as e:
+        await _send_frames(send, request, encoder.fail(e))
+
+
+async def _stream_generation(send, request, prompt, route, response_mode, timer, site_id=None,
+                             leading_frames=(), cache_as=None):
+    if not await _admit(send, request, timer):
+        return await _finish_stream(send, request)
+    # Start the upstream call before the response so set-up failures still return a 500
+    timer.mark('gemini_call')
+    response = await _open_stream(prompt, route, timer.endpoint)
+    await _start_event_stream(send, request, timer)
+    await _send_frames(send, request, list(leading_frames))
+    watcher = asyncio.ensure_future(request.watch_disconnect())
+    encoder = backend.StreamEncoder(response_mode, site_id, timer, request.emit_timings, cache_as=cache_as)
+    try:
+        await _relay(send, request, _generated_texts(response, prompt, route, timer), encoder)
+    finally:
+        watcher.cancel()
+    await _finish_stream(send, request)
+
+
+async def _follow(send, request, timer, broadcast):
+    """
+    Relay the generation another request is leading for the same thing, from its first frame
+    """
+    print(f"Joining in-flight generation {broadcast.generation_id}")
+    await _send_stream_headers(send, request, timer)
+    loop = asyncio.get_running_loop()
+    changed = asyncio.Event()
+
+    def wake():
+        loop.call_soon_threadsafe(changed.set)
+
+    watcher = asyncio.ensure_future(request.watch_disconnect())
+    broadcast.listen(wake)
+    last_event_id = 0
+    try:
+        while not request.disconnected.is_set():
+            changed.clear()
+            frames, done = broadcast.read(last_event_id)
+            if frames is None:
+                print(f"Follower of generation {broadcast.generation_id} fell behind the replay buffer")
+                break
+            if frames:
+                last_event_id = frames[-1][0]
+                await _send_text(send, request, ''.join(tag_frame(event_id, frame) for event_id, frame in frames))
+            if done:
+                break
+            if not frames:
+                try:
+                    await asyncio.wait_for(changed.wait(), backend.SSE_HEARTBEAT or None)
+                except asyncio.TimeoutError:
+                    await _send_text(send, request, HEARTBEAT_FRAME)
+    finally:
+        broadcast.unlisten(wake)
+        watcher.cancel()
+    if not request.disconnected.is_set():
+        await send({'type': 'http.response.body', 'body': request.gzip.finish() if request.gzip else b''})
+
+
+async def _generate(send, request, kind, build_request, description, response_mode, timer):
+    """
+    Stream a new generation, or follow an identical one that is already running
+    (see broadcast.SingleFlight), or replay a cached one for a similar description
+    (see generation_cache.py)
+    """
+    key = (kind, response_mode, request.emit_timings, request.use_cache, backend.normalize_description(description))
+    flight = _flights.get(key) if backend.SINGLE_FLIGHT else None
+    while flight is not None:
+        broadcast = await asyncio.shield(flight)
+        if broadcast is not None:
+            backend.single_flight.record(follower=True)
+            return await _follow(send, request, timer, broadcast)
+        # The leader failed before it started streaming, so this request tries for itself
+        flight = _flights.get(key)
+
+    if backend.SINGLE_FLIGHT:
+        request.flight = _flights[key] = asyncio.get_running_loop().create_future()
+        backend.single_flight.record(follower=False)
+    try:
+        await _lead(send, request, kind, build_request, description, response_mode, timer)
+    finally:
+        if request.flight is not None:
+            if not request.flight.done():
+                request.flight.set_result(None)
+            if _flights.get(key) is request.flight:
+                del _flights[key]
+
+
+async def _lead(send, request, kind, build_request, description, response_mode, timer):
+    match = await _run_blocking(backend.lookup_generation, kind, description, request.use_cache, timer)
+    if match and backend.GENERATION_CACHE_MODE == 'replay':
+        await _start_event_stream(send, request, timer)
+        await _send_frames(send, request, list(backend.replay_generation(match, response_mode, timer, request.emit_timings)))
+        return await _finish_stream(send, request)
+
+    prompt, route = await _run_blocking(build_request, description, timer)
+    if match:
+        prompt = backend.build_seeded_prompt(prompt, match)
+    await _stream_generation(send, request, prompt, route, response_mode, timer, cache_as=(kind, description))
+
+
+async def generate_application(send, request, description, response_mode, timer):
+    await _generate(send, request, 'application', backend.build_application_request, description, response_mode, timer)
+
+
+async def generate_website(send, request, data):
+    timer = RequestTimer('website')
+    description = data.get('description')
+    if not description:
+        return await _send_json(send, request, {'error': 'No description provided'}, 400)
+
+    response_mode = backend.get_response_mode(data)
+    if not response_mode:
+        return await _send_json(send, request, {'error': f"responseMode must be one of: {', '.join(backend.RESPONSE_MODES)}"}, 400)
+
+    print(f"Received description: {description}")  # Debug log
+
+    with timer.phase('intent'):
+        is_application = backend.is_application_request(description)
+    if is_application:
+        print(f"Detected interactive application request: {description}")
+        return await generate_application(send, request, description, response_mode, timer)
+
+    await _generate(send, request, 'website', backend.build_website_request, description, response_mode, timer)
+
+
+async def _stream_patched_site(send, request, site, modification, image_references, response_mode, timer):
+    if not await _admit(send, request, timer):
+        return await _finish_stream(send, request)
+    await _start_event_stream(send, request, timer)
+    await _send_frames(send, request, [backend.sse_event({'phase': 'patching', 'siteId': site['site_id']})])
+
+    started = time.perf_counter()
+    encoder = backend.StreamEncoder(response_mode, site['site_id'], timer, request.emit_timings)
+    try:
+        timer.mark('gemini_call')
+        response = await _open_stream(
+            backend.build_patch_prompt(modification, site, image_references), backend.patch_route(site), timer.endpoint
+        )
+        parts, reason = [], None
+        async for chunk in response:
+            reason = finish_reason(chunk) or reason
+            parts.append(chunk_text(chunk))
+        sections, edit_count = backend.apply_patch(site, backend.complete_patch(''.join(parts), reason))
+    except backend.PatchError as e:
+        print(f"Patch for site {site['site_id']} did not apply, regenerating: {str(e)}")
+        ERRORS.inc(endpoint=timer.endpoint, stage='patch')
+        await _send_frames(send, request, [backend.sse_event({'phase': 'patch_failed', 'reason': str(e)})])
+        try:
+            compacted = backend.compact_modify_inputs(site['html'], site['css'], site['js'])
+            size_error = backend.check_modify_size(compacted['stats']['compacted_tokens'], full_regeneration=True)
+            if size_error:
+                await _send_frames(send, request, [backend.sse_event({'error': size_error})])
+                return await _finish_stream(send, request)
+            prompt, route, compaction_event = backend.build_compacted_modify_request(
+                modification, compacted, image_references, timer
+            )
+            await _send_frames(send, request, [compaction_event])
+            timer.mark('gemini_call')
+            response = await _open_stream(prompt, route, timer.endpoint)
+            await _relay(send, request, _generated_texts(response, prompt, route, timer), encoder)
+        except Exception as e:
+            await _send_frames(send, request, encoder.fail(e))
+    except Exception as e:
+        await _send_frames(send, request, encoder.fail(e))
+    else:
+        timer.record('patch', time.perf_counter() - started)
+        await _send_frames(send, request, [backend.sse_event({'phase': 'patch_applied', 'edits': edit_count})])
+        await _send_frames(send, request, encoder.feed(backend.format_site(sections)) + encoder.close())
+
+    await _finish_stream(send, request)
+
+
+async def modify_website(send, request, data):
+    timer = RequestTimer('modify')
+    modification = data.get('modificationDescription')
+    current_html = data.get('currentHtml')
+    current_css = data.get('currentCss')
+    current_js = data.get('currentJs', '')  # Optional JavaScript code
+
+    site_id = data.get('siteId')
+    site = None
+    if site_id and not current_html:
+        site = backend.artifact_store.get(site_id)
+        if site is None:
+            return await _send_json(send, request, {'error': 'Unknown or expired siteId'}, 404)
+        if not modification:
+            return await _send_json(send, request, {'error': 'Missing required fields'}, 400)
+    elif not all([modification, current_html, current_css]):
+        return await _send_json(send, request, {'error': 'Missing required fields'}, 400)
+
+    response_mode = backend.get_response_mode(data)
+    if not response_mode:
+        return await _send_json(send, request, {'error': f"responseMode must be one of: {', '.join(backend.RESPONSE_MODES)}"}, 400)
+
+    # Oversized sites are rejected before any image lookup or model call
+    patch_mode = site is not None and data.get('editMode', 'patch') == 'patch'
+    if patch_mode:
+        size_error = backend.check_modify_size(estimate_tokens(site['html'] + site['css'] + site['js']), False)
+    else:
+        if site is not None:
+            current_html, current_css, current_js = site['html'], site['css'], site['js']
+        with timer.phase('compaction'):
+            compacted = backend.compact_modify_inputs(current_html, current_css, current_js)
+        size_error = backend.check_modify_size(compacted['stats']['compacted_tokens'], full_regeneration=True)
+    if size_error:
+        return await _send_json(send, request, {'error': size_error}, 413)
+
+    image_references = await _run_blocking(backend.build_modification_image_references, modification, timer)
+
+    if patch_mode:
+        return await _stream_patched_site(send, request, site, modification, image_references, response_mode, timer)
+
+    if site is None and site_id and backend.artifact_store.get(site_id) is None:
+        site_id = None
+
+    prompt, route, compaction_event = backend.build_compacted_modify_request(
+        modification, compacted, image_references, timer
+    )
+    await _stream_generation(
+        send, request, prompt, route, response_mode, timer, site_id, leading_frames=[compaction_event]
+    )
+
+
+async def _generate_application_route(send, request, data):
+    description = data.get('description')
+    if not description:
+        return await _send_json(send, request, {'error': 'No description provided'}, 400)
+
+    response_mode = backend.get_response_mode(data)
+    if not response_mode:
+        return await _send_json(send, request, {'error': f"responseMode must be one of: {', '.join(backend.RESPONSE_MODES)}"}, 400)
+
+    await generate_application(send, request, description, response_mode, RequestTimer('application'))
+
+
+ASYNC_ROUTES = {
+    '/api/generate-website': generate_website,
+    '/api/generate-application': _generate_application_route,
+    '/api/modify-website': modify_website
+}
+
+# Endpoint labels used in metrics, matching the Flask routes
+ENDPOINT_LABELS = {
+    '/api/generate-website': 'website',
+    '/api/generate-application': 'application',
+    '/api/modify-website': 'modify'
+}
+
+
+async def _call_flask(scope, receive, send, body=None):
+    """
+    Serve a request with the Flask app on the thread pool. Response bodies are
+    pulled chunk by chunk, so streaming Flask routes keep streaming.
+    """
+    if body is None:
+        body = await _Request(scope, receive).body()
+
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        'CONTENT_LENGTH': str(len(body))
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+
+    response_start = {}
+
+    def start_response(status, headers, exc_info=None):
+        response_start['status'] = int(status.split(' ', 1)[0])
+        response_start['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue()
+    stopped = threading.Event()
+    _passthrough_executor.submit(_pump_wsgi, environ, start_response, loop, chunks, stopped)
+    try:
+        while True:
+            chunk = await chunks.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if chunk is None:
+                break
+            if chunk is _STARTED:
+                await send({'type': 'http.response.start', **response_start})
+            elif chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        stopped.set()
+
+
+def _pump_wsgi(environ, start_response, loop, chunks, stopped):
+    """
+    Run the Flask app on a passthrough thread and hand its response to the event
+    loop: _STARTED, then the body chunks, then None (or the exception that ended it).
+    Stops reading once the ASGI side has stopped, e.g. because the client went away.
+    """
+    def put(item):
+        loop.call_soon_threadsafe(chunks.put_nowait, item)
+
+    try:
+        result = backend.app(environ, start_response)
+        try:
+            put(_STARTED)
+            for chunk in result:
+                if stopped.is_set():
+                    break
+                put(chunk)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        put(None)
+    except Exception as e:
+        put(e)
+
+
+async def asgi_app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # Resume jobs a previous process left queued, rather than waiting for the first job request
+                backend.job_queue.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if scope['type'] != 'http':
+        return
+
+    handler = ASYNC_ROUTES.get(scope['path'])
+    if handler is None or scope['method'] != 'POST':
+        return await _call_flask(scope, receive, send)
+
+    request = _Request(scope, receive)
+    body = await request.body()
+
+    try:
+        data = json.loads(body) if body else None
+    except ValueError:
+        data = None
+
+    # Pipelined website generation relies on the threaded pipeline, so let Flask serve it
+    if isinstance(data, dict) and data.get('pipelined') and scope['path'] == '/api/generate-website':
+        return await _call_flask(scope, receive, send, body)
+
+    # Job submissions are queued for the Flask app's job workers and answered straight away
+    if isinstance(data, dict) and data.get('job') and scope['path'] != '/api/modify-website':
+        return await _call_flask(scope, receive, send, body)
+
+    if not isinstance(data, dict) or not data:
+        return await _send_json(send, request, {'error': 'No JSON data received'}, 400)
+
+    REQUESTS.inc(endpoint=ENDPOINT_LABELS[scope['path']])
+    request.emit_timings = backend.wants_timings(data)
+    request.use_cache = backend.wants_cache(data)
+    request.client = backend.client_id(request.headers, (scope.get('client') or ('',))[0])
+    try:
+        await handler(send, request, data)
+    except Exception as e:
+        backend.note_throttling(e)
+        if backend.is_overload(e) and not request.response_started:
+            return await _send_overload(send, request, e)
+        ERRORS.inc(endpoint=ENDPOINT_LABELS[scope['path']], stage='request')
+        print(f"Error in {scope['path']}: {str(e)}")
+        traceback.print_exc()
+        if request.broadcast is not None:
+            # A request that was queued has already started its stream, so the error goes out as an event
+            await _send_frames(send, request, [backend.sse_event({'error': str(e)})])
+            await _finish_stream(send, request)
+        elif request.response_started:
+            await send({'type': 'http.response.body', 'body': b''})
+        else:
+            await _send_json(send, request, {'error': str(e), 'traceback': traceback.format_exc()}, 500)
+    finally:
+        if request.ticket is not None:
+            request.ticket.release()
+
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit("The asyncio server mode needs an ASGI server: pip install uvicorn")
+    uvicorn.run(asgi_app, host='0.0.0.0', port=int(os.getenv('PORT', 3001)))
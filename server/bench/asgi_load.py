@@ -0,0 +1,142 @@
+"""
+Compare how many concurrent generation streams the WSGI and ASGI modes sustain.
+
+Both modes are driven in-process against a fake Gemini model, with image
+lookups stubbed out, so only the serving model is measured:
+  * WSGI: requests run on a fixed pool of worker threads, like gunicorn/waitress
+    threads, and each stream holds its worker until the generation ends.
+  * ASGI: every request is a coroutine on one event loop.
+
+Usage:  python bench/asgi_load.py [--concurrency 10,100,1000] [--wsgi-workers 16] [--output results.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('GOOGLE_API_KEY', 'benchmark')
+os.environ.setdefault('SINGLE_FLIGHT', 'False')
+# Every request must reach the model: no cache replays, and no admission cap turning streams away with 429s
+os.environ.setdefault('GENERATION_CACHE_MODE', 'off')
+os.environ.setdefault('ADMISSION_MAX_ACTIVE', '0')
+
+import app as backend  # noqa: E402
+import asgi  # noqa: E402
+from fakes import FakeGenerativeModel  # noqa: E402
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(mode, concurrency, wall, outcomes):
+    """
+    outcomes are (ttfb, ok) pairs; only streams that got a 200 count
+    """
+    ttfbs = [ttfb for ttfb, ok in outcomes if ok]
+    return {
+        'mode': mode,
+        'concurrency': concurrency,
+        'wall_s': round(wall, 3),
+        'failed': len(outcomes) - len(ttfbs),
+        'streams_per_s': round(len(ttfbs) / wall, 1),
+        'ttfb_p50_ms': round(percentile(ttfbs, 50) * 1000, 1),
+        'ttfb_p99_ms': round(percentile(ttfbs, 99) * 1000, 1)
+    }
+
+
+def run_wsgi(concurrency, workers):
+    client = backend.app.test_client()
+
+    batch_started = time.perf_counter()
+
+    def one(index):
+        # Measured from when the whole batch arrived, so time spent queued for a worker counts
+        started = batch_started
+        response = client.post('/api/generate-website', json={'description': f"bakery site number {index}"}, buffered=False)
+        iterator = iter(response.response)
+        next(iterator, None)
+        ttfb = time.perf_counter() - started
+        for _ in iterator:
+            pass
+        response.close()
+        return ttfb, response.status_code == 200
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        outcomes = list(pool.map(one, range(concurrency)))
+    return summarize(f"wsgi({workers} workers)", concurrency, time.perf_counter() - batch_started, outcomes)
+
+
+async def _asgi_request(index):
+    body = json.dumps({'description': f"bakery site number {index}"}).encode()
+    scope = {
+        'type': 'http', 'method': 'POST', 'path': '/api/generate-website', 'query_string': b'',
+        'headers': [(b'content-type', b'application/json')]
+    }
+    received = [False]
+    never = asyncio.Event()
+
+    async def receive():
+        if not received[0]:
+            received[0] = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        await never.wait()
+
+    started = time.perf_counter()
+    first_body = []
+    status = []
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+        if message['type'] == 'http.response.body' and message.get('body') and not first_body:
+            first_body.append(time.perf_counter() - started)
+
+    await asgi.asgi_app(scope, receive, send)
+    return (first_body[0] if first_body else 0.0), status == [200]
+
+
+async def _run_asgi(concurrency):
+    started = time.perf_counter()
+    outcomes = await asyncio.gather(*[_asgi_request(i) for i in range(concurrency)])
+    return summarize('asgi', concurrency, time.perf_counter() - started, outcomes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', default='10,100,1000')
+    parser.add_argument('--wsgi-workers', type=int, default=16)
+    parser.add_argument('--first-chunk-delay', type=float, default=0.2)
+    parser.add_argument('--chunk-delay', type=float, default=0.01)
+    parser.add_argument('--output', help='write the JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    backend.model = FakeGenerativeModel(first_chunk_delay=args.first_chunk_delay, chunk_delay=args.chunk_delay)
+    # Only the serving model is under test here, not Unsplash
+    backend.fetch_images_for_topics = lambda topics, deadline=None: []
+
+    results = []
+    for concurrency in [int(value) for value in args.concurrency.split(',')]:
+        results.append(run_wsgi(concurrency, args.wsgi_workers))
+        results.append(asyncio.run(_run_asgi(concurrency)))
+        print(json.dumps(results[-2]), file=sys.stderr)
+        print(json.dumps(results[-1]), file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeUnsplashServer:
+    """
+    Local stand-in for api.unsplash.com/search/photos with configurable latency.
+    Point the app at it with UNSPLASH_API_URL=server.url before importing app.
+    It counts down an hourly `quota` in the X-Ratelimit-* headers and answers 429 once it is spent.
+    """
+
+    def __init__(self, latency=0.1, host='127.0.0.1', port=0, quota=5000):
+        self.latency = latency
+        self.quota = quota
+        self.requests = 0
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path != '/search/photos':
+                    self.send_error(404)
+                    return
+                fake.requests += 1
+                remaining = max(0, fake.quota - fake.requests)
+                time.sleep(fake.latency)
+                if fake.requests > fake.quota:
+                    body = b'Rate Limit Exceeded'
+                    self.send_response(429)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.send_header('X-Ratelimit-Limit', str(fake.quota))
+                    self.send_header('X-Ratelimit-Remaining', '0')
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                params = parse_qs(url.query)
+                query = params.get('query', ['photo'])[0]
+                per_page = int(params.get('per_page', ['10'])[0])
+                body = json.dumps({'total': per_page, 'results': [fake_photo(query, i) for i in range(per_page)]}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('X-Ratelimit-Limit', str(fake.quota))
+                self.send_header('X-Ratelimit-Remaining', str(remaining))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://{host}:{self.httpd.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name='fake-unsplash', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+
+
+def fake_photo(query, index):
+    slug = query.replace(' ', '-')
+    return {
+        'id': f"{slug}-{index}",
+        'description': f"{query} photo {index}",
+        'alt_description': f"{query} {index}",
+        'urls': {
+            'small': f"https://images.example.test/{slug}/{index}?w=400",
+            'regular': f"https://images.example.test/{slug}/{index}?w=1080",
+            'thumb': f"https://images.example.test/{slug}/{index}?w=200"
+        },
+        'user': {'name': 'Bench Photographer'},
+        'links': {'download': f"https://images.example.test/{slug}/{index}/download"}
+    }
@@ -0,0 +1,88 @@
+import asyncio
+import random
+import time
+
+# A small but complete site in the fenced format the prompts ask for
+SAMPLE_OUTPUT = (
+    "```html\n<header><h1>Benchmark Site</h1></header>\n<main>\n"
+    + "  <section class=\"card\"><h2>Section</h2><p>Some generated copy for the page.</p></section>\n" * 12
+    + "</main>\n```\n"
+    "```css\nbody {\n  margin: 0;\n  font-family: sans-serif;\n}\n"
+    + ".card {\n  padding: 16px;\n  border-radius: 8px;\n}\n" * 6
+    + "```\n"
+    "```javascript\ndocument.querySelectorAll('.card').forEach((card) => {\n"
+    "  card.addEventListener('click', () => card.classList.toggle('open'));\n});\n```\n"
+)
+
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGeminiError(Exception):
+    pass
+
+
+class FakeStream:
+    """
+    Stand-in for a streaming GenerateContentResponse, iterable both ways.
+    If fail_at is set, the stream raises after that many chunks.
+    """
+
+    def __init__(self, chunks, first_chunk_delay, chunk_delay, fail_at=None):
+        self.chunks = chunks
+        self.first_chunk_delay = first_chunk_delay
+        self.chunk_delay = chunk_delay
+        self.fail_at = fail_at
+        self.text = ''.join(chunks)
+
+    def __iter__(self):
+        for index, chunk in enumerate(self.chunks):
+            if index == self.fail_at:
+                raise FakeGeminiError('Injected stream error')
+            time.sleep(self.first_chunk_delay if index == 0 else self.chunk_delay)
+            yield FakeChunk(chunk)
+
+    async def __aiter__(self):
+        for index, chunk in enumerate(self.chunks):
+            if index == self.fail_at:
+                raise FakeGeminiError('Injected stream error')
+            await asyncio.sleep(self.first_chunk_delay if index == 0 else self.chunk_delay)
+            yield FakeChunk(chunk)
+
+
+class FakeGenerativeModel:
+    """
+    Drop-in replacement for genai.GenerativeModel that streams SAMPLE_OUTPUT
+    in chunks of `chunk_chars` characters without calling Gemini.
+
+    tokens_per_second, if given, sets the chunk delay assuming ~4 characters per token.
+    error_rate is the share of calls that fail before streaming starts, and
+    stream_error_rate the share that fail halfway through the stream.
+    """
+
+    def __init__(self, output=SAMPLE_OUTPUT, chunk_chars=40, first_chunk_delay=0.2, chunk_delay=0.01,
+                 tokens_per_second=None, error_rate=0.0, stream_error_rate=0.0, seed=None):
+        self.output = output
+        self.chunk_chars = chunk_chars
+        self.first_chunk_delay = first_chunk_delay
+        self.chunk_delay = chunk_chars / 4 / tokens_per_second if tokens_per_second else chunk_delay
+        self.error_rate = error_rate
+        self.stream_error_rate = stream_error_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+
+    def _stream(self):
+        self.calls += 1
+        if self.random.random() < self.error_rate:
+            raise FakeGeminiError('Injected upstream error')
+        chunks = [self.output[i:i + self.chunk_chars] for i in range(0, len(self.output), self.chunk_chars)]
+        fail_at = len(chunks) // 2 if self.random.random() < self.stream_error_rate else None
+        return FakeStream(chunks, self.first_chunk_delay, self.chunk_delay, fail_at)
+
+    def generate_content(self, prompt, generation_config=None, stream=False, **kwargs):
+        return self._stream()
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False, **kwargs):
+        return self._stream()
@@ -0,0 +1,85 @@
+"""
+Measure what SSE frame coalescing and gzip do to a generation stream.
+
+Streams the fake Gemini output through stream_response with coalescing
+off (one event per model chunk) and with the given coalescing settings,
+in both response modes, and reports events per response, bytes on the
+wire with and without gzip, time to the first event and total time.
+
+Usage:  python bench/framing_bench.py [--chunk-chars 12] [--tokens-per-second 200]
+                                      [--coalesce-bytes 256] [--flush-interval 0.05] [--output results.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('GOOGLE_API_KEY', 'benchmark')
+
+import app as backend  # noqa: E402
+from fakes import FakeGenerativeModel  # noqa: E402
+from framing import gzip_frames  # noqa: E402
+
+
+def run_stream(model, response_mode, coalesce_bytes, flush_interval):
+    backend.SSE_COALESCE_BYTES = coalesce_bytes
+    backend.SSE_FLUSH_INTERVAL = flush_interval
+
+    started = time.perf_counter()
+    first_event = None
+    frames = []
+    for frame in backend.stream_response(model.generate_content(''), response_mode):
+        if first_event is None:
+            first_event = time.perf_counter() - started
+        frames.append(frame)
+    total = time.perf_counter() - started
+
+    return {
+        'events': len(frames),
+        'bytes': sum(len(frame.encode('utf-8')) for frame in frames),
+        'gzip_bytes': sum(len(part) for part in gzip_frames(frames)),
+        'first_event_ms': round(first_event * 1000, 1),
+        'total_ms': round(total * 1000, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chunk-chars', type=int, default=12, help='characters per fake model chunk')
+    parser.add_argument('--tokens-per-second', type=float, default=200.0)
+    parser.add_argument('--first-token-delay', type=float, default=0.1)
+    parser.add_argument('--coalesce-bytes', type=int, default=256)
+    parser.add_argument('--flush-interval', type=float, default=0.05)
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    args = parser.parse_args()
+
+    model = FakeGenerativeModel(
+        chunk_chars=args.chunk_chars,
+        first_chunk_delay=args.first_token_delay,
+        tokens_per_second=args.tokens_per_second
+    )
+
+    report = {'config': {key: value for key, value in vars(args).items() if key != 'output'}, 'modes': {}}
+    for response_mode in backend.RESPONSE_MODES:
+        baseline = run_stream(model, response_mode, 0, 0.0)
+        coalesced = run_stream(model, response_mode, args.coalesce_bytes, args.flush_interval)
+        report['modes'][response_mode] = {
+            'per_chunk': baseline,
+            'coalesced': coalesced,
+            'events_saved_pct': round((1 - coalesced['events'] / baseline['events']) * 100, 1),
+            'bytes_saved_pct': round((1 - coalesced['bytes'] / baseline['bytes']) * 100, 1),
+            'gzip_bytes_saved_pct': round((1 - coalesced['gzip_bytes'] / baseline['bytes']) * 100, 1)
+        }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
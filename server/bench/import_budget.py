@@ -0,0 +1,76 @@
+"""
+Check the cold-start import cost of the Vercel entry point.
+
+Imports vercel.py in fresh interpreters with -X importtime and reports the
+median total import time and the slowest modules. Exits non-zero if the
+median goes over the budget, or if a module that should only load on first
+use (the Gemini SDK, requests) is imported eagerly.
+
+Usage:  python bench/import_budget.py [--budget-ms 400] [--runs 5] [--top 10] [--output results.json]
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loaded on first use by get_model() and get_unsplash_client(), never at import
+DEFERRED_MODULES = ('google.generativeai', 'grpc', 'requests')
+
+_LINE_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def import_once(entry_module):
+    env = dict(os.environ, GOOGLE_API_KEY=os.environ.get('GOOGLE_API_KEY', 'import-budget'))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {entry_module}"],
+        cwd=SERVER_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if match:
+            self_us, cumulative_us, _, name = match.groups()
+            modules[name] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entry', default='vercel', help='module to import')
+    parser.add_argument('--budget-ms', type=float, default=400.0)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='slowest modules to list')
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    args = parser.parse_args()
+
+    runs = [import_once(args.entry) for _ in range(args.runs)]
+    totals = [modules[args.entry][1] / 1000 for modules in runs]
+    last = runs[-1]
+    eager = [name for name in DEFERRED_MODULES if name in last]
+    slowest = sorted(last.items(), key=lambda item: item[1][0], reverse=True)[:args.top]
+
+    report = {
+        'entry': args.entry,
+        'budget_ms': args.budget_ms,
+        'median_ms': round(statistics.median(totals), 1),
+        'runs_ms': [round(total, 1) for total in totals],
+        'eager_deferred_modules': eager,
+        'slowest_modules_ms': {name: round(self_us / 1000, 2) for name, (self_us, _) in slowest}
+    }
+    report['ok'] = report['median_ms'] <= args.budget_ms and not eager
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    return 0 if report['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
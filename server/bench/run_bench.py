@@ -0,0 +1,244 @@
+"""
+Offline load test for the generation endpoints.
+
+Starts a fake Unsplash server and the Flask app (with a fake streaming
+Gemini model) on local ports, then drives /api/generate-website,
+/api/modify-website and /api/generate-application over real HTTP at the
+requested concurrency. No Gemini quota or Unsplash key is used.
+
+For every endpoint it reports TTFB, time to first section (first html
+content), total duration, throughput and error counts, with mean and
+p50/p95/p99 in milliseconds. Results are JSON tagged with the current git
+commit, so runs on different commits can be compared:
+
+    python bench/run_bench.py --output before.json
+    git checkout <other commit>
+    python bench/run_bench.py --output after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_unsplash import FakeUnsplashServer  # noqa: E402
+from fakes import FakeGenerativeModel  # noqa: E402
+
+ENDPOINTS = {
+    'website': '/api/generate-website',
+    'modify': '/api/modify-website',
+    'application': '/api/generate-application'
+}
+
+SUBJECTS = ['bakery', 'yoga studio', 'hiking club', 'coffee roaster', 'law firm', 'dog groomer',
+            'florist', 'bike shop', 'dental clinic', 'jazz bar', 'surf school', 'bookstore']
+
+# Lower is better for every metric except throughput
+METRICS = ('ttfb_ms', 'first_section_ms', 'total_ms')
+
+
+def make_payload(endpoint, index, response_mode, identical):
+    subject = SUBJECTS[0] if identical else f"{SUBJECTS[index % len(SUBJECTS)]} #{index}"
+    if endpoint == 'website':
+        return {'description': f"A website for a {subject}", 'responseMode': response_mode}
+    if endpoint == 'application':
+        return {'description': f"A memory card game themed around a {subject}", 'responseMode': response_mode}
+    return {
+        'modificationDescription': f"Add a testimonials section for the {subject}",
+        'currentHtml': '<header><h1>Site</h1></header>\n<main><p>Welcome</p></main>',
+        'currentCss': 'body { margin: 0; }',
+        'currentJs': '',
+        'responseMode': response_mode
+    }
+
+
+def run_request(base_url, endpoint, payload):
+    """
+    POST one request and time its stream. Times are in seconds from the start of the request.
+    """
+    result = {'ok': False, 'ttfb': None, 'first_section': None, 'total': None, 'bytes': 0}
+    started = time.perf_counter()
+    try:
+        with requests.post(base_url + ENDPOINTS[endpoint], json=payload, stream=True, timeout=120) as response:
+            if response.status_code != 200:
+                result['error'] = f"HTTP {response.status_code}"
+                return result
+            seen = ''
+            for chunk in response.iter_content(chunk_size=None):
+                now = time.perf_counter() - started
+                if result['ttfb'] is None:
+                    result['ttfb'] = now
+                result['bytes'] += len(chunk)
+                if result['first_section'] is None:
+                    # The end of the previous chunk is kept so a marker split between chunks is still found
+                    seen = seen[-64:] + chunk.decode('utf-8', 'replace')
+                    if '"section": "html", "delta"' in seen or '```html' in seen:
+                        result['first_section'] = now
+                if b'"error"' in chunk:
+                    result['error'] = 'error event'
+            result['total'] = time.perf_counter() - started
+            result['ok'] = 'error' not in result
+    except requests.RequestException as e:
+        result['error'] = str(e)
+    return result
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def distribution(values):
+    values = [value * 1000 for value in values if value is not None]
+    if not values:
+        return None
+    return {
+        'mean': round(statistics.mean(values), 1),
+        'p50': round(percentile(values, 50), 1),
+        'p95': round(percentile(values, 95), 1),
+        'p99': round(percentile(values, 99), 1),
+        'max': round(max(values), 1)
+    }
+
+
+def summarize(results, wall):
+    ok = [result for result in results if result['ok']]
+    errors = {}
+    for result in results:
+        if not result['ok']:
+            errors[result.get('error', 'unknown')] = errors.get(result.get('error', 'unknown'), 0) + 1
+    return {
+        'requests': len(results),
+        'ok': len(ok),
+        'errors': errors,
+        'wall_s': round(wall, 3),
+        'throughput_rps': round(len(ok) / wall, 2) if wall else 0.0,
+        'throughput_kbps': round(sum(result['bytes'] for result in results) / 1024 / wall, 1) if wall else 0.0,
+        'ttfb_ms': distribution([result['ttfb'] for result in ok]),
+        'first_section_ms': distribution([result['first_section'] for result in ok]),
+        'total_ms': distribution([result['total'] for result in ok])
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=SERVER_DIR, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(current, baseline):
+    """
+    Print the relative change of each p50/p95/p99 against a baseline run
+    """
+    for endpoint, stats in current['endpoints'].items():
+        base = baseline.get('endpoints', {}).get(endpoint)
+        if not base:
+            continue
+        print(f"\n{endpoint} (vs {baseline.get('commit')})", file=sys.stderr)
+        for metric in METRICS:
+            if not stats.get(metric) or not base.get(metric):
+                continue
+            changes = []
+            for pct in ('p50', 'p95', 'p99'):
+                before, after = base[metric][pct], stats[metric][pct]
+                change = (after - before) / before * 100 if before else 0.0
+                changes.append(f"{pct} {before:.0f}->{after:.0f}ms ({change:+.1f}%)")
+            print(f"  {metric:<17} " + ', '.join(changes), file=sys.stderr)
+        before, after = base['throughput_rps'], stats['throughput_rps']
+        print(f"  {'throughput_rps':<17} {before} -> {after}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoints', default='website,modify,application')
+    parser.add_argument('--requests', type=int, default=40, help='requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--response-mode', default='raw', choices=['raw', 'sections'])
+    parser.add_argument('--identical', action='store_true', help='send the same description every time')
+    parser.add_argument('--first-token-delay', type=float, default=0.3, help='fake Gemini delay before the first chunk (s)')
+    parser.add_argument('--tokens-per-second', type=float, default=400.0, help='fake Gemini streaming rate')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of Gemini calls that fail up front')
+    parser.add_argument('--stream-error-rate', type=float, default=0.0, help='share of Gemini streams that fail midway')
+    parser.add_argument('--unsplash-latency', type=float, default=0.15, help='fake Unsplash response time (s)')
+    parser.add_argument('--generation-cache', default='off', choices=['off', 'replay', 'seed'],
+                        help='GENERATION_CACHE_MODE for the app (off measures every generation)')
+    parser.add_argument('--admission-max-active', type=int, default=0,
+                        help='ADMISSION_MAX_ACTIVE for the app (0, the default, measures without admission control)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    parser.add_argument('--compare', help='baseline JSON results to compare against')
+    args = parser.parse_args()
+
+    # The fake Unsplash server must be up before app.py builds its Unsplash client
+    unsplash = FakeUnsplashServer(latency=args.unsplash_latency).start()
+    os.environ['UNSPLASH_API_URL'] = unsplash.url
+    os.environ.setdefault('GOOGLE_API_KEY', 'benchmark')
+    os.environ['GENERATION_CACHE_MODE'] = args.generation_cache
+    os.environ['ADMISSION_MAX_ACTIVE'] = str(args.admission_max_active)
+
+    import app as backend
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    backend.model = FakeGenerativeModel(
+        first_chunk_delay=args.first_token_delay,
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        stream_error_rate=args.stream_error_rate,
+        seed=args.seed
+    )
+
+    httpd = make_server('127.0.0.1', 0, backend.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=httpd.serve_forever, name='bench-server', daemon=True).start()
+    base_url = f"http://127.0.0.1:{httpd.server_port}"
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'endpoints': {}
+    }
+
+    for endpoint in args.endpoints.split(','):
+        endpoint = endpoint.strip()
+        payloads = [make_payload(endpoint, i, args.response_mode, args.identical) for i in range(args.requests)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(lambda payload: run_request(base_url, endpoint, payload), payloads))
+        report['endpoints'][endpoint] = summarize(results, time.perf_counter() - started)
+
+    report['upstream'] = {'gemini_calls': backend.model.calls, 'unsplash_requests': unsplash.requests}
+    httpd.shutdown()
+    unsplash.stop()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict, deque
+from itertools import islice
+
+from framing import HEARTBEAT_FRAME
+
+
+def tag_frame(event_id, frame):
+    """
+    Prefix an SSE frame with its event id, so clients can resume after it with Last-Event-ID
+    """
+    return f"id: {event_id}\n{frame}"
+
+
+class Broadcast:
+    """
+    Buffers the frames of one upstream stream and replays them to any number of subscribers.
+
+    Every frame gets a monotonically increasing event id. Subscribers that
+    join late, or reconnect with the last id they saw, first receive
+    everything buffered after it. The buffer is a ring of at most
+    `max_frames` frames, so a subscriber can only resume from a frame that
+    hasn't been dropped yet.
+
+    Besides subscribe(), which blocks a thread per subscriber, listen() takes
+    a callback to run whenever a frame is published or the stream finishes,
+    for subscribers on an event loop that read() the new frames themselves.
+    """
+
+    def __init__(self, key=None, max_frames=None):
+        self.key = key
+        self.generation_id = uuid.uuid4().hex
+        self.subscribers = 0  # currently following the stream
+        self.size = 0  # characters held in the buffer
+        self.finished_at = None
+        self._frames = deque()  # (event id, frame)
+        self._next_id = 1
+        self._max_frames = max_frames
+        self._done = False
+        self._listeners = []
+        self._cond = threading.Condition()
+
+    def publish(self, frame):
+        with self._cond:
+            event_id = self._next_id
+            self._next_id += 1
+            self._frames.append((event_id, frame))
+            self.size += len(frame)
+            if self._max_frames and len(self._frames) > self._max_frames:
+                _, dropped = self._frames.popleft()
+                self.size -= len(dropped)
+            self._cond.notify_all()
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener()
+        return event_id
+
+    def finish(self):
+        with self._cond:
+            self._done = True
+            self.finished_at = time.time()
+            self._cond.notify_all()
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener()
+
+    def listen(self, callback):
+        with self._cond:
+            self.subscribers += 1
+            self._listeners.append(callback)
+
+    def unlisten(self, callback):
+        with self._cond:
+            self.subscribers -= 1
+            self._listeners.remove(callback)
+
+    def read(self, last_event_id):
+        """
+        The (event id, frame) pairs after last_event_id, or None if some were
+        already dropped from the ring, and whether the stream has finished
+        """
+        with self._cond:
+            start = last_event_id + 1 - self._first_id()
+            frames = list(islice(self._frames, start, None)) if start >= 0 else None
+            return frames, self._done
+
+    def can_resume(self, last_event_id):
+        with self._cond:
+            return last_event_id + 1 >= self._first_id()
+
+    def subscribe(self, last_event_id=0, heartbeat=None):
+        """
+        Iterate over the id-tagged frames after last_event_id, following the stream until it finishes.
+        A heartbeat comment is yielded whenever no frame arrives for `heartbeat` seconds.
+        """
+        return self._iterate(last_event_id, heartbeat or None)
+
+    def _first_id(self):
+        return self._frames[0][0] if self._frames else self._next_id
+
+    def _iterate(self, last_event_id, heartbeat):
+        # Counted from the first read until the stream ends or the subscriber goes away
+        with self._cond:
+            self.subscribers += 1
+        try:
+            yield from self._follow(last_event_id, heartbeat)
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+
+    def _follow(self, last_event_id, heartbeat):
+        while True:
+            with self._cond:
+                idle = False
+                while self._next_id - 1 <= last_event_id and not self._done:
+                    if not self._cond.wait(timeout=heartbeat):
+                        idle = True
+                        break
+                if not idle:
+                    start = last_event_id + 1 - self._first_id()
+                    frames = list(islice(self._frames, start, None)) if start >= 0 else None
+                    done = self._done
+            if idle:
+                yield HEARTBEAT_FRAME
+                continue
+            if frames is None:
+                # Fell further behind than the ring holds; the client can reconnect and gets a clear error
+                print(f"Subscriber to generation {self.generation_id} fell behind the replay buffer")
+                return
+            for event_id, frame in frames:
+                last_event_id = event_id
+                yield tag_frame(event_id, frame)
+            if done:
+                return
+
+
+class ReplayStore:
+    """
+    Keeps generations by id so clients can reconnect and resume them.
+
+    Finished generations are dropped `ttl` seconds after they end, and the
+    oldest finished ones go first whenever the buffers together hold more
+    than `max_bytes`. Running generations are never dropped; their ring
+    buffers bound them instead.
+    """
+
+    def __init__(self, max_frames=2048, ttl=300.0, max_bytes=64 * 1024 * 1024):
+        self.max_frames = max_frames
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._broadcasts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, key=None):
+        broadcast = Broadcast(key, self.max_frames)
+        with self._lock:
+            self._broadcasts[broadcast.generation_id] = broadcast
+        self.evict()
+        return broadcast
+
+    def get(self, generation_id):
+        self.evict()
+        with self._lock:
+            return self._broadcasts.get(generation_id)
+
+    def evict(self):
+        now = time.time()
+        with self._lock:
+            finished = [b for b in self._broadcasts.values() if b.finished_at is not None]
+            total = sum(b.size for b in self._broadcasts.values())
+            for broadcast in sorted(finished, key=lambda b: b.finished_at):
+                if now - broadcast.finished_at < self.ttl and total <= self.max_bytes:
+                    break
+                del self._broadcasts[broadcast.generation_id]
+                total -= broadcast.size
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'generations': len(self._broadcasts),
+                'running': sum(1 for b in self._broadcasts.values() if b.finished_at is None),
+                'subscribers': sum(b.subscribers for b in self._broadcasts.values()),
+                'bytes': sum(b.size for b in self._broadcasts.values()),
+                'evictions': self.evictions
+            }
+
+
+class SingleFlight:
+    """
+    Collapses concurrent identical generations into one upstream call.
+
+    The first caller for a key (the leader) runs prepare() inline, on the
+    calling thread, so set-up errors reach it as exceptions; followers that
+    joined meanwhile get error_frame(e). prepare() returns an iterator of
+    frames, which a background thread pumps into a Broadcast
+    that the leader and every follower subscribe to. The key is released once
+    the upstream stream finishes, so later requests start a fresh generation.
+
+    Because the pump doesn't depend on any client, a generation keeps running
+    when its clients disconnect, and stays in the replay store for them to
+    resume. A key of None never shares its generation. The first frame of
+    every generation is announce(generation_id). Subscribers get a heartbeat
+    comment after `heartbeat` idle seconds.
+    """
+
+    def __init__(self, error_frame, replay_store=None, announce=None, heartbeat=None):
+        self.error_frame = error_frame
+        self.replay_store = replay_store or ReplayStore()
+        self.announce = announce
+        self.heartbeat = heartbeat
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def run(self, key, prepare):
+        with self._lock:
+            flight = self._flights.get(key) if key is not None else None
+            if flight is not None:
+                self.followers += 1
+                print(f"Joining in-flight generation for {key!r}")
+                return flight.subscribe(heartbeat=self.heartbeat)
+            flight = self.replay_store.create(key)
+            if key is not None:
+                self._flights[key] = flight
+            self.leaders += 1
+
+        if self.announce:
+            flight.publish(self.announce(flight.generation_id))
+
+        try:
+            frames = prepare()
+        except Exception as e:
+            # Followers that joined during set-up get the error as their last frame
+            flight.publish(self.error_frame(e))
+            flight.finish()
+            self._release(key, flight)
+            raise
+
+        subscription = flight.subscribe(heartbeat=self.heartbeat)
+        threading.Thread(
+            target=self._pump, args=(key, flight, frames), name='single-flight', daemon=True
+        ).start()
+        return subscription
+
+    def _pump(self, key, flight, frames):
+        try:
+            for frame in frames:
+                flight.publish(frame)
+        except Exception as e:
+            print(f"Error in single-flight stream {key!r}: {str(e)}")
+            traceback.print_exc()
+            flight.publish(self.error_frame(e))
+        finally:
+            flight.finish()
+            self._release(key, flight)
+
+    def record(self, follower):
+        """
+        Count a generation shared outside run(), by the asyncio server (see asgi.py)
+        """
+        with self._lock:
+            if follower:
+                self.followers += 1
+            else:
+                self.leaders += 1
+
+    def _release(self, key, flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'leaders': self.leaders,
+                'followers': self.followers
+            }
+
+
+def create_replay_store_from_env():
+    """
+    Build the process-wide replay store from STREAM_REPLAY_* environment variables.
+    """
+    return ReplayStore(
+        max_frames=int(os.getenv('STREAM_REPLAY_FRAMES', '2048')),
+        ttl=float(os.getenv('STREAM_REPLAY_TTL', '300')),
+        max_bytes=int(float(os.getenv('STREAM_REPLAY_MAX_MB', '64')) * 1024 * 1024)
+    )
@@ -1,2 +1,4 @@
 #!/bin/bash
 pip install -r requirements.txt
+# Fails the build if importing the entry point gets slow or loads the Gemini SDK eagerly
+python bench/import_budget.py --runs 3
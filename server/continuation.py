@@ -0,0 +1,175 @@
+from fence_parser import SECTION_NAMES, FenceParser, fence_language
+from metrics import CONTINUATIONS
+
+# Characters of a continuation held back before deciding how much of it repeats the output
+OVERLAP_WINDOW = 400
+
+# Shorter repeats are kept unless they are whole lines with more than brackets on them, since they are as
+# likely to be new text that happens to match (a closing brace usually is)
+MIN_OVERLAP = 8
+
+# Characters that a repeated short line needs more than to count as repeated
+_BRACKETS = set('{}[]();, \t\n')
+
+# Gemini FinishReason values, for responses that report them as plain integers
+_FINISH_REASONS = {1: 'STOP', 2: 'MAX_TOKENS', 3: 'SAFETY', 4: 'RECITATION', 5: 'OTHER'}
+
+
+def chunk_text(chunk):
+    try:
+        return chunk.text
+    except (AttributeError, ValueError):
+        # Chunks without a text part, such as a last chunk that only carries the finish reason
+        return ''
+
+
+def finish_reason(chunk):
+    """
+    Name of a chunk's finish reason, or None while the candidate is still going
+    """
+    for candidate in getattr(chunk, 'candidates', None) or []:
+        reason = getattr(candidate, 'finish_reason', None)
+        if reason:
+            return getattr(reason, 'name', None) or _FINISH_REASONS.get(reason, str(reason))
+    return None
+
+
+def build_continuation_prompt(prompt, tail):
+    return f"""{prompt}
+
+    Your previous response to this was cut off before it was finished. It ended with:
+    <<<
+{tail}
+    >>>
+    Continue from exactly where it stops. Do not repeat any of the text above and do not
+    start the current code block again. Close every code block as the format requires.
+    """
+
+
+def repeated_length(tail, text):
+    """
+    How much of the start of text repeats the end of tail.
+
+    Generated code is often repetitive, so several lengths can match; the
+    shortest is taken, since a longer match would drop new text. Matches
+    under MIN_OVERLAP only count if they are whole lines, which is where a
+    model that repeats itself usually restarts, and not just brackets.
+    """
+    for length in range(1, min(len(tail), len(text)) + 1):
+        if tail.endswith(text[:length]) and (length >= MIN_OVERLAP or _repeats_a_line(tail, text, length)):
+            return length
+    return 0
+
+
+def _repeats_a_line(tail, text, length):
+    repeated = text[:length]
+    starts_line = tail[-length - 1:-length] == '\n'
+    ends_line = repeated.endswith('\n') or text[length:length + 1] in ('\n', '')
+    return starts_line and ends_line and any(char not in _BRACKETS for char in repeated)
+
+
+class Stitcher:
+    """
+    Joins a generation and its continuations into one text.
+
+    feed() passes text through while keeping the tail of the output and
+    tracking its code fences, so end() can tell whether the response was
+    cut short: by the MAX_TOKENS finish reason, or by ending inside a fence.
+    Up to max_continuations follow-ups are allowed.
+
+    The start of each continuation is held back until OVERLAP_WINDOW
+    characters have arrived. Any text it repeats from the end of the output
+    is then dropped, as is an opening fence for the section in progress.
+    """
+
+    def __init__(self, max_continuations=2, tail_chars=2000, endpoint='stream'):
+        self.max_continuations = max_continuations
+        self.tail_chars = tail_chars
+        self.endpoint = endpoint
+        self.continuations = 0
+        self.finish_reason = None
+        self.tail = ''
+        self._parser = FenceParser()
+        self._held = None  # start of the current continuation, until its overlap is resolved
+
+    def feed(self, chunk):
+        self.finish_reason = finish_reason(chunk) or self.finish_reason
+        text = chunk_text(chunk)
+        if self._held is not None:
+            self._held += text
+            if len(self._held) < OVERLAP_WINDOW:
+                return ''
+            text = self._resolve_overlap()
+        return self._accept(text)
+
+    def end(self):
+        """
+        Finish the current response. Returns any text still held back, and the
+        reason for a continuation if one should follow (otherwise None).
+        """
+        text = self._accept(self._resolve_overlap()) if self._held is not None else ''
+        if self.finish_reason == 'MAX_TOKENS':
+            reason = 'max_tokens'
+        elif self._parser.unterminated:
+            reason = 'unclosed_fence'
+        else:
+            return text, None
+
+        if self.continuations >= self.max_continuations:
+            print(f"Output still cut short ({reason}) after {self.continuations} continuations")
+            return text, None
+        self.continuations += 1
+        self.finish_reason = None
+        self._held = ''
+        CONTINUATIONS.inc(endpoint=self.endpoint, reason=reason)
+        print(f"Output cut short ({reason}), requesting continuation {self.continuations} of {self.max_continuations}")
+        return text, reason
+
+    def _accept(self, text):
+        if text:
+            self._parser.feed(text)
+            self.tail = (self.tail + text)[-self.tail_chars:]
+        return text
+
+    def _resolve_overlap(self):
+        text, self._held = self._held, None
+        first_line, newline, rest = text.partition('\n')
+        language = fence_language(first_line) if newline else None
+        if language and self._parser.in_fence and SECTION_NAMES.get(language) == self._parser.section:
+            text = rest
+        return text[repeated_length(self.tail, text):]
+
+
+def continued_texts(response, stitcher, continue_with):
+    """
+    Texts of a Gemini stream, followed by those of its continuations while
+    the output is cut short. continue_with(tail) starts the next stream.
+    """
+    while True:
+        for chunk in response:
+            text = stitcher.feed(chunk)
+            if text:
+                yield text
+        text, reason = stitcher.end()
+        if text:
+            yield text
+        if reason is None:
+            return
+        response = continue_with(stitcher.tail)
+
+
+async def acontinued_texts(response, stitcher, continue_with):
+    """
+    continued_texts for async Gemini streams; continue_with(tail) is a coroutine
+    """
+    while True:
+        async for chunk in response:
+            text = stitcher.feed(chunk)
+            if text:
+                yield text
+        text, reason = stitcher.end()
+        if text:
+            yield text
+        if reason is None:
+            return
+        response = await continue_with(stitcher.tail)
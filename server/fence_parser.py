@@ -0,0 +1,132 @@
+import re
+
+# Fence info strings the frontend understands, mapped to the section names it uses
+SECTION_NAMES = {
+    'html': 'html',
+    'css': 'css',
+    'javascript': 'js',
+    'js': 'js'
+}
+
+_FENCE_RE = re.compile(r"^[ \t]*```[ \t]*([A-Za-z0-9_+-]*)[ \t]*\r?$")
+
+
+def fence_language(line):
+    """
+    The info string of a fence line ('' for a closing fence), or None if the line isn't a fence
+    """
+    match = _FENCE_RE.match(line)
+    return match.group(1).lower() if match else None
+
+
+class FenceParser:
+    """
+    Incremental parser for the ```html / ```css / ```javascript blocks in a model response.
+
+    Each chunk is scanned once, so the total cost is linear in the output size.
+    Only a line that might still turn out to be a fence is held back between
+    chunks, which lets fences split across chunk boundaries parse correctly.
+
+    feed() and close() return a list of events:
+        {'section': 'css', 'event': 'section_start'}
+        {'section': 'css', 'delta': '...'}
+        {'section': 'css', 'event': 'section_end'}
+    Text outside a recognised fence is dropped.
+    """
+
+    def __init__(self):
+        self.section = None  # Current section name, or None outside a fence
+        self.in_fence = False  # True inside any fence, including unrecognised languages
+        self._pending = ''  # Start of a line that may be a fence
+        self._at_line_start = True
+        self.sections_seen = []
+
+    def feed(self, text):
+        events = []
+        if not text:
+            return events
+
+        text = self._pending + text
+        self._pending = ''
+        pos = 0
+        length = len(text)
+
+        while pos < length:
+            newline = text.find('\n', pos)
+
+            if self._at_line_start:
+                line_end = length if newline == -1 else newline
+                line = text[pos:line_end]
+                stripped = line.lstrip(' \t')
+
+                if newline == -1 and (stripped.startswith('```') or '```'.startswith(stripped)):
+                    # Might be a fence but the line isn't finished yet, wait for more text
+                    self._pending = line
+                    break
+
+                match = _FENCE_RE.match(line) if stripped.startswith('```') else None
+                if match:
+                    self._handle_fence(match.group(1).lower(), events)
+                    pos = line_end + 1
+                    continue
+
+            # Ordinary content up to and including the next newline
+            end = length if newline == -1 else newline + 1
+            self._emit(text[pos:end], events)
+            self._at_line_start = newline != -1
+            pos = end
+
+        return events
+
+    @property
+    def unterminated(self):
+        """
+        True if the text so far ends inside a fence. A closing fence that is
+        still held back waiting for its newline counts as closed.
+        """
+        return self.in_fence and fence_language(self._pending) != ''
+
+    def close(self):
+        """
+        Flush anything held back and end an unterminated section.
+        """
+        events = []
+        if self._pending:
+            pending, self._pending = self._pending, ''
+            match = _FENCE_RE.match(pending)
+            if match:
+                self._handle_fence(match.group(1).lower(), events)
+            else:
+                self._emit(pending, events)
+        if self.section:
+            events.append({'section': self.section, 'event': 'section_end'})
+            self.section = None
+        self.in_fence = False
+        return events
+
+    def _handle_fence(self, language, events):
+        if self.in_fence and not language:
+            # Closing fence
+            if self.section:
+                events.append({'section': self.section, 'event': 'section_end'})
+            self.section = None
+            self.in_fence = False
+            return
+
+        # Opening fence. A new opening fence also ends an unterminated section.
+        if self.section:
+            events.append({'section': self.section, 'event': 'section_end'})
+        self.in_fence = True
+        self.section = SECTION_NAMES.get(language)
+        if self.section:
+            self.sections_seen.append(self.section)
+            events.append({'section': self.section, 'event': 'section_start'})
+
+    def _emit(self, delta, events):
+        if not self.section or not delta:
+            return
+        # Merge consecutive deltas from the same chunk into a single event
+        if events and events[-1].get('section') == self.section and 'delta' in events[-1]:
+            events[-1]['delta'] += delta
+        else:
+            events.append({'section': self.section, 'delta': delta})
@@ -0,0 +1,123 @@
+import queue
+import threading
+import zlib
+
+# SSE comment line; clients ignore it, but it keeps idle proxies from closing the stream
+HEARTBEAT_FRAME = ": keep-alive\n\n"
+
+_END = object()
+
+
+class FrameCoalescer:
+    """
+    Merges generated text into fewer SSE events.
+
+    Pending text is flushed once it reaches `min_bytes` or has waited
+    `flush_interval` seconds, whichever comes first. The first text always
+    goes out straight away so coalescing never delays the first byte.
+    Consecutive deltas of the same section are merged into one event; any
+    other event ends the merge. With min_bytes=0 every item is flushed as it
+    arrives.
+    """
+
+    def __init__(self, min_bytes=0, flush_interval=0.0):
+        self.min_bytes = min_bytes
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.pending_bytes = 0
+        self.pending_since = None
+        self.flushed = False
+
+    def add(self, event, now):
+        if 'delta' in event and self.pending and self.pending[-1].get('section') == event.get('section') \
+                and 'delta' in self.pending[-1]:
+            self.pending[-1] = dict(self.pending[-1], delta=self.pending[-1]['delta'] + event['delta'])
+        elif 'text' in event and self.pending and 'text' in self.pending[-1]:
+            self.pending[-1] = {'text': self.pending[-1]['text'] + event['text']}
+        else:
+            self.pending.append(event)
+        self.pending_bytes += len(event.get('delta') or event.get('text') or '')
+        if self.pending_since is None:
+            self.pending_since = now
+
+    def due(self, now):
+        if not self.pending:
+            return False
+        return (not self.flushed or self.pending_bytes >= self.min_bytes
+                or now - self.pending_since >= self.flush_interval)
+
+    def flush(self):
+        events = self.pending
+        self.pending = []
+        self.pending_bytes = 0
+        self.pending_since = None
+        if events:
+            self.flushed = True
+        return events
+
+
+def with_ticks(iterable, interval):
+    """
+    Iterate in a helper thread and yield None whenever nothing has arrived
+    for `interval` seconds, so time-based flushes can happen while the
+    upstream is slow. Without an interval the iterable is returned unchanged.
+    """
+    if not interval:
+        return iter(iterable)
+    return _ticking(iterable, interval)
+
+
+def _ticking(iterable, interval):
+    items = queue.Queue()
+
+    def pump():
+        try:
+            for item in iterable:
+                items.put(item)
+            items.put(_END)
+        except Exception as e:
+            items.put(e)
+
+    threading.Thread(target=pump, name='stream-ticker', daemon=True).start()
+    while True:
+        try:
+            item = items.get(timeout=interval)
+        except queue.Empty:
+            yield None
+            continue
+        if item is _END:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+def accepts_gzip(accept_encoding):
+    for coding in (accept_encoding or '').split(','):
+        name, _, params = coding.strip().partition(';')
+        if name.strip().lower() == 'gzip' and params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            return True
+    return False
+
+
+class GzipStream:
+    """
+    Incremental gzip for an event stream. Every write is sync-flushed so the
+    client can decode each frame as soon as it arrives.
+    """
+
+    def __init__(self, level=6):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, text):
+        return self._compressor.compress(text.encode('utf-8')) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+def gzip_frames(frames, level=6):
+    stream = GzipStream(level)
+    for frame in frames:
+        yield stream.compress(frame)
+    yield stream.finish()
@@ -0,0 +1,245 @@
+"""
+Cache of completed generations, found by description similarity rather
+than exact text, so "a portfolio site for a photographer" can reuse what
+was generated for "photographer portfolio website".
+
+Descriptions are reduced to a set of normalized words (stop words dropped,
+site/website/page and the like folded together, plurals trimmed). A MinHash
+signature of that set is split into LSH bands, and entries sharing a band
+with the query are the candidates. Their exact Jaccard similarity to the
+query decides whether the best one is close enough.
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import traceback
+
+from topics import STOP_WORDS
+
+# Words that name the kind of thing asked for, folded together so wording alone doesn't change a match
+_SYNONYMS = {
+    'website': 'site', 'websites': 'site', 'sites': 'site', 'webpage': 'site', 'webpages': 'site',
+    'page': 'site', 'pages': 'site', 'homepage': 'site', 'web': 'site',
+    'application': 'app', 'applications': 'app', 'apps': 'app'
+}
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+# Mersenne prime for the MinHash permutations (a * x + b) mod p
+_PRIME = (1 << 61) - 1
+
+
+def description_tokens(description):
+    """
+    The normalized word set of a description
+    """
+    tokens = set()
+    for word in _WORD_RE.findall(description.lower()):
+        if word in STOP_WORDS:
+            continue
+        word = _SYNONYMS.get(word, word)
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        tokens.add(word)
+    return tokens
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+class MinHasher:
+    """
+    MinHash signatures of word sets, and the LSH band keys they fall into.
+
+    With `bands` bands of `num_perm / bands` rows, two sets share at least one
+    band with probability 1 - (1 - s^rows)^bands for Jaccard similarity s.
+    """
+
+    def __init__(self, num_perm=64, bands=16, seed=1):
+        if num_perm % bands:
+            raise ValueError('num_perm must be a multiple of bands')
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = random.Random(seed)
+        self._permutations = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(num_perm)]
+
+    def signature(self, tokens):
+        hashes = [int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'big') for token in tokens]
+        return [min((a * h + b) % _PRIME for h in hashes) for a, b in self._permutations]
+
+    def band_keys(self, tokens):
+        signature = self.signature(tokens)
+        return [
+            hashlib.blake2b(
+                ','.join(map(str, signature[band * self.rows:(band + 1) * self.rows])).encode('ascii'), digest_size=8
+            ).hexdigest()
+            for band in range(self.bands)
+        ]
+
+
+class GenerationCache:
+    """
+    Completed generations in SQLite, indexed by the LSH bands of their description.
+
+    lookup() returns the most similar entry of the same kind at or above
+    `threshold`. Entries are evicted least recently used first once there are
+    more than `max_entries` or they hold more than `max_bytes` of code. A
+    generation whose description has the same word set as an entry replaces
+    it. The database is in memory unless db_path is given.
+    """
+
+    def __init__(self, db_path=None, threshold=0.8, max_entries=1000, max_bytes=64 * 1024 * 1024, hasher=None):
+        self.db_path = db_path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hasher = hasher or MinHasher()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        try:
+            self._db = sqlite3.connect(db_path or ':memory:', check_same_thread=False)
+            self._create_tables()
+        except Exception as e:
+            print(f"Error opening generation cache {db_path}: {str(e)}")
+            traceback.print_exc()
+            self.db_path = None
+            self._db = sqlite3.connect(':memory:', check_same_thread=False)
+            self._create_tables()
+
+    def _create_tables(self):
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS generations ("
+            "entry_id INTEGER PRIMARY KEY, kind TEXT NOT NULL, description TEXT NOT NULL, tokens TEXT NOT NULL, "
+            "sections TEXT NOT NULL, size INTEGER NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS generation_bands ("
+            "band INTEGER NOT NULL, bucket TEXT NOT NULL, entry_id INTEGER NOT NULL, PRIMARY KEY (band, bucket, entry_id))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS generations_by_use ON generations (last_used)")
+        self._db.commit()
+
+    def lookup(self, kind, description):
+        """
+        The closest cached generation as {'description', 'sections', 'similarity'}, or None
+        """
+        tokens = description_tokens(description)
+        if not tokens:
+            return None
+        with self._lock:
+            best = self._closest(kind, tokens)
+            if best is None or best[1] < self.threshold:
+                self.misses += 1
+                return None
+            (entry_id, cached_description, sections), similarity = best
+            self._db.execute("UPDATE generations SET last_used = ? WHERE entry_id = ?", (time.time(), entry_id))
+            self._db.commit()
+            self.hits += 1
+        return {'description': cached_description, 'sections': json.loads(sections), 'similarity': round(similarity, 3)}
+
+    def add(self, kind, description, sections):
+        """
+        Cache a completed generation's html/css/js. Returns False if there was nothing to index.
+        """
+        tokens = description_tokens(description)
+        if not tokens:
+            return False
+        record = json.dumps({name: sections.get(name, '') for name in ('html', 'css', 'js')})
+        now = time.time()
+        with self._lock:
+            existing = self._closest(kind, tokens)
+            if existing is not None and existing[1] == 1.0:
+                self._db.execute(
+                    "UPDATE generations SET description = ?, sections = ?, size = ?, last_used = ? WHERE entry_id = ?",
+                    (description, record, len(record), now, existing[0][0])
+                )
+            else:
+                cursor = self._db.execute(
+                    "INSERT INTO generations (kind, description, tokens, sections, size, created_at, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (kind, description, json.dumps(sorted(tokens)), record, len(record), now, now)
+                )
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO generation_bands (band, bucket, entry_id) VALUES (?, ?, ?)",
+                    [(band, self._bucket(kind, key), cursor.lastrowid)
+                     for band, key in enumerate(self.hasher.band_keys(tokens))]
+                )
+            self._evict()
+            self._db.commit()
+        return True
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM generations").fetchone()
+            return {
+                'entries': entries,
+                'bytes': size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'persistent': self.db_path is not None
+            }
+
+    @staticmethod
+    def _bucket(kind, key):
+        # Kinds share the band table but never each other's buckets
+        return f"{kind}:{key}"
+
+    def _closest(self, kind, tokens):
+        """
+        ((entry_id, description, sections), similarity) of the best LSH candidate, or None
+        """
+        buckets = [self._bucket(kind, key) for key in self.hasher.band_keys(tokens)]
+        rows = self._db.execute(
+            "SELECT entry_id, description, tokens, sections FROM generations WHERE entry_id IN ("
+            "SELECT entry_id FROM generation_bands WHERE " + ' OR '.join(['(band = ? AND bucket = ?)'] * len(buckets)) + ")",
+            [value for band, bucket in enumerate(buckets) for value in (band, bucket)]
+        ).fetchall()
+        best = None
+        for entry_id, description, entry_tokens, sections in rows:
+            similarity = jaccard(tokens, set(json.loads(entry_tokens)))
+            if best is None or similarity > best[1]:
+                best = ((entry_id, description, sections), similarity)
+        return best
+
+    def _evict(self):
+        entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM generations").fetchone()
+        if entries <= self.max_entries and size <= self.max_bytes:
+            return
+        evicted = []
+        for entry_id, entry_size in self._db.execute("SELECT entry_id, size FROM generations ORDER BY last_used").fetchall():
+            if entries <= self.max_entries and size <= self.max_bytes:
+                break
+            evicted.append((entry_id,))
+            entries -= 1
+            size -= entry_size
+        self._db.executemany("DELETE FROM generations WHERE entry_id = ?", evicted)
+        self._db.executemany("DELETE FROM generation_bands WHERE entry_id = ?", evicted)
+        self.evictions += len(evicted)
+
+
+def create_generation_cache_from_env(mode='seed'):
+    """
+    Build the process-wide cache from GENERATION_CACHE_* environment variables.
+    A replayed site goes out exactly as it was generated for someone else, so
+    replay mode matches at GENERATION_CACHE_REPLAY_SIMILARITY, by default only
+    descriptions with the same normalized words.
+    """
+    if mode == 'replay':
+        threshold = float(os.getenv('GENERATION_CACHE_REPLAY_SIMILARITY', '1.0'))
+    else:
+        threshold = float(os.getenv('GENERATION_CACHE_SIMILARITY', '0.8'))
+    return GenerationCache(
+        db_path=os.getenv('GENERATION_CACHE_DB') or None,
+        threshold=threshold,
+        max_entries=int(os.getenv('GENERATION_CACHE_SIZE', '1000')),
+        max_bytes=int(float(os.getenv('GENERATION_CACHE_MAX_MB', '64')) * 1024 * 1024)
+    )
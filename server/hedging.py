@@ -0,0 +1,239 @@
+"""
+Hedged Gemini calls: if a stream hasn't produced its first chunk after a
+delay, the same call is made again and whichever stream starts first is
+used. The delay is fixed, or learned as a percentile of recent
+first-chunk times, and a token bucket caps how many extra calls are made.
+
+Only first calls are learned from, each once its first chunk arrives,
+whether or not a hedge beat it. Learning from winners alone would only
+ever see the times that hedging cut short, and the delay would keep
+shrinking.
+"""
+import math
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+from metrics import HEDGES
+
+_END = object()
+
+
+class HedgePolicy:
+    """
+    When to hedge and whether the budget allows it.
+
+    delay() is `fixed_delay` if given, otherwise the `percentile` of the
+    last `window` first-chunk times of the endpoint's first calls (never below
+    `min_delay`), and `initial_delay` until `min_samples` have been seen.
+    Every call earns `budget` hedge tokens, up to `burst`, and a hedge
+    spends one, so at most about `budget` of calls are duplicated.
+    """
+
+    def __init__(self, fixed_delay=None, percentile=0.95, budget=0.1, burst=5.0, window=200, min_samples=20,
+                 min_delay=0.25, initial_delay=2.0):
+        self.fixed_delay = fixed_delay
+        self.percentile = percentile
+        self.budget = budget
+        self.burst = burst
+        self.window = window
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.initial_delay = initial_delay
+        self._samples = {}  # endpoint -> recent first-chunk seconds
+        self._tokens = burst
+        self._lock = threading.Lock()
+
+    def delay(self, endpoint):
+        if self.fixed_delay is not None:
+            return self.fixed_delay
+        with self._lock:
+            samples = sorted(self._samples.get(endpoint, ()))
+        if len(samples) < self.min_samples:
+            return self.initial_delay
+        index = min(len(samples) - 1, math.ceil(self.percentile * len(samples)) - 1)
+        return max(self.min_delay, samples[index])
+
+    def observe(self, endpoint, seconds):
+        with self._lock:
+            self._samples.setdefault(endpoint, deque(maxlen=self.window)).append(seconds)
+
+    def earn(self):
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.budget)
+
+    def spend(self):
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def snapshot(self, endpoints=('website', 'application', 'modify')):
+        with self._lock:
+            tokens = round(self._tokens, 2)
+        return {'tokens': tokens, 'delays': {endpoint: round(self.delay(endpoint), 3) for endpoint in endpoints}}
+
+
+def _first_chunk(start, attempt, results, abandoned, observe=None):
+    """
+    Run one attempt until its first chunk, then hand the stream over (or drop it if the other attempt won).
+    observe() is called once the first chunk arrives, either way.
+    """
+    try:
+        chunks = iter(start())
+        first = next(chunks, _END)
+    except Exception as e:
+        results.put((attempt, e, None))
+        return
+    if observe:
+        observe()
+    if abandoned.is_set():
+        close = getattr(chunks, 'close', None)
+        if close:
+            close()
+        return
+    results.put((attempt, first, chunks))
+
+
+def _relay(first, chunks):
+    if first is not _END:
+        yield first
+    yield from chunks
+
+
+def hedged(start, policy, endpoint):
+    """
+    Call start() (which opens a Gemini stream) and return its chunks,
+    calling it a second time if no chunk has arrived after policy.delay().
+    Blocks until the winning stream's first chunk, like the SDK's own
+    streaming call. The losing stream is left unread; a stream can't be
+    interrupted while it waits for its first chunk, so it is dropped when
+    that arrives. Errors are only raised once both attempts have failed.
+    """
+    policy.earn()
+    started = time.perf_counter()
+    results = queue.Queue()
+    abandoned = threading.Event()
+    observe = lambda: policy.observe(endpoint, time.perf_counter() - started)
+    threading.Thread(target=_first_chunk, args=(start, 'primary', results, abandoned, observe), daemon=True).start()
+
+    pending = 1
+    hedge_sent = False
+    delay = policy.delay(endpoint)
+    error = None
+    while pending:
+        try:
+            attempt, first, chunks = results.get(timeout=None if hedge_sent else delay)
+        except queue.Empty:
+            hedge_sent = True
+            if not policy.spend():
+                HEDGES.inc(endpoint=endpoint, outcome='over_budget')
+                continue
+            HEDGES.inc(endpoint=endpoint, outcome='sent')
+            print(f"No Gemini chunk after {round(delay * 1000)}ms, sending a hedged request")
+            threading.Thread(target=_first_chunk, args=(start, 'hedge', results, abandoned), daemon=True).start()
+            pending += 1
+            continue
+
+        pending -= 1
+        if isinstance(first, Exception):
+            error = error or first
+            continue
+        abandoned.set()
+        if attempt == 'hedge':
+            HEDGES.inc(endpoint=endpoint, outcome='won')
+        return _relay(first, chunks)
+    raise error
+
+
+async def _afirst_chunk(start, attempt, observe=None):
+    chunks = (await start()).__aiter__()
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = _END
+    if observe:
+        observe()
+    return attempt, first, chunks
+
+
+def _adrop(task):
+    """
+    Close the stream of a first call that got its first chunk after the hedge had won
+    """
+    if task.cancelled() or task.exception() is not None:
+        return
+    _, _, chunks = task.result()
+    aclose = getattr(chunks, 'aclose', None)
+    if aclose:
+        # Only the asyncio server mode gets here
+        import asyncio
+        asyncio.ensure_future(aclose())
+
+
+async def _arelay(first, chunks):
+    if first is not _END:
+        yield first
+    async for chunk in chunks:
+        yield chunk
+
+
+async def ahedged(start, policy, endpoint):
+    """
+    hedged() for async Gemini streams; start() is a coroutine. A losing hedge
+    is cancelled, while a losing first call runs on to its first chunk, so
+    its time is still learned, and is then closed.
+    """
+    # Only the asyncio server mode gets here, so the WSGI app doesn't pay for importing asyncio
+    import asyncio
+
+    policy.earn()
+    started = time.perf_counter()
+    observe = lambda: policy.observe(endpoint, time.perf_counter() - started)
+    primary = asyncio.ensure_future(_afirst_chunk(start, 'primary', observe))
+    pending = {primary}
+    delay = policy.delay(endpoint)
+    done, _ = await asyncio.wait(pending, timeout=delay)
+    if not done:
+        if policy.spend():
+            HEDGES.inc(endpoint=endpoint, outcome='sent')
+            print(f"No Gemini chunk after {round(delay * 1000)}ms, sending a hedged request")
+            pending.add(asyncio.ensure_future(_afirst_chunk(start, 'hedge')))
+        else:
+            HEDGES.inc(endpoint=endpoint, outcome='over_budget')
+
+    error = None
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is not None:
+                error = error or task.exception()
+                continue
+            for loser in pending:
+                if loser is primary:
+                    loser.add_done_callback(_adrop)
+                else:
+                    loser.cancel()
+            attempt, first, chunks = task.result()
+            if attempt == 'hedge':
+                HEDGES.inc(endpoint=endpoint, outcome='won')
+            return _arelay(first, chunks)
+    raise error
+
+
+def create_hedge_policy_from_env():
+    """
+    Build the process-wide policy from HEDGE_* environment variables, or
+    return None unless HEDGING is on.
+    """
+    if os.getenv('HEDGING', 'False').lower() != 'true':
+        return None
+    fixed_delay = os.getenv('HEDGE_DELAY')
+    return HedgePolicy(
+        fixed_delay=float(fixed_delay) if fixed_delay else None,
+        percentile=float(os.getenv('HEDGE_PERCENTILE', '0.95')),
+        budget=float(os.getenv('HEDGE_BUDGET', '0.1'))
+    )
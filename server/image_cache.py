@@ -0,0 +1,202 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+
+class ImageCache:
+    """
+    Two-tier cache for Unsplash search results.
+
+    The first tier is an in-process LRU with a TTL. The optional second tier is
+    an SQLite file that survives restarts and serverless cold starts. Entries
+    older than the TTL but younger than the stale TTL are still served, and a
+    background refresh is started for them (stale-while-revalidate).
+
+    The SQLite tier drops entries past the stale TTL, and the oldest ones
+    beyond `max_disk_entries`, when it is opened and on every write.
+    """
+
+    def __init__(self, max_entries=256, ttl=3600, stale_ttl=86400, db_path=None, max_disk_entries=10000):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.db_path = db_path
+
+        self._entries = OrderedDict()  # key -> (value, stored_at)
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._db = None
+        self._db_lock = threading.Lock()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.purged = 0
+
+        if db_path:
+            try:
+                self._db = sqlite3.connect(db_path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS image_cache ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)"
+                )
+                self._db.execute("CREATE INDEX IF NOT EXISTS image_cache_by_age ON image_cache (stored_at)")
+                self._purge(time.time())
+                self._db.commit()
+            except Exception as e:
+                # The disk tier is optional, so fall back to memory only
+                print(f"Error opening image cache database {db_path}: {str(e)}")
+                traceback.print_exc()
+                self._db = None
+
+    @staticmethod
+    def make_key(clean_query, count):
+        return f"{clean_query}|{count}"
+
+    def get(self, key):
+        """
+        Look up a key and return (value, state) where state is 'fresh', 'stale' or 'miss'.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                age = now - stored_at
+                if age < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value, 'fresh'
+                if age < self.stale_ttl:
+                    self._entries.move_to_end(key)
+                    self.stale_hits += 1
+                    return value, 'stale'
+                del self._entries[key]
+
+        entry = self._load_from_disk(key)
+        if entry is not None:
+            value, stored_at = entry
+            age = now - stored_at
+            if age < self.stale_ttl:
+                self._remember(key, value, stored_at)
+                with self._lock:
+                    self.disk_hits += 1
+                    if age < self.ttl:
+                        self.hits += 1
+                        return value, 'fresh'
+                    self.stale_hits += 1
+                    return value, 'stale'
+
+        with self._lock:
+            self.misses += 1
+        return None, 'miss'
+
+    def set(self, key, value):
+        stored_at = time.time()
+        self._remember(key, value, stored_at)
+        self._save_to_disk(key, value, stored_at)
+
+    def refresh(self, key, loader):
+        """
+        Reload a stale entry in the background. Only one refresh per key runs at a time.
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            self.refreshes += 1
+
+        def run():
+            try:
+                value = loader()
+                if value:
+                    self.set(key, value)
+            except Exception as e:
+                print(f"Error refreshing image cache entry '{key}': {str(e)}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=run, name='image-cache-refresh', daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'refreshes': self.refreshes,
+                'purged': self.purged,
+                'hit_ratio': round((self.hits + self.stale_hits) / lookups, 3) if lookups else 0.0,
+                'persistent': self._db is not None
+            }
+
+    def _remember(self, key, value, stored_at):
+        with self._lock:
+            self._entries[key] = (value, stored_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _load_from_disk(self, key):
+        if self._db is None:
+            return None
+        try:
+            with self._db_lock:
+                row = self._db.execute(
+                    "SELECT value, stored_at FROM image_cache WHERE key = ?", (key,)
+                ).fetchone()
+            if row:
+                return json.loads(row[0]), row[1]
+        except Exception as e:
+            print(f"Error reading image cache entry '{key}': {str(e)}")
+        return None
+
+    def _save_to_disk(self, key, value, stored_at):
+        if self._db is None:
+            return
+        try:
+            with self._db_lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO image_cache (key, value, stored_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), stored_at)
+                )
+                self._purge(stored_at)
+                self._db.commit()
+        except Exception as e:
+            print(f"Error writing image cache entry '{key}': {str(e)}")
+
+    def _purge(self, now):
+        """
+        Delete rows too old to serve even stale, then the oldest rows over max_disk_entries
+        """
+        expired = self._db.execute("DELETE FROM image_cache WHERE stored_at < ?", (now - self.stale_ttl,)).rowcount
+        over = self._db.execute(
+            "DELETE FROM image_cache WHERE key IN "
+            "(SELECT key FROM image_cache ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,)
+        ).rowcount
+        self.purged += expired + over
+
+
+def create_image_cache_from_env():
+    """
+    Build the process-wide cache from IMAGE_CACHE_* environment variables.
+    """
+    return ImageCache(
+        max_entries=int(os.getenv('IMAGE_CACHE_SIZE', '256')),
+        ttl=float(os.getenv('IMAGE_CACHE_TTL', '3600')),
+        stale_ttl=float(os.getenv('IMAGE_CACHE_STALE_TTL', '86400')),
+        db_path=os.getenv('IMAGE_CACHE_DB') or None,
+        max_disk_entries=int(os.getenv('IMAGE_CACHE_DISK_SIZE', '10000'))
+    )
@@ -0,0 +1,224 @@
+"""
+Local catalog of Unsplash images with a full-text index over their topic,
+alt text and tags, so image topics can be answered without a network call.
+
+Fill or update it from the live Unsplash search API with:
+
+    python image_catalog.py refresh [topic ...] [--per-topic 10] [--db image_catalog.sqlite3]
+
+Without topics, the general topics and the fixture keywords used by topics.py are fetched.
+No catalog ships with the app: one that doesn't exist yet is created empty on first
+use and seeded with the results of the app's live Unsplash searches.
+`python image_catalog.py search "mountain hiking"` shows what a lookup returns.
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+
+DEFAULT_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'image_catalog.sqlite3')
+
+# Topics every catalog gets, the same ones generation falls back to when a description yields none
+GENERAL_TOPICS = ['business', 'nature', 'technology', 'people', 'food']
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def image_from_result(result, topic):
+    """
+    The image record the app works with, from one Unsplash search result
+    """
+    return {
+        "url": result['urls']['small'],  # Use small size by default (max 400px wide)
+        "regular_url": result['urls']['regular'],  # Keep regular size as an option
+        "thumb_url": result['urls']['thumb'],  # Thumbnail size (max 200px wide)
+        "alt": result.get('alt_description', topic) or topic,
+        "credit": f"Photo by {result['user']['name']} on Unsplash",
+        "download_url": result['links']['download'],
+        "topic": topic
+    }
+
+
+def result_tags(result):
+    return [tag.get('title', '') for tag in result.get('tags') or [] if isinstance(tag, dict) and tag.get('title')]
+
+
+class ImageCatalog:
+    """
+    Image records in SQLite with an FTS5 index (porter stemming) over
+    topic, alt text and tags.
+
+    search() takes an already normalized query, matches any of its words
+    and ranks by bm25, weighting topic and tag matches above alt text.
+    If the database can't be opened the catalog is simply empty.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB):
+        self.db_path = db_path
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        self._lock = threading.Lock()
+
+        if db_path:
+            try:
+                self._db = sqlite3.connect(db_path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS images ("
+                    "image_id TEXT PRIMARY KEY, record TEXT NOT NULL, added_at REAL NOT NULL)"
+                )
+                self._db.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS image_index "
+                    "USING fts5(topic, alt, tags, tokenize='porter unicode61')"
+                )
+                self._db.commit()
+            except Exception as e:
+                print(f"Error opening image catalog {db_path}: {str(e)}")
+                traceback.print_exc()
+                self._db = None
+
+    def search(self, clean_query, count=1):
+        """
+        Return up to `count` images for a normalized query, or None if nothing matches
+        """
+        words = _WORD_RE.findall(clean_query or '')
+        if self._db is None or not words:
+            return None
+        match = ' OR '.join('"' + word + '"' for word in words)
+        try:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT images.record FROM image_index JOIN images ON images.rowid = image_index.rowid "
+                    "WHERE image_index MATCH ? ORDER BY bm25(image_index, 2.0, 1.0, 1.5) LIMIT ?",
+                    (match, count)
+                ).fetchall()
+        except Exception as e:
+            print(f"Error searching image catalog for '{clean_query}': {str(e)}")
+            return None
+
+        with self._lock:
+            if rows:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not rows:
+            return None
+        # Records keep the topic they were fetched for; callers expect the one they asked about
+        return [dict(json.loads(record), topic=clean_query) for (record,) in rows]
+
+    def add(self, image_id, image, tags=()):
+        """
+        Add an image (in the image_from_result format). Returns False if it was already there.
+        """
+        if self._db is None:
+            return False
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO images (image_id, record, added_at) VALUES (?, ?, ?)",
+                (image_id, json.dumps(image), time.time())
+            )
+            if not cursor.rowcount:
+                return False
+            self._db.execute(
+                "INSERT INTO image_index (rowid, topic, alt, tags) VALUES (?, ?, ?, ?)",
+                (cursor.lastrowid, image['topic'], image['alt'], ' '.join(tags))
+            )
+            self._db.commit()
+            return True
+
+    def add_results(self, results, clean_query):
+        """
+        Add Unsplash search results under the query they were found for.
+        Returns the number of new images.
+        """
+        added = 0
+        for result in results:
+            try:
+                added += self.add(result['id'], image_from_result(result, clean_query), result_tags(result))
+            except Exception as e:
+                print(f"Error adding image to catalog for '{clean_query}': {str(e)}")
+        return added
+
+    def stats(self):
+        with self._lock:
+            images = self._db.execute("SELECT COUNT(*) FROM images").fetchone()[0] if self._db else 0
+            return {'images': images, 'hits': self.hits, 'misses': self.misses, 'available': self._db is not None}
+
+
+def refresh_catalog(catalog, client, topics, per_topic=10, normalize=lambda query: query.strip().lower()):
+    """
+    Search Unsplash for every topic and add the results to the catalog.
+    Returns the number of new images.
+    """
+    added = 0
+    for topic in topics:
+        clean_query = normalize(topic)
+        data = client.search_photos(clean_query, per_page=per_topic, orientation="landscape", content_filter="high")
+        if not data:
+            if client.quota.snapshot()['tokens'] < 1:
+                print("Unsplash quota is used up, stopping")
+                break
+            print(f"No Unsplash results for '{clean_query}'")
+            continue
+        new = catalog.add_results(data.get('results', []), clean_query)
+        print(f"'{clean_query}': {new} new image(s)")
+        added += new
+    return added
+
+
+def default_topics():
+    from topics import DEFAULT_FIXTURES
+
+    topics = list(GENERAL_TOPICS)
+    with open(DEFAULT_FIXTURES) as f:
+        for fixture in json.load(f):
+            topics.extend(keyword for keyword in fixture['keywords'] if keyword not in topics)
+    return topics
+
+
+def create_image_catalog_from_env():
+    """
+    Open the process-wide catalog at IMAGE_CATALOG_DB (image_catalog.sqlite3 next to this file by default).
+    A catalog that hasn't been built yet is created empty, so it only answers lookups once live
+    searches have seeded it.
+    """
+    db_path = os.getenv('IMAGE_CATALOG_DB') or DEFAULT_DB
+    if not os.path.exists(db_path):
+        print(f"Warning: no image catalog at {db_path}; starting an empty one that fills from live Unsplash "
+              f"searches. Build a full one with: python image_catalog.py refresh")
+    return ImageCatalog(db_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=('refresh', 'search'))
+    parser.add_argument('terms', nargs='*', help='topics to refresh, or the query to search for')
+    parser.add_argument('--per-topic', type=int, default=10, help='images to fetch per topic')
+    parser.add_argument('--count', type=int, default=5, help='images to show for a search')
+    parser.add_argument('--db', default=os.getenv('IMAGE_CATALOG_DB') or DEFAULT_DB)
+    args = parser.parse_args()
+
+    # The app's client and query normalization, so the catalog is keyed the way lookups are
+    import app as backend
+
+    catalog = ImageCatalog(args.db)
+    if args.command == 'search':
+        clean_query = backend.normalize_query(' '.join(args.terms))
+        started = time.perf_counter()
+        images = catalog.search(clean_query, args.count) or []
+        print(json.dumps(images, indent=2))
+        print(f"{len(images)} image(s) for '{clean_query}' in {(time.perf_counter() - started) * 1000:.3f}ms")
+        return
+
+    added = refresh_catalog(catalog, backend.get_unsplash_client(), args.terms or default_topics(), args.per_topic,
+                            backend.normalize_query)
+    print(json.dumps(dict(catalog.stats(), added=added), indent=2))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,334 @@
+import heapq
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+from metrics import JOB_WAIT_SECONDS, JOBS
+
+# Queue order: lower ranks are started first, and jobs of the same priority in submission order
+PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
+
+FINISHED_STATUSES = ('done', 'failed', 'cancelled')
+
+_COLUMNS = (
+    'job_id', 'kind', 'priority', 'status', 'request', 'generation_id',
+    'created_at', 'started_at', 'finished_at', 'error', 'result'
+)
+
+
+class QueueFull(Exception):
+    """
+    Raised when a job is submitted while max_queued jobs are already waiting
+    """
+
+
+class JobStore:
+    """
+    Job records in SQLite: what was asked for, the status, and the result
+    once the job is done. The database is in memory unless db_path is given,
+    in which case jobs also outlive the process.
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        try:
+            self._db = sqlite3.connect(db_path or ':memory:', check_same_thread=False)
+            self._create_tables()
+        except Exception as e:
+            print(f"Error opening job database {db_path}: {str(e)}")
+            traceback.print_exc()
+            self.db_path = None
+            self._db = sqlite3.connect(':memory:', check_same_thread=False)
+            self._create_tables()
+
+    def _create_tables(self):
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id TEXT PRIMARY KEY, kind TEXT NOT NULL, priority TEXT NOT NULL, status TEXT NOT NULL, "
+            "request TEXT NOT NULL, generation_id TEXT, created_at REAL NOT NULL, started_at REAL, "
+            "finished_at REAL, error TEXT, result TEXT)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, created_at)")
+        self._db.commit()
+
+    def create(self, job_id, kind, priority, request_data, generation_id):
+        record = {
+            'job_id': job_id,
+            'kind': kind,
+            'priority': priority,
+            'status': 'queued',
+            'request': request_data,
+            'generation_id': generation_id,
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'error': None,
+            'result': None
+        }
+        with self._lock:
+            self._db.execute(
+                f"INSERT INTO jobs ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                tuple(json.dumps(record[name]) if name in ('request', 'result') else record[name] for name in _COLUMNS)
+            )
+            self._db.commit()
+        return record
+
+    def update(self, job_id, **fields):
+        values = [json.dumps(value) if name in ('request', 'result') else value for name, value in fields.items()]
+        with self._lock:
+            self._db.execute(
+                f"UPDATE jobs SET {', '.join(name + ' = ?' for name in fields)} WHERE job_id = ?",
+                values + [job_id]
+            )
+            self._db.commit()
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._db.execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._record(row) if row else None
+
+    def with_status(self, status):
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE status = ? ORDER BY created_at", (status,)
+            ).fetchall()
+        return [self._record(row) for row in rows]
+
+    def purge(self, finished_before):
+        """
+        Delete jobs that finished before the given time. Returns how many were deleted.
+        """
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM jobs WHERE finished_at < ?", (finished_before,))
+            self._db.commit()
+            return cursor.rowcount
+
+    def counts(self):
+        with self._lock:
+            return dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    @staticmethod
+    def _record(row):
+        record = dict(zip(_COLUMNS, row))
+        for name in ('request', 'result'):
+            record[name] = json.loads(record[name]) if record[name] is not None else None
+        return record
+
+
+class JobQueue:
+    """
+    Runs generations in background workers instead of inside the request.
+
+    submit() stores a job and returns straight away. A pool of `workers`
+    threads, started with the first job, takes queued jobs by priority and
+    runs execute(record, publish, cancelled), which publishes the job's SSE
+    frames and returns its result. Frames go into a Broadcast in the replay
+    store, so clients can attach to a job at any point and replay what they
+    missed; status changes are published as event_frame({'jobId', 'status'}).
+
+    A queued job is cancelled on the spot. A running one has its cancelled
+    event set, and execute() is expected to stop at its next chunk. Finished
+    jobs are deleted `ttl` seconds after they end. With a persistent store,
+    jobs that were queued when the process stopped are queued again, and
+    those that were running are marked failed. That happens in start(),
+    not on construction, so importing the app doesn't start any threads;
+    start() runs once, from the server's startup or the first job call.
+    """
+
+    def __init__(self, execute, store, replay_store, event_frame, workers=2, max_queued=100, ttl=86400):
+        self.execute = execute
+        self.store = store
+        self.replay_store = replay_store
+        self.event_frame = event_frame
+        self.workers = workers
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self._heap = []  # (priority rank, sequence, job id)
+        self._queued = {}  # job id -> heap entry, for jobs still waiting
+        self._running = {}  # job id -> cancelled event
+        self._broadcasts = {}  # job id -> Broadcast, until the job finishes
+        self._sequence = itertools.count()
+        self._threads = []
+        self._cond = threading.Condition()
+        self._started = False
+
+    def start(self):
+        """
+        Recover the jobs a previous process left in the store and start the
+        workers if any are waiting. Only the first call does anything.
+        """
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+            self._recover()
+
+    def submit(self, kind, request_data, priority='normal'):
+        """
+        Queue a job and return its record. Raises QueueFull if too many jobs are waiting.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"priority must be one of: {', '.join(PRIORITIES)}")
+        self.start()
+        self.store.purge(time.time() - self.ttl)
+
+        with self._cond:
+            if len(self._queued) >= self.max_queued:
+                raise QueueFull(f"{len(self._queued)} jobs are already queued")
+            broadcast = self.replay_store.create()
+            record = self.store.create(uuid.uuid4().hex, kind, priority, request_data, broadcast.generation_id)
+            self._enqueue(record['job_id'], priority, broadcast)
+        self._start_workers()
+        return record
+
+    def get(self, job_id):
+        """
+        A job's record, with its place in the queue (1 is next) while it is waiting
+        """
+        self.start()
+        record = self.store.get(job_id)
+        if record is not None and record['status'] == 'queued':
+            record['position'] = self.position(job_id)
+        return record
+
+    def position(self, job_id):
+        with self._cond:
+            entry = self._queued.get(job_id)
+            if entry is None:
+                return None
+            return 1 + sum(1 for other in self._queued.values() if other < entry)
+
+    def cancel(self, job_id):
+        """
+        Cancel a job. Returns its status afterwards: 'cancelled' if it hadn't
+        started, 'cancelling' while a running job stops, the final status of a
+        job that had already finished, or None for an unknown job.
+        """
+        self.start()
+        with self._cond:
+            queued = self._queued.pop(job_id, None) is not None
+            event = self._running.get(job_id)
+            if event is not None:
+                event.set()
+                return 'cancelling'
+        record = self.store.get(job_id)
+        if queued:
+            # Its heap entry stays behind and is skipped when a worker reaches it
+            self._finish(record, 'cancelled')
+            return 'cancelled'
+        return record['status'] if record else None
+
+    def stats(self):
+        with self._cond:
+            queued = {priority: 0 for priority in PRIORITIES}
+            ranks = {rank: priority for priority, rank in PRIORITIES.items()}
+            for rank, _, _ in self._queued.values():
+                queued[ranks[rank]] += 1
+            return {
+                'workers': len(self._threads),
+                'max_workers': self.workers,
+                'queued': queued,
+                'running': len(self._running),
+                'jobs': self.store.counts(),
+                'persistent': self.store.db_path is not None
+            }
+
+    def _enqueue(self, job_id, priority, broadcast):
+        entry = (PRIORITIES[priority], next(self._sequence), job_id)
+        heapq.heappush(self._heap, entry)
+        self._queued[job_id] = entry
+        self._broadcasts[job_id] = broadcast
+        broadcast.publish(self.event_frame({'jobId': job_id, 'status': 'queued', 'priority': priority}))
+        self._cond.notify()
+
+    def _start_workers(self):
+        with self._cond:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f"job-worker-{len(self._threads) + 1}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                _, _, job_id = heapq.heappop(self._heap)
+                if self._queued.pop(job_id, None) is None:
+                    continue
+                cancelled = self._running[job_id] = threading.Event()
+            try:
+                self._run(job_id, cancelled)
+            finally:
+                with self._cond:
+                    del self._running[job_id]
+
+    def _run(self, job_id, cancelled):
+        record = self.store.get(job_id)
+        record['started_at'] = time.time()
+        record['status'] = 'running'
+        self.store.update(job_id, status='running', started_at=record['started_at'])
+        JOB_WAIT_SECONDS.observe(record['started_at'] - record['created_at'], priority=record['priority'])
+
+        broadcast = self._broadcasts[job_id]
+        broadcast.publish(self.event_frame({'jobId': job_id, 'status': 'running'}))
+        print(f"Starting {record['priority']} priority {record['kind']} job {job_id}")
+        try:
+            result = self.execute(record, broadcast.publish, cancelled)
+        except Exception as e:
+            print(f"Error in job {job_id}: {str(e)}")
+            traceback.print_exc()
+            self._finish(record, 'failed', error=str(e))
+            return
+        # A job that completed before it noticed the cancellation still counts as done
+        self._finish(record, 'cancelled' if cancelled.is_set() and result is None else 'done', result=result)
+
+    def _finish(self, record, status, result=None, error=None):
+        job_id = record['job_id']
+        self.store.update(job_id, status=status, finished_at=time.time(), result=result, error=error)
+        JOBS.inc(kind=record['kind'], status=status)
+        print(f"Job {job_id} {status}")
+
+        with self._cond:
+            broadcast = self._broadcasts.pop(job_id, None)
+        if broadcast is not None:
+            event = {'jobId': job_id, 'status': status}
+            if error:
+                event['error'] = error
+            broadcast.publish(self.event_frame(event))
+            broadcast.finish()
+
+    def _recover(self):
+        now = time.time()
+        for record in self.store.with_status('running'):
+            self.store.update(record['job_id'], status='failed', finished_at=now, error='Interrupted by a server restart')
+        queued = self.store.with_status('queued')
+        with self._cond:
+            for record in queued:
+                broadcast = self.replay_store.create()
+                self.store.update(record['job_id'], generation_id=broadcast.generation_id)
+                self._enqueue(record['job_id'], record['priority'], broadcast)
+        if queued:
+            print(f"Requeued {len(queued)} job(s) from {self.store.db_path}")
+            self._start_workers()
+
+
+def create_job_queue_from_env(execute, replay_store, event_frame):
+    """
+    Build the process-wide job queue from JOB_* environment variables.
+    """
+    return JobQueue(
+        execute,
+        JobStore(os.getenv('JOB_DB') or None),
+        replay_store,
+        event_frame,
+        workers=int(os.getenv('JOB_WORKERS', '2')),
+        max_queued=int(os.getenv('JOB_MAX_QUEUED', '100')),
+        ttl=float(os.getenv('JOB_TTL', '86400'))
+    )
@@ -0,0 +1,199 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Default latency buckets in seconds, from fast local work up to long model streams
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in pairs]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series = {}  # label values -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labelnames, key, ('le', _format_value(bound)))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """
+    Minimal Prometheus-style metrics registry rendered in the text exposition format
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help_text, labelnames=()):
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUESTS = registry.counter('instn_requests_total', 'Generation requests received', ('endpoint',))
+ERRORS = registry.counter('instn_errors_total', 'Errors by endpoint and stage', ('endpoint', 'stage'))
+PHASE_SECONDS = registry.histogram('instn_phase_seconds', 'Time spent in each request phase', ('endpoint', 'phase'))
+UNSPLASH_SECONDS = registry.histogram('instn_unsplash_request_seconds', 'Unsplash search call duration', ('outcome',))
+CATALOG_SECONDS = registry.histogram(
+    'instn_image_catalog_seconds', 'Local image catalog lookup duration', ('outcome',),
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)
+)
+FIRST_CHUNK_SECONDS = registry.histogram(
+    'instn_gemini_first_chunk_seconds', 'Time from the Gemini call to its first chunk', ('endpoint',)
+)
+CHUNK_GAP_SECONDS = registry.histogram(
+    'instn_gemini_chunk_gap_seconds', 'Time between consecutive Gemini chunks', ('endpoint',),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+STREAM_SECONDS = registry.histogram('instn_stream_duration_seconds', 'Total duration of a generation stream', ('endpoint',))
+STREAM_CHUNKS = registry.counter('instn_stream_chunks_total', 'Gemini chunks relayed', ('endpoint',))
+STREAM_BYTES = registry.counter('instn_stream_bytes_total', 'SSE bytes sent', ('endpoint',))
+STREAM_FRAMES = registry.counter('instn_stream_frames_total', 'SSE events sent', ('endpoint',))
+CONTINUATIONS = registry.counter(
+    'instn_continuations_total', 'Continuation requests for cut-off generations', ('endpoint', 'reason')
+)
+MINIFIED_BYTES_SAVED = registry.counter(
+    'instn_stream_minify_bytes_saved_total', 'Bytes removed from generated code by streaming minification', ('endpoint',)
+)
+PROMPT_CHARS_SAVED = registry.counter(
+    'instn_prompt_chars_saved_total', 'Characters removed from prompts by compaction', ('endpoint',)
+)
+GENERATION_CACHE_LOOKUPS = registry.counter(
+    'instn_generation_cache_lookups_total', 'Similar-description cache lookups by outcome', ('kind', 'outcome')
+)
+ADMISSIONS = registry.counter(
+    'instn_admissions_total', 'Generations admitted at once, queued, rejected or abandoned while queued', ('outcome',)
+)
+ADMISSION_WAIT_SECONDS = registry.histogram('instn_admission_wait_seconds', 'Time generations waited for an upstream slot')
+HEDGES = registry.counter(
+    'instn_gemini_hedges_total', 'Hedged Gemini calls sent, won by the hedge, or skipped over budget', ('endpoint', 'outcome')
+)
+MODEL_ROUTES = registry.counter(
+    'instn_model_routes_total', 'Model calls by task and the model profile they were routed to', ('task', 'profile')
+)
+ROUTED_TRUNCATIONS = registry.counter(
+    'instn_routed_truncations_total', 'Routed model calls that stopped at their output budget', ('task', 'profile')
+)
+JOBS = registry.counter('instn_jobs_total', 'Queued generation jobs by how they ended', ('kind', 'status'))
+JOB_WAIT_SECONDS = registry.histogram(
+    'instn_job_wait_seconds', 'Time a job spent queued before a worker started it', ('priority',)
+)
+
+
+class RequestTimer:
+    """
+    Collects the phase timings of one request and feeds the shared histograms.
+
+    Phases are recorded in milliseconds for the Server-Timing header and the
+    optional trailing timings event.
+    """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.marks = {}
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name, seconds, observe=True):
+        self.phases[name] = round(self.phases.get(name, 0.0) + seconds * 1000, 2)
+        if observe:
+            PHASE_SECONDS.observe(seconds, endpoint=self.endpoint, phase=name)
+
+    def mark(self, name):
+        self.marks[name] = time.perf_counter()
+
+    def since(self, name):
+        return time.perf_counter() - self.marks.get(name, self.started)
+
+    def server_timing(self):
+        return ', '.join(f"{name};dur={duration}" for name, duration in self.phases.items())
+
+    def as_dict(self):
+        timings = dict(self.phases)
+        timings['total'] = round((time.perf_counter() - self.started) * 1000, 2)
+        return timings
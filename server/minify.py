@@ -0,0 +1,534 @@
+import math
+import time
+
+from fence_parser import SECTION_NAMES, fence_language
+
+# Rough size of a Gemini token in characters of code, good enough for budgeting
+CHARS_PER_TOKEN = 4
+
+# Elements whose content is copied untouched
+RAW_TEXT_ELEMENTS = ('pre', 'textarea', 'script', 'style')
+
+# CSS characters around which whitespace carries no meaning
+_CSS_TIGHT = set('{};,>')
+
+# JavaScript punctuators around which whitespace can go, unless JsMinifier._joinable says otherwise
+_JS_TIGHT = set('{}()[];,:=<>!?&|*%^~')
+
+# After these keywords a '/' starts a regular expression, not a division
+_JS_REGEX_KEYWORDS = {'return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new', 'delete',
+                      'void', 'throw', 'instanceof', 'yield', 'await'}
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text or '') / CHARS_PER_TOKEN)
+
+
+def _is_word_char(char):
+    return char.isalnum() or char in '_$'
+
+
+class _Minifier:
+    """
+    Incremental minifier: feed() returns the output that can already be
+    decided, and keeps back the few characters that need more input to
+    decide (a '/' that may start a comment, a '<' that may open one).
+    close() returns the rest.
+    """
+
+    def __init__(self):
+        self._buffer = ''
+        self.chars_in = 0
+        self.chars_out = 0
+
+    def feed(self, text):
+        self.chars_in += len(text)
+        self._buffer += text
+        return self._emit(self._run(final=False))
+
+    def close(self):
+        return self._emit(self._run(final=True))
+
+    def _emit(self, parts):
+        output = ''.join(parts)
+        self.chars_out += len(output)
+        return output
+
+    def _run(self, final):
+        raise NotImplementedError
+
+
+class CssMinifier(_Minifier):
+    """
+    Drops comments, collapses whitespace and removes it around { } ; , > and
+    after ':', and drops the last ';' of a block. Strings are kept as they are.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._in_comment = False
+        self._quote = None
+        self._space = False
+        self._semicolon = False
+        self._last = ''
+
+    def _run(self, final):
+        text, out, i, n = self._buffer, [], 0, len(self._buffer)
+        while i < n:
+            char = text[i]
+            if self._in_comment:
+                end = text.find('*/', i)
+                if end == -1:
+                    i = n - 1 if text.endswith('*') and not final else n
+                    break
+                self._in_comment = False
+                i = end + 2
+                continue
+            if self._quote:
+                if char == '\\':
+                    if i + 1 >= n and not final:
+                        break
+                    out.append(text[i:i + 2])
+                    i += 2
+                    continue
+                out.append(char)
+                if char == self._quote or char == '\n':
+                    self._quote = None
+                i += 1
+                continue
+            if char == '/':
+                if i + 1 >= n and not final:
+                    break
+                if text.startswith('/*', i):
+                    self._in_comment = True
+                    i += 2
+                    continue
+            if char.isspace():
+                self._space = True
+                i += 1
+                continue
+
+            if char == ';':
+                self._space = False
+                self._semicolon = True
+                i += 1
+                continue
+            if self._semicolon:
+                self._semicolon = False
+                if char != '}':
+                    out.append(';')
+                    self._last = ';'
+            if self._space:
+                self._space = False
+                if self._last and self._last not in _CSS_TIGHT and self._last != ':' and char not in _CSS_TIGHT:
+                    out.append(' ')
+            if char in '"\'':
+                self._quote = char
+            out.append(char)
+            self._last = char
+            i += 1
+
+        self._buffer = text[i:]
+        if final:
+            if self._semicolon:
+                out.append(';')
+            self._semicolon = self._space = False
+        return out
+
+
+class JsMinifier(_Minifier):
+    """
+    Drops comments and collapses whitespace, keeping line breaks where
+    automatic semicolon insertion could depend on them. Strings, template
+    literals and regular expression literals are kept as they are.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._state = 'code'  # code, string, template, regex, line_comment, block_comment
+        self._quote = None
+        self._regex_class = False
+        self._templates = []  # brace depth of the code inside each open ${...}
+        self._space = False
+        self._newline = False
+        self._last = ''
+        self._word = ''
+
+    def _regex_allowed(self):
+        if not self._last:
+            return True
+        if _is_word_char(self._last):
+            return self._word in _JS_REGEX_KEYWORDS
+        # After a closing bracket or a string a '/' is a division
+        return self._last not in ')]"\'`'
+
+    def _flush_space(self, out, char):
+        if not (self._space or self._newline):
+            return
+        last, newline = self._last, self._newline
+        self._space = self._newline = False
+        if not last:
+            return
+        if newline:
+            if last not in '{;,([' and char not in '})]':
+                out.append('\n')
+                self._last = '\n'
+            return
+        tight = (last in _JS_TIGHT or char in _JS_TIGHT) and self._joinable(last, char)
+        if not tight or (_is_word_char(last) and _is_word_char(char)):
+            out.append(' ')
+
+    @staticmethod
+    def _joinable(last, char):
+        # Joining these would make ++, --, **, //, /*, */ or an HTML-like <!--
+        if last in '+-/*' and char in '+-/*':
+            return False
+        return not (last == '<' and char == '!')
+
+    def _run(self, final):
+        text, out, i, n = self._buffer, [], 0, len(self._buffer)
+        while i < n:
+            char = text[i]
+            state = self._state
+
+            if state == 'line_comment':
+                end = text.find('\n', i)
+                if end == -1:
+                    i = n
+                    break
+                self._state = 'code'
+                self._newline = True
+                i = end + 1
+                continue
+            if state == 'block_comment':
+                end = text.find('*/', i)
+                if end == -1:
+                    self._newline = self._newline or '\n' in text[i:]
+                    i = n - 1 if text.endswith('*') and not final else n
+                    break
+                self._newline = self._newline or '\n' in text[i:end]
+                self._space = True
+                self._state = 'code'
+                i = end + 2
+                continue
+            if state in ('string', 'template', 'regex'):
+                if char == '\\':
+                    if i + 1 >= n and not final:
+                        break
+                    out.append(text[i:i + 2])
+                    i += 2
+                    continue
+                if state == 'template' and char == '$':
+                    if i + 1 >= n and not final:
+                        break
+                    if text.startswith('${', i):
+                        out.append('${')
+                        self._templates.append(0)
+                        self._state = 'code'
+                        self._last = '{'
+                        i += 2
+                        continue
+                out.append(char)
+                i += 1
+                if state == 'string' and char in (self._quote, '\n'):
+                    self._state = 'code'
+                    self._last = char
+                elif state == 'template' and char == '`':
+                    self._state = 'code'
+                    self._last = '`'
+                elif state == 'regex':
+                    if char == '[':
+                        self._regex_class = True
+                    elif char == ']':
+                        self._regex_class = False
+                    elif char in '/\n' and not self._regex_class:
+                        self._state = 'code'
+                        self._last = ')'  # a '/' after a regex is a division
+                        self._word = ''
+                continue
+
+            # Code
+            if char.isspace():
+                if char == '\n':
+                    self._newline = True
+                else:
+                    self._space = True
+                i += 1
+                continue
+            if char == '/':
+                if i + 1 >= n and not final:
+                    break
+                following = text[i + 1] if i + 1 < n else ''
+                if following == '/':
+                    self._state = 'line_comment'
+                    i += 2
+                    continue
+                if following == '*':
+                    self._state = 'block_comment'
+                    i += 2
+                    continue
+                if self._regex_allowed():
+                    self._flush_space(out, char)
+                    self._state = 'regex'
+                    self._regex_class = False
+                    out.append(char)
+                    i += 1
+                    continue
+
+            # Whitespace and comments end a word, so 'else return' isn't read as the word 'elsereturn'
+            separated = self._space or self._newline
+            self._flush_space(out, char)
+            if char in '"\'':
+                self._state = 'string'
+                self._quote = char
+            elif char == '`':
+                self._state = 'template'
+            elif char == '{' and self._templates:
+                self._templates[-1] += 1
+            elif char == '}' and self._templates:
+                if self._templates[-1] == 0:
+                    self._templates.pop()
+                    self._state = 'template'
+                else:
+                    self._templates[-1] -= 1
+            out.append(char)
+            if _is_word_char(char):
+                self._word = char if separated else self._word + char
+            else:
+                self._word = ''
+            self._last = char
+            i += 1
+
+        self._buffer = text[i:]
+        if final:
+            self._space = self._newline = False
+        return out
+
+
+class HtmlMinifier(_Minifier):
+    """
+    Drops comments and collapses runs of whitespace to one space, in text
+    and between attributes. Attribute values and the content of <pre>,
+    <textarea>, <script> and <style> are kept as they are.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._state = 'text'  # text, tag, comment, raw
+        self._quote = None
+        self._tag_name = ''
+        self._reading_name = False
+        self._raw_end = None
+        self._space = False
+        self._last = ''
+
+    def _run(self, final):
+        text, out, i, n = self._buffer, [], 0, len(self._buffer)
+        while i < n:
+            char = text[i]
+
+            if self._state == 'comment':
+                end = text.find('-->', i)
+                if end == -1:
+                    i = max(i, n - 2) if not final else n
+                    break
+                self._state = 'text'
+                i = end + 3
+                continue
+
+            if self._state == 'raw':
+                end = text.lower().find(self._raw_end, i)
+                if end == -1:
+                    keep = 0 if final else len(self._raw_end) - 1
+                    stop = max(i, n - keep)
+                    out.append(text[i:stop])
+                    i = stop
+                    break
+                out.append(text[i:end])
+                self._state = 'text'
+                i = end
+                continue
+
+            if self._state == 'tag':
+                if self._quote:
+                    out.append(char)
+                    if char == self._quote:
+                        self._quote = None
+                    i += 1
+                    continue
+                if char.isspace():
+                    self._space = True
+                    self._reading_name = False
+                    i += 1
+                    continue
+                if self._space:
+                    self._space = False
+                    if char != '>':
+                        out.append(' ')
+                if char == '>':
+                    self._state = 'text'
+                    name = self._tag_name.lower()
+                    if name in RAW_TEXT_ELEMENTS and self._last != '/':
+                        self._state = 'raw'
+                        self._raw_end = f"</{name}"
+                elif char in '"\'':
+                    self._quote = char
+                elif self._reading_name:
+                    if char == '/' and not self._tag_name:
+                        self._reading_name = False  # closing tag, never raw
+                    else:
+                        self._tag_name += char
+                out.append(char)
+                self._last = char
+                i += 1
+                continue
+
+            # Text
+            if char == '<':
+                if n - i < 4 and not final and '<!--'.startswith(text[i:]):
+                    break
+                if text.startswith('<!--', i):
+                    self._state = 'comment'
+                    i += 4
+                    continue
+            if char.isspace():
+                self._space = True
+                i += 1
+                continue
+            if self._space:
+                self._space = False
+                if self._last:
+                    out.append(' ')
+            if char == '<':
+                self._state = 'tag'
+                self._tag_name = ''
+                self._reading_name = True
+            out.append(char)
+            self._last = char
+            i += 1
+
+        self._buffer = text[i:]
+        if final:
+            self._space = False
+        return out
+
+
+MINIFIERS = {'html': HtmlMinifier, 'css': CssMinifier, 'js': JsMinifier}
+
+
+def minify(section, text):
+    minifier = MINIFIERS[section]()
+    return minifier.feed(text or '') + minifier.close()
+
+
+class FencedMinifier:
+    """
+    Minifies the code blocks of a model response as it streams.
+
+    Fence lines and text outside the ```html / ```css / ```javascript blocks
+    pass through as they are, and so do blocks in other languages. Each
+    block's content goes through the incremental minifier for its section, so
+    feed() returns what is already decided without waiting for the block to
+    end. A line that may still turn out to be a fence is held back until its
+    newline arrives. bytes_in, bytes_out and seconds (time spent minifying)
+    add up over the stream.
+    """
+
+    def __init__(self):
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+        self._minifier = None  # for the open block, None outside a block or in one of another language
+        self._in_fence = False
+        self._pending = ''  # start of a line that may be a fence
+        self._at_line_start = True
+        self._last = '\n'  # last character sent
+
+    def feed(self, text):
+        started = time.perf_counter()
+        self.bytes_in += len(text.encode('utf-8'))
+        output = self._run(self._pending + text)
+        return self._emit(output, started)
+
+    def close(self):
+        started = time.perf_counter()
+        out = []
+        if self._pending:
+            pending, self._pending = self._pending, ''
+            if fence_language(pending) is not None:
+                self._fence(fence_language(pending), pending, out)
+            else:
+                out.append(self._minifier.feed(pending) if self._minifier else pending)
+        if self._minifier:
+            out.append(self._minifier.close())
+            self._minifier = None
+        return self._emit(''.join(out), started)
+
+    def _emit(self, output, started):
+        if output:
+            self._last = output[-1]
+        self.bytes_out += len(output.encode('utf-8'))
+        self.seconds += time.perf_counter() - started
+        return output
+
+    def _run(self, text):
+        self._pending = ''
+        out, pos, length = [], 0, len(text)
+        while pos < length:
+            newline = text.find('\n', pos)
+            if self._at_line_start:
+                line_end = length if newline == -1 else newline
+                line = text[pos:line_end]
+                stripped = line.lstrip(' \t')
+                if newline == -1 and (stripped.startswith('```') or '```'.startswith(stripped)):
+                    self._pending = line
+                    break
+                language = fence_language(line) if stripped.startswith('```') else None
+                if language is not None:
+                    self._fence(language, text[pos:line_end + 1], out)
+                    pos = line_end + 1
+                    continue
+
+            end = length if newline == -1 else newline + 1
+            content = text[pos:end]
+            out.append(self._minifier.feed(content) if self._minifier else content)
+            self._at_line_start = newline != -1
+            pos = end
+        return ''.join(out)
+
+    def _fence(self, language, line, out):
+        """
+        Pass a fence line through, ending the block in progress and starting a new one if it opens one
+        """
+        if self._in_fence:
+            if self._minifier:
+                out.append(self._minifier.close())
+                self._minifier = None
+            # The fence must start a line, and minified code rarely ends with one
+            if (''.join(out)[-1:] or self._last) != '\n':
+                out.append('\n')
+            if not language:
+                self._in_fence = False
+                out.append(line)
+                return
+        self._in_fence = True
+        section = SECTION_NAMES.get(language)
+        self._minifier = MINIFIERS[section]() if section else None
+        out.append(line)
+
+
+def compact_site(html, css, js):
+    """
+    Minify the three parts of a site for a prompt and report what that saved
+    """
+    original = {'html': html or '', 'css': css or '', 'js': js or ''}
+    compacted = {section: minify(section, text).strip() for section, text in original.items()}
+    original_chars = sum(len(text) for text in original.values())
+    compacted_chars = sum(len(text) for text in compacted.values())
+    return dict(compacted, stats={
+        'original_chars': original_chars,
+        'compacted_chars': compacted_chars,
+        'original_tokens': estimate_tokens(''.join(original.values())),
+        'compacted_tokens': estimate_tokens(''.join(compacted.values())),
+        'saved_pct': round((1 - compacted_chars / original_chars) * 100, 1) if original_chars else 0.0
+    })
@@ -0,0 +1,201 @@
+"""
+Which model, and how many output tokens, each model call gets.
+
+Calls are routed by task: image topic extraction, patch edits, full
+modifications, websites, and three kinds of application. A task's output
+budget grows with the size of its input (the description, or the site being
+modified). Each task has a preferred model profile, and small edits go to the
+'fast' one. A call whose budget is more than its profile allows moves up to
+the next profile that can take it.
+
+Budgets learn from truncation. Each task keeps a moving average of how
+often its calls stop at max_output_tokens. While that average is above the
+target rate, every truncated call scales the task's budgets up. Once
+truncation is rare, the budgets ease back toward their base.
+"""
+import os
+import threading
+
+from continuation import finish_reason
+from metrics import MODEL_ROUTES, ROUTED_TRUNCATIONS
+
+# Model profiles from smallest to largest
+PROFILE_ORDER = ('fast', 'default', 'large')
+
+
+class ModelProfile:
+    def __init__(self, name, model, max_output_tokens=8192):
+        self.name = name
+        self.model = model
+        self.max_output_tokens = max_output_tokens
+
+
+class TaskBudget:
+    """
+    Output tokens for a task: base + per_token for every input token, and at
+    least floor. With fast_when_small, inputs of up to the router's
+    small_tokens go to the fast profile.
+    """
+
+    def __init__(self, profile, base, per_token=0.0, floor=0, fast_when_small=False):
+        self.profile = profile
+        self.base = base
+        self.per_token = per_token
+        self.floor = floor
+        self.fast_when_small = fast_when_small
+
+
+TASKS = {
+    'topics': TaskBudget('fast', 100),
+    # Patches and full modifications are sized by the site they change
+    'patch': TaskBudget('default', 2048, fast_when_small=True),
+    # The model writes the whole site back (usually less compactly than it was sent), plus room for the change itself
+    'modify': TaskBudget('default', 1024, per_token=1.5, floor=2048, fast_when_small=True),
+    # Generations are sized by their description, since longer ones ask for more
+    'website': TaskBudget('default', 2048, per_token=8.0),
+    'application': TaskBudget('default', 4096, per_token=8.0),
+    'game': TaskBudget('default', 4096, per_token=8.0),
+    'simulation': TaskBudget('large', 6144, per_token=8.0)
+}
+
+
+class Route:
+    """
+    Where one model call goes: the profile, its model, and max_output_tokens.
+    settings are the call's other generation settings (temperature and so on).
+    """
+
+    def __init__(self, task, profile, max_output_tokens, settings):
+        self.task = task
+        self.profile = profile.name
+        self.model = profile.model
+        self.max_output_tokens = max_output_tokens
+        self.settings = settings
+
+
+class Router:
+    """
+    Picks a Route for each call from the profiles and TASKS, and learns
+    each task's budget scale (1 to `max_scale`) from observe().
+    """
+
+    def __init__(self, profiles, tasks=None, small_tokens=1500, truncation_target=0.1, max_scale=2.0, alpha=0.1):
+        self.profiles = profiles
+        self.tasks = tasks or TASKS
+        self.small_tokens = small_tokens
+        self.truncation_target = truncation_target
+        self.max_scale = max_scale
+        self.alpha = alpha
+        self._rates = {}  # task -> moving average of truncated calls
+        self._scales = {}  # task -> budget multiplier
+        self._lock = threading.Lock()
+
+    def base_budget(self, task, input_tokens=0):
+        """
+        Output tokens for the task before any learned scaling
+        """
+        budget = self.tasks[task]
+        return max(budget.floor, int(budget.base + budget.per_token * input_tokens))
+
+    def route(self, task, input_tokens=0, ceiling=None, **settings):
+        """
+        Route a call for the task with an input of about input_tokens. The
+        budget never goes over ceiling, if given, or the profile's own limit.
+        """
+        with self._lock:
+            scale = self._scales.get(task, 1.0)
+        max_output_tokens = int(self.base_budget(task, input_tokens) * scale)
+        if ceiling:
+            max_output_tokens = min(max_output_tokens, ceiling)
+        profile = self._profile_for(task, input_tokens, max_output_tokens)
+        MODEL_ROUTES.inc(task=task, profile=profile.name)
+        return Route(task, profile, min(max_output_tokens, profile.max_output_tokens), settings)
+
+    def observe(self, route, truncated):
+        """
+        Record whether a routed call stopped at its output budget
+        """
+        if truncated:
+            ROUTED_TRUNCATIONS.inc(task=route.task, profile=route.profile)
+        with self._lock:
+            rate = (1 - self.alpha) * self._rates.get(route.task, 0.0) + self.alpha * (1.0 if truncated else 0.0)
+            self._rates[route.task] = rate
+            scale = self._scales.get(route.task, 1.0)
+            if truncated and rate > self.truncation_target:
+                scale = min(self.max_scale, scale * 1.25)
+            elif not truncated and rate < self.truncation_target / 2:
+                scale = max(1.0, scale * 0.98)
+            self._scales[route.task] = scale
+        if truncated:
+            print(f"{route.task} call on {route.model} stopped at {route.max_output_tokens} tokens "
+                  f"(truncation rate {round(rate, 2)}, budget scale {round(scale, 2)})")
+
+    def snapshot(self):
+        with self._lock:
+            tasks = {
+                task: {'truncation_rate': round(rate, 3), 'scale': round(self._scales.get(task, 1.0), 2)}
+                for task, rate in self._rates.items()
+            }
+        profiles = {
+            name: {'model': profile.model, 'max_output_tokens': profile.max_output_tokens}
+            for name, profile in self.profiles.items()
+        }
+        return {'profiles': profiles, 'tasks': tasks}
+
+    def _profile_for(self, task, input_tokens, max_output_tokens):
+        """
+        The task's preferred profile, or the next larger one that allows max_output_tokens
+        """
+        budget = self.tasks[task]
+        preferred = 'fast' if budget.fast_when_small and input_tokens <= self.small_tokens else budget.profile
+        names = PROFILE_ORDER[PROFILE_ORDER.index(preferred):]
+        for name in names:
+            if self.profiles[name].max_output_tokens >= max_output_tokens:
+                return self.profiles[name]
+        return self.profiles[names[-1]]
+
+
+def observed(chunks, router, route):
+    """
+    Pass a model stream's chunks through, then tell the router whether it stopped at its budget
+    """
+    reason = None
+    for chunk in chunks:
+        reason = finish_reason(chunk) or reason
+        yield chunk
+    router.observe(route, reason == 'MAX_TOKENS')
+
+
+async def aobserved(chunks, router, route):
+    """
+    observed() for async model streams
+    """
+    reason = None
+    async for chunk in chunks:
+        reason = finish_reason(chunk) or reason
+        yield chunk
+    router.observe(route, reason == 'MAX_TOKENS')
+
+
+def create_router_from_env(default_model):
+    """
+    Build the process-wide router. Profiles use default_model unless
+    GEMINI_FAST_MODEL or GEMINI_LARGE_MODEL name another model for them.
+    """
+    profiles = {
+        'fast': ModelProfile(
+            'fast', os.getenv('GEMINI_FAST_MODEL') or default_model,
+            int(os.getenv('GEMINI_FAST_MAX_OUTPUT_TOKENS', '8192'))
+        ),
+        'default': ModelProfile('default', default_model, int(os.getenv('GEMINI_MAX_OUTPUT_TOKENS', '8192'))),
+        'large': ModelProfile(
+            'large', os.getenv('GEMINI_LARGE_MODEL') or default_model,
+            int(os.getenv('GEMINI_LARGE_MAX_OUTPUT_TOKENS', '8192'))
+        )
+    }
+    return Router(
+        profiles,
+        small_tokens=int(os.getenv('ROUTING_SMALL_TOKENS', '1500')),
+        truncation_target=float(os.getenv('ROUTING_TRUNCATION_TARGET', '0.1')),
+        max_scale=float(os.getenv('ROUTING_MAX_SCALE', '2.0'))
+    )
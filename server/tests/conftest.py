@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# The server's modules import each other by their flat names, as app.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Importing app opens (and if need be creates) the image catalog; keep it out of the source tree
+os.environ.setdefault('IMAGE_CATALOG_DB', os.path.join(tempfile.mkdtemp(prefix='image-catalog-'), 'catalog.sqlite3'))
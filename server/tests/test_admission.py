@@ -0,0 +1,116 @@
+import pytest
+
+from admission import AdmissionController, AdmissionRejected, parse_weights
+
+
+def admitted_clients(tickets):
+    return [ticket.client for ticket in tickets if ticket.admitted]
+
+
+def test_admits_up_to_max_active_and_queues_the_rest():
+    controller = AdmissionController(max_active=2, per_client=2)
+    tickets = [controller.request(client) for client in ('a', 'b', 'c')]
+    assert [ticket.admitted for ticket in tickets] == [True, True, False]
+    assert tickets[2].position == 1
+    tickets[0].release()
+    assert tickets[2].admitted
+    assert tickets[2].position == 0
+
+
+def test_clients_take_turns_instead_of_first_come_first_served():
+    controller = AdmissionController(max_active=1, per_client=1, max_waiting=10, client_queue=5)
+    first = controller.request('burst')
+    burst = [controller.request('burst') for _ in range(3)]
+    other = controller.request('other')
+    assert first.admitted
+    # The burst's second ticket ties with other's first and was queued earlier; the rest wait behind other
+    assert other.position == 2
+
+    order = []
+    current = first
+    for _ in range(4):
+        current.release()
+        current = next(ticket for ticket in burst + [other] if ticket.admitted and not ticket.released)
+        order.append(current.client)
+    assert order == ['burst', 'other', 'burst', 'burst']
+
+
+def test_per_client_limit_lets_other_clients_through():
+    controller = AdmissionController(max_active=3, per_client=1, client_queue=5)
+    tickets = [controller.request('a'), controller.request('a'), controller.request('b')]
+    assert admitted_clients(tickets) == ['a', 'b']
+    assert not tickets[1].admitted
+
+
+def test_weights_give_a_client_a_larger_share():
+    controller = AdmissionController(max_active=1, per_client=1, max_waiting=10, client_queue=5,
+                                     weights={'heavy': 2.0})
+    blocker = controller.request('x')
+    heavy = [controller.request('heavy') for _ in range(3)]
+    light = [controller.request('light') for _ in range(2)]
+    assert [ticket.position for ticket in heavy + light] == [1, 2, 4, 3, 5]
+    blocker.release()
+
+
+def test_rejects_when_the_queue_is_full():
+    controller = AdmissionController(max_active=1, max_waiting=1, client_queue=5)
+    controller.request('a')
+    controller.request('b')
+    with pytest.raises(AdmissionRejected) as error:
+        controller.request('c')
+    assert error.value.retry_after >= 1
+    assert 'the queue' in str(error.value)
+    assert controller.stats()['rejected'] == 1
+
+
+def test_rejects_a_client_with_too_many_waiting():
+    controller = AdmissionController(max_active=1, max_waiting=10, client_queue=1)
+    controller.request('a')
+    controller.request('a')
+    with pytest.raises(AdmissionRejected) as error:
+        controller.request('a')
+    assert 'your queue' in str(error.value)
+    assert not controller.request('b').admitted
+
+
+def test_abandoned_tickets_leave_the_queue():
+    controller = AdmissionController(max_active=1)
+    active = controller.request('a')
+    waiting = controller.request('b')
+    waiting.release()
+    assert controller.stats()['waiting'] == 0
+    active.release()
+    waiting.release()
+    assert controller.stats() == dict(controller.stats(), active=0, waiting=0, clients=0)
+
+
+def test_holding_releases_when_the_frames_run_out():
+    controller = AdmissionController(max_active=1)
+    ticket = controller.request('a')
+    assert list(ticket.holding(iter(['x', 'y']))) == ['x', 'y']
+    assert ticket.released
+    assert controller.stats()['active'] == 0
+
+
+def test_backoff_holds_admissions_back():
+    controller = AdmissionController(max_active=2)
+    controller.backoff(60)
+    ticket = controller.request('a')
+    assert not ticket.admitted
+    assert not ticket.wait(0.01)
+    assert controller.stats()['paused_seconds'] > 0
+
+
+def test_parse_weights():
+    assert parse_weights('a=2, b = 0.5,,c=') == {'a': 2.0, 'b': 0.5}
+    assert parse_weights(None) == {}
+
+
+def test_a_full_queue_gets_a_429_with_retry_after(monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, 'admission', AdmissionController(max_active=1, max_waiting=0))
+    response = app.app.test_client().post('/api/generate-website', json={'description': 'a bakery'})
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+    assert response.get_json()['retryAfter'] == int(response.headers['Retry-After'])
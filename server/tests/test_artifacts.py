@@ -0,0 +1,94 @@
+import json
+import re
+from types import SimpleNamespace
+
+import pytest
+
+from artifacts import ArtifactStore, PatchError, apply_patch, complete_patch, parse_patch
+
+SITE = {
+    'html': '<main>\n  <h1>Bakery</h1>\n  <p>Fresh bread</p>\n  <p>Fresh bread</p>\n</main>',
+    'css': 'h1 {\n  color: red;\n}',
+    'js': "console.log('hi');"
+}
+
+
+def block(section, search, replace):
+    return f"<<<<<<< SEARCH {section}\n{search}\n=======\n{replace}\n>>>>>>> REPLACE\n"
+
+
+def test_apply_replaces_the_matching_text():
+    sections, edits = apply_patch(SITE, block('css', '  color: red;', '  color: blue;'))
+    assert edits == 1
+    assert sections['css'] == 'h1 {\n  color: blue;\n}'
+    assert sections['html'] == SITE['html']
+
+
+def test_apply_ignores_whitespace_differences_and_appends_on_empty_search():
+    patch = block('html', '<h1>Bakery</h1>', '  <h1>Bakery & Cafe</h1>') + block('javascript', '', 'init();')
+    sections, edits = apply_patch(SITE, patch)
+    assert edits == 2
+    assert '  <h1>Bakery & Cafe</h1>' in sections['html']
+    assert sections['js'] == "console.log('hi');\ninit();"
+
+
+def test_no_match_raises():
+    with pytest.raises(PatchError, match='not found in css'):
+        apply_patch(SITE, block('css', 'h2 {', 'h3 {'))
+
+
+def test_ambiguous_match_raises():
+    with pytest.raises(PatchError, match='matches 2 places in html'):
+        apply_patch(SITE, block('html', '<p>Fresh bread</p>', '<p>Sourdough</p>'))
+    with pytest.raises(PatchError, match='matches 2 places in html'):
+        apply_patch(SITE, block('html', '<p>Fresh   bread</p>', '<p>Sourdough</p>'))
+
+
+def test_parse_errors():
+    with pytest.raises(PatchError, match='No edit blocks'):
+        parse_patch('I changed the colour.')
+    with pytest.raises(PatchError, match="Unknown patch section 'python'"):
+        parse_patch(block('python', 'a', 'b'))
+    assert parse_patch('NO CHANGES needed') == []
+
+
+def test_truncated_patch_is_rejected():
+    patch = block('css', '  color: red;', '  color: blue;')
+    assert complete_patch(patch, 'STOP') == patch
+    with pytest.raises(PatchError, match='cut off'):
+        complete_patch(patch, 'MAX_TOKENS')
+
+
+def test_store_versions_a_site_and_persists_it(tmp_path):
+    db_path = str(tmp_path / 'sites.sqlite3')
+    store = ArtifactStore(db_path=db_path)
+    first = store.save('<p>a</p>', '', '')
+    second = store.save('<p>b</p>', '', '', first['site_id'])
+    assert second['version'] == 2
+    assert second['content_hash'] != first['content_hash']
+    assert ArtifactStore(db_path=db_path).get(first['site_id'])['html'] == '<p>b</p>'
+
+
+def chunk(text, reason=None):
+    return SimpleNamespace(text=text, candidates=[SimpleNamespace(finish_reason=reason)])
+
+
+def test_truncated_patch_falls_back_to_regenerating(monkeypatch):
+    import app
+
+    site = app.artifact_store.save(SITE['html'], SITE['css'], SITE['js'])
+    regenerated = "```html\n<h1>New</h1>\n```\n```css\nh1 { color: blue; }\n```\n```javascript\n```\n"
+    streams = [
+        # Its only complete block applies, but the rest of the edit was cut off
+        [chunk(block('css', '  color: red;', '  color: blue;')), chunk('<<<<<<< SEARCH html\n<h1>', 'MAX_TOKENS')],
+        [chunk(regenerated, 'STOP')]
+    ]
+    monkeypatch.setattr(app, 'open_gemini_stream', lambda prompt, route, endpoint: iter(streams.pop(0)))
+
+    frames = list(app.stream_patched_site(app.artifact_store.get(site['site_id']), 'make it blue', '', 'raw'))
+    events = [json.loads(data) for data in re.findall(r'data: (.*)', ''.join(frames))]
+    phases = [event['phase'] for event in events if 'phase' in event]
+    assert 'patch_applied' not in phases
+    assert phases[:2] == ['patching', 'patch_failed']
+    assert not streams
+    assert app.artifact_store.get(site['site_id'])['html'] == '<h1>New</h1>'
@@ -0,0 +1,202 @@
+import threading
+import time
+
+import broadcast as broadcast_module
+from broadcast import Broadcast, ReplayStore, SingleFlight
+from framing import HEARTBEAT_FRAME
+
+
+def published(*frames, max_frames=None):
+    broadcast = Broadcast(max_frames=max_frames)
+    for frame in frames:
+        broadcast.publish(frame)
+    return broadcast
+
+
+def test_subscribers_resume_after_the_last_event_id():
+    broadcast = published('a', 'b', 'c')
+    broadcast.finish()
+    assert list(broadcast.subscribe()) == ['id: 1\na', 'id: 2\nb', 'id: 3\nc']
+    assert list(broadcast.subscribe(2)) == ['id: 3\nc']
+    assert list(broadcast.subscribe(3)) == []
+
+
+def test_late_subscribers_follow_a_running_stream():
+    broadcast = published('a')
+    frames = broadcast.subscribe(1)
+
+    def produce():
+        broadcast.publish('b')
+        broadcast.finish()
+
+    threading.Timer(0.05, produce).start()
+    assert list(frames) == ['id: 2\nb']
+
+
+def test_idle_subscribers_get_heartbeats():
+    broadcast = published('a')
+    frames = broadcast.subscribe(1, heartbeat=0.01)
+    assert next(frames) == HEARTBEAT_FRAME
+    broadcast.finish()
+    assert list(frames) == []
+
+
+def test_dropped_frames_cannot_be_resumed():
+    broadcast = published('a', 'b', 'c', 'd', max_frames=2)
+    assert broadcast.can_resume(2)
+    assert not broadcast.can_resume(1)
+    broadcast.finish()
+    assert list(broadcast.subscribe(1)) == []
+    assert list(broadcast.subscribe(2)) == ['id: 3\nc', 'id: 4\nd']
+
+
+def test_subscribers_are_counted_while_they_read():
+    broadcast = published('a')
+    frames = broadcast.subscribe()
+    assert broadcast.subscribers == 0
+    next(frames)
+    assert broadcast.subscribers == 1
+    frames.close()
+    assert broadcast.subscribers == 0
+
+
+def test_listeners_are_woken_and_read_new_frames():
+    broadcast = published('a')
+    wakes = []
+    broadcast.listen(lambda: wakes.append(1))
+    broadcast.publish('b')
+    broadcast.finish()
+    assert len(wakes) == 2
+    assert broadcast.read(1) == ([(2, 'b')], True)
+    assert broadcast.subscribers == 1
+
+
+def test_replay_store_expires_finished_generations(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(broadcast_module.time, 'time', lambda: now[0])
+    store = ReplayStore(ttl=60)
+    running, finished = store.create(), store.create()
+    finished.finish()
+    now[0] += 61
+    assert store.get(finished.generation_id) is None
+    assert store.get(running.generation_id) is running
+    assert store.stats()['evictions'] == 1
+
+
+def test_replay_store_drops_the_oldest_finished_generations_over_max_bytes():
+    store = ReplayStore(max_bytes=10)
+    old, new = store.create(), store.create()
+    old.publish('x' * 8)
+    old.finish()
+    new.publish('y' * 8)
+    new.finish()
+    store.evict()
+    assert store.get(old.generation_id) is None
+    assert store.get(new.generation_id) is new
+
+
+def test_resume_route_replays_after_last_event_id():
+    import app
+
+    broadcast = app.replay_store.create()
+    for text in ('a', 'b', 'c'):
+        broadcast.publish(app.sse_event({'text': text}))
+    broadcast.finish()
+    client = app.app.test_client()
+    body = client.get(f"/api/streams/{broadcast.generation_id}", headers={'Last-Event-ID': '1'}).get_data(as_text=True)
+    assert body == 'id: 2\ndata: {"text": "b"}\n\nid: 3\ndata: {"text": "c"}\n\n'
+    assert client.get(f"/api/streams/{broadcast.generation_id}?lastEventId=x").status_code == 400
+    assert client.get('/api/streams/unknown').status_code == 404
+
+
+def single_flight():
+    return SingleFlight(lambda e: f'error: {e}', announce=lambda generation_id: 'start')
+
+
+def released(flights):
+    """
+    Wait for the pump to release its key, which it does just after finishing the broadcast
+    """
+    deadline = time.monotonic() + 5
+    while flights.stats()['in_flight'] and time.monotonic() < deadline:
+        time.sleep(0.001)
+    return flights.stats()['in_flight'] == 0
+
+
+def test_identical_generations_share_one_upstream_call():
+    flights = single_flight()
+    gate = threading.Event()
+    calls = []
+
+    def prepare():
+        calls.append(threading.current_thread())
+
+        def frames():
+            gate.wait(5)
+            yield 'a'
+            yield 'b'
+        return frames()
+
+    leader = flights.run('key', prepare)
+    follower = flights.run('key', prepare)
+    # prepare() runs on the leader's own thread, only the pump is a background thread
+    assert calls == [threading.current_thread()]
+    assert flights.stats() == {'in_flight': 1, 'leaders': 1, 'followers': 1}
+
+    gate.set()
+    expected = ['id: 1\nstart', 'id: 2\na', 'id: 3\nb']
+    assert list(leader) == expected
+    assert list(follower) == expected
+    assert released(flights)
+
+    # Once the generation finished, the same key starts a new one
+    gate.set()
+    assert list(flights.run('key', prepare))[1:] == ['id: 2\na', 'id: 3\nb']
+    assert len(calls) == 2
+
+
+def test_generations_without_a_key_are_never_shared():
+    flights = single_flight()
+    runs = [flights.run(None, lambda: iter(['a'])) for _ in range(2)]
+    assert [list(frames) for frames in runs] == [['id: 1\nstart', 'id: 2\na']] * 2
+    assert flights.stats() == {'in_flight': 0, 'leaders': 2, 'followers': 0}
+
+
+def test_prepare_errors_reach_the_leader_and_end_the_followers_streams():
+    flights = single_flight()
+    preparing = threading.Event()
+    fail = threading.Event()
+    errors = []
+
+    def prepare():
+        preparing.set()
+        fail.wait(5)
+        raise RuntimeError('no model')
+
+    def lead():
+        try:
+            flights.run('key', prepare)
+        except RuntimeError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=lead)
+    leader.start()
+    assert preparing.wait(5)
+    follower = flights.run('key', lambda: iter(['unused']))
+    fail.set()
+    leader.join(5)
+
+    assert [str(e) for e in errors] == ['no model']
+    assert list(follower) == ['id: 1\nstart', 'id: 2\nerror: no model']
+    assert flights.stats() == {'in_flight': 0, 'leaders': 1, 'followers': 1}
+
+
+def test_stream_errors_are_published_after_the_frames_so_far():
+    flights = single_flight()
+
+    def frames():
+        yield 'a'
+        raise RuntimeError('stream broke')
+
+    assert list(flights.run('key', lambda: frames())) == ['id: 1\nstart', 'id: 2\na', 'id: 3\nerror: stream broke']
+    assert released(flights)
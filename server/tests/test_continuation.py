@@ -0,0 +1,105 @@
+import enum
+from types import SimpleNamespace
+
+from continuation import OVERLAP_WINDOW, Stitcher, chunk_text, continued_texts, finish_reason, repeated_length
+
+
+class FinishReason(enum.Enum):
+    STOP = 1
+    MAX_TOKENS = 2
+
+
+def chunk(text='', reason=None):
+    return SimpleNamespace(text=text, candidates=[SimpleNamespace(finish_reason=reason)])
+
+
+def test_finish_reason_names():
+    assert finish_reason(chunk(reason=FinishReason.MAX_TOKENS)) == 'MAX_TOKENS'
+    assert finish_reason(chunk(reason=1)) == 'STOP'
+    assert finish_reason(chunk()) is None
+    assert finish_reason(SimpleNamespace(text='x')) is None
+
+
+def test_chunk_text_of_a_chunk_without_text():
+    class NoText:
+        @property
+        def text(self):
+            raise ValueError('no text part')
+
+    assert chunk_text(NoText()) == ''
+    assert chunk_text(chunk('a')) == 'a'
+
+
+def test_repeated_length_takes_long_matches():
+    assert repeated_length('color: red;\n  margin', 'red;\n  margin: 0;') == len('red;\n  margin')
+    assert repeated_length('abc', 'xyz') == 0
+
+
+def test_repeated_length_takes_whole_repeated_lines():
+    assert repeated_length('a\n<ul>', '<ul>\n<li>') == len('<ul>')
+    assert repeated_length('x\nabc\n', 'abc\nq') == len('abc\n')
+
+
+def test_repeated_length_keeps_new_closing_brackets():
+    assert repeated_length('x\n}', '}\n}') == 0
+    assert repeated_length('a {\n  b {\n  }\n}', '}\n') == 0
+    assert repeated_length('f(a\n);', ');\nnext') == 0
+
+
+def test_repeated_length_keeps_short_matches_inside_a_line():
+    assert repeated_length('foo\nbar', 'bar;\nbaz') == 0
+    assert repeated_length('x = 1;\nlet y', 'let y = 2') == 0
+
+
+def stitch(*responses, max_continuations=2):
+    """
+    Run continued_texts over canned responses, recording the tails continuations were asked for with
+    """
+    responses = list(responses)
+    tails = []
+
+    def continue_with(tail):
+        tails.append(tail)
+        return iter(responses.pop(0))
+
+    stitcher = Stitcher(max_continuations=max_continuations)
+    text = ''.join(continued_texts(iter(responses.pop(0)), stitcher, continue_with))
+    return text, tails, stitcher
+
+
+def test_complete_output_needs_no_continuation():
+    text, tails, stitcher = stitch([chunk('```css\nh1 {}\n```\n', 'STOP')])
+    assert text == '```css\nh1 {}\n```\n'
+    assert tails == []
+    assert stitcher.continuations == 0
+
+
+def test_truncated_output_is_continued_without_the_repeat():
+    padding = 'p { margin: 0; }\n' * (OVERLAP_WINDOW // 10)
+    first = '```css\nh1 {\n  color: red;\n'
+    continuation = '```css\n  color: red;\n}\n' + padding + '```\n'
+    text, tails, stitcher = stitch([chunk(first, 'MAX_TOKENS')], [chunk(continuation, 'STOP')])
+    assert text == first + '}\n' + padding + '```\n'
+    assert tails == [first]
+    assert stitcher.continuations == 1
+
+
+def test_a_new_closing_brace_survives_stitching():
+    first = '```css\n@media print {\n  a {\n  color: red;\n}\n'
+    text, _, _ = stitch([chunk(first, 'MAX_TOKENS')], [chunk('}\n```\n', 'STOP')])
+    assert text == first + '}\n```\n'
+    assert text.count('{') == text.count('}')
+
+
+def test_unclosed_fence_is_continued():
+    text, tails, _ = stitch([chunk('```javascript\nrun();\n', 'STOP')], [chunk('done();\n```\n', 'STOP')])
+    assert text == '```javascript\nrun();\ndone();\n```\n'
+    assert len(tails) == 1
+
+
+def test_continuations_stop_at_the_limit():
+    responses = [[chunk('```html\n<p>', 'MAX_TOKENS')]] + [[chunk('more', 'MAX_TOKENS')]] * 2
+    text, tails, stitcher = stitch(*responses, max_continuations=1)
+    assert text == '```html\n<p>more'
+    assert len(tails) == 1
+    assert stitcher.continuations == 1
@@ -0,0 +1,89 @@
+import random
+
+from fence_parser import FenceParser, fence_language
+
+RESPONSE = (
+    "Here is the site:\n"
+    "```html\n<main>\n  <p>Inline ``` is not a fence</p>\n</main>\n```\n"
+    "Some notes.\n"
+    "```python\nprint('ignored')\n```\n"
+    "  ```css\nbody { margin: 0; }\n  ```\n"
+    "```javascript\nconst s = `template`;\nconsole.log(s);\n```\n"
+)
+
+
+def parse(chunks):
+    parser = FenceParser()
+    events = []
+    for chunk in chunks:
+        events += parser.feed(chunk)
+    return events + parser.close()
+
+
+def normalize(events):
+    """
+    The events with consecutive deltas of a section merged, so any chunking of the same text compares equal
+    """
+    merged = []
+    for event in events:
+        if 'delta' in event and merged and 'delta' in merged[-1] and merged[-1]['section'] == event['section']:
+            merged[-1] = dict(merged[-1], delta=merged[-1]['delta'] + event['delta'])
+        else:
+            merged.append(dict(event))
+    return merged
+
+
+def test_sections_in_one_chunk():
+    assert normalize(parse([RESPONSE])) == [
+        {'section': 'html', 'event': 'section_start'},
+        {'section': 'html', 'delta': "<main>\n  <p>Inline ``` is not a fence</p>\n</main>\n"},
+        {'section': 'html', 'event': 'section_end'},
+        {'section': 'css', 'event': 'section_start'},
+        {'section': 'css', 'delta': "body { margin: 0; }\n"},
+        {'section': 'css', 'event': 'section_end'},
+        {'section': 'js', 'event': 'section_start'},
+        {'section': 'js', 'delta': "const s = `template`;\nconsole.log(s);\n"},
+        {'section': 'js', 'event': 'section_end'},
+    ]
+
+
+def test_every_two_way_split_parses_the_same():
+    expected = normalize(parse([RESPONSE]))
+    for split in range(1, len(RESPONSE)):
+        assert normalize(parse([RESPONSE[:split], RESPONSE[split:]])) == expected, split
+
+
+def test_random_chunkings_parse_the_same():
+    expected = normalize(parse([RESPONSE]))
+    rng = random.Random(7)
+    for _ in range(200):
+        chunks, pos = [], 0
+        while pos < len(RESPONSE):
+            size = rng.randint(1, 12)
+            chunks.append(RESPONSE[pos:pos + size])
+            pos += size
+        assert normalize(parse(chunks)) == expected
+
+
+def test_character_by_character():
+    assert normalize(parse(list(RESPONSE))) == normalize(parse([RESPONSE]))
+
+
+def test_unterminated_section_is_closed():
+    parser = FenceParser()
+    parser.feed("```css\nbody {}\n")
+    assert parser.unterminated
+    assert parser.close() == [{'section': 'css', 'event': 'section_end'}]
+
+
+def test_closing_fence_without_newline_counts_as_closed():
+    parser = FenceParser()
+    parser.feed("```css\nbody {}\n```")
+    assert not parser.unterminated
+    assert parser.close() == [{'section': 'css', 'event': 'section_end'}]
+
+
+def test_fence_language():
+    assert fence_language('```JavaScript') == 'javascript'
+    assert fence_language('  ```  ') == ''
+    assert fence_language('text ```css') is None
@@ -0,0 +1,138 @@
+import threading
+import zlib
+
+import pytest
+
+from broadcast import Broadcast
+from framing import HEARTBEAT_FRAME, FrameCoalescer, GzipStream, accepts_gzip, gzip_frames, with_ticks
+
+
+def test_the_first_text_goes_out_straight_away():
+    coalescer = FrameCoalescer(min_bytes=100, flush_interval=1.0)
+    coalescer.add({'text': 'a'}, now=0.0)
+    assert coalescer.due(0.0)
+    assert coalescer.flush() == [{'text': 'a'}]
+    assert not coalescer.due(0.0)
+
+
+def test_later_text_waits_for_min_bytes_or_the_flush_interval():
+    coalescer = FrameCoalescer(min_bytes=10, flush_interval=1.0)
+    coalescer.add({'text': 'first'}, now=0.0)
+    coalescer.flush()
+
+    coalescer.add({'text': 'abcd'}, now=1.0)
+    coalescer.add({'text': 'efgh'}, now=1.2)
+    assert not coalescer.due(1.5)
+    coalescer.add({'text': 'ij'}, now=1.6)
+    assert coalescer.due(1.6)
+    assert coalescer.flush() == [{'text': 'abcdefghij'}]
+
+    # The interval counts from the oldest pending text
+    coalescer.add({'text': 'k'}, now=3.0)
+    assert not coalescer.due(3.9)
+    assert coalescer.due(4.0)
+
+
+def test_only_deltas_of_the_same_section_are_merged():
+    coalescer = FrameCoalescer(min_bytes=1000, flush_interval=10.0)
+    for event in (
+        {'section': 'html', 'delta': '<p>'},
+        {'section': 'html', 'delta': 'hi</p>'},
+        {'section': 'css', 'delta': 'p {'},
+        {'section_end': 'css'},
+        {'section': 'css', 'delta': '}'},
+    ):
+        coalescer.add(event, now=0.0)
+    assert coalescer.flush() == [
+        {'section': 'html', 'delta': '<p>hi</p>'},
+        {'section': 'css', 'delta': 'p {'},
+        {'section_end': 'css'},
+        {'section': 'css', 'delta': '}'},
+    ]
+
+
+def test_without_min_bytes_every_item_is_flushed():
+    coalescer = FrameCoalescer()
+    coalescer.add({'text': 'a'}, now=0.0)
+    coalescer.flush()
+    coalescer.add({'text': 'b'}, now=0.0)
+    assert coalescer.due(0.0)
+
+
+def test_pending_text_is_flushed_when_the_stream_closes(monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, 'SSE_COALESCE_BYTES', 1000)
+    monkeypatch.setattr(app, 'SSE_FLUSH_INTERVAL', 60.0)
+    monkeypatch.setattr(app, 'STREAM_MINIFY', False)
+    encoder = app.StreamEncoder('raw')
+    assert encoder.feed('Hello') == [app.sse_event({'text': 'Hello'})]
+    assert encoder.feed(', ') == []
+    assert encoder.feed('world') == []
+    assert encoder.pending
+    assert encoder.close() == [app.sse_event({'text': ', world'})]
+
+
+def test_gzip_output_decompresses_to_the_frames():
+    frames = [f"data: {{\"text\": \"chunk {n}\"}}\n\n" for n in range(50)]
+    assert zlib.decompress(b''.join(gzip_frames(frames)), 31).decode('utf-8') == ''.join(frames)
+
+
+def test_every_gzip_write_can_be_decoded_as_it_arrives():
+    stream = GzipStream()
+    decoder = zlib.decompressobj(31)
+    for frame in ('data: {"text": "é"}\n\n', ': keep-alive\n\n', 'data: {"text": "b"}\n\n'):
+        assert decoder.decompress(stream.compress(frame)).decode('utf-8') == frame
+    assert decoder.decompress(stream.finish()) == b''
+    assert decoder.eof
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('gzip', True),
+    ('deflate, gzip;q=0.5', True),
+    ('GZIP', True),
+    ('gzip;q=0', False),
+    ('gzip; q=0.0', False),
+    ('br, deflate', False),
+    (None, False),
+])
+def test_accepts_gzip(header, expected):
+    assert accepts_gzip(header) == expected
+
+
+def test_ticks_are_yielded_while_the_upstream_is_idle():
+    gate = threading.Event()
+
+    def slow():
+        yield 'a'
+        gate.wait(5)
+        yield 'b'
+
+    items = with_ticks(slow(), 0.01)
+    assert next(items) == 'a'
+    assert next(items) is None
+    gate.set()
+    assert [item for item in items if item is not None] == ['b']
+
+
+def test_ticks_pass_upstream_errors_on():
+    def broken():
+        yield 'a'
+        raise RuntimeError('upstream failed')
+
+    items = with_ticks(broken(), 0.01)
+    assert next(items) == 'a'
+    with pytest.raises(RuntimeError):
+        list(items)
+
+
+def test_heartbeats_go_out_between_frames_of_an_idle_stream():
+    broadcast = Broadcast()
+    frames = broadcast.subscribe(heartbeat=0.01)
+    assert next(frames) == HEARTBEAT_FRAME
+    broadcast.publish('data: {"text": "a"}\n\n')
+    broadcast.finish()
+    received = [frame for frame in frames if frame != HEARTBEAT_FRAME]
+    assert received == ['id: 1\ndata: {"text": "a"}\n\n']
+    # A heartbeat is an SSE comment: one line starting with a colon, ending the (empty) event
+    assert HEARTBEAT_FRAME.startswith(':') and HEARTBEAT_FRAME.endswith('\n\n') and HEARTBEAT_FRAME.count('\n') == 2
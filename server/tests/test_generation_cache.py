@@ -0,0 +1,85 @@
+import pytest
+
+from generation_cache import GenerationCache, MinHasher, create_generation_cache_from_env, description_tokens, jaccard
+
+SITE = {'html': '<h1>Hi</h1>', 'css': 'h1{color:red}', 'js': ''}
+
+
+def test_description_tokens_fold_wording():
+    assert description_tokens('A portfolio website for photographers') == {'portfolio', 'site', 'photographer'}
+    assert description_tokens('photographer portfolio page') == {'portfolio', 'site', 'photographer'}
+    assert description_tokens('the of and') == set()
+
+
+def test_minhash_estimates_jaccard():
+    hasher = MinHasher(num_perm=256, bands=32)
+    a = {f"word{i}" for i in range(100)}
+    b = {f"word{i}" for i in range(50, 150)}
+    signature_a, signature_b = hasher.signature(a), hasher.signature(b)
+    estimate = sum(x == y for x, y in zip(signature_a, signature_b)) / len(signature_a)
+    assert abs(estimate - jaccard(a, b)) < 0.1
+
+
+def test_minhash_is_deterministic_for_a_seed():
+    tokens = {'bakery', 'site'}
+    assert MinHasher(seed=3).band_keys(tokens) == MinHasher(seed=3).band_keys(tokens)
+    assert MinHasher(seed=3).band_keys(tokens) != MinHasher(seed=4).band_keys(tokens)
+
+
+def test_num_perm_must_split_into_bands():
+    with pytest.raises(ValueError):
+        MinHasher(num_perm=10, bands=4)
+
+
+def test_lookup_matches_reworded_descriptions():
+    cache = GenerationCache(threshold=0.8)
+    cache.add('website', 'a portfolio site for a photographer', SITE)
+    match = cache.lookup('website', 'photographer portfolio website')
+    assert match['similarity'] == 1.0
+    assert match['sections'] == SITE
+    assert match['description'] == 'a portfolio site for a photographer'
+
+
+def test_lookup_respects_the_threshold():
+    cache = GenerationCache(threshold=0.8)
+    # {bakery, site, paris, modern} against {bakery, site, paris, rustic}: 3 of 5 words shared
+    cache.add('website', 'modern bakery site in paris', SITE)
+    assert cache.lookup('website', 'rustic bakery site in paris') is None
+
+    loose = GenerationCache(threshold=0.5)
+    loose.add('website', 'modern bakery site in paris', SITE)
+    assert loose.lookup('website', 'rustic bakery site in paris')['similarity'] == 0.6
+    assert cache.stats()['misses'] == 1
+
+
+def test_kinds_never_share_entries():
+    cache = GenerationCache()
+    cache.add('website', 'snake game', SITE)
+    assert cache.lookup('application', 'snake game') is None
+    assert cache.lookup('website', 'snake game') is not None
+
+
+def test_same_words_replace_the_entry():
+    cache = GenerationCache()
+    cache.add('website', 'bakery site', SITE)
+    cache.add('website', 'site for a bakery', dict(SITE, js='x()'))
+    assert cache.stats()['entries'] == 1
+    assert cache.lookup('website', 'bakery website')['sections']['js'] == 'x()'
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = GenerationCache(max_entries=2)
+    cache.add('website', 'bakery', SITE)
+    cache.add('website', 'florist', SITE)
+    cache.lookup('website', 'bakery')
+    cache.add('website', 'plumber', SITE)
+    assert cache.lookup('website', 'florist') is None
+    assert cache.lookup('website', 'bakery') is not None
+    assert cache.stats()['evictions'] == 1
+
+
+def test_replay_mode_only_matches_the_same_words(monkeypatch):
+    monkeypatch.delenv('GENERATION_CACHE_REPLAY_SIMILARITY', raising=False)
+    monkeypatch.delenv('GENERATION_CACHE_SIMILARITY', raising=False)
+    assert create_generation_cache_from_env('replay').threshold == 1.0
+    assert create_generation_cache_from_env('seed').threshold == 0.8
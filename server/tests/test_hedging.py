@@ -0,0 +1,203 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from hedging import HedgePolicy, ahedged, hedged
+from metrics import HEDGES
+
+
+def hedges(endpoint, outcome):
+    return HEDGES._values.get((endpoint, outcome), 0)
+
+
+class Calls:
+    """
+    A start() whose first call is a slow primary, held until `release` is set,
+    and whose later calls (hedges) answer straight away
+    """
+
+    def __init__(self, primary_error=None):
+        self.release = threading.Event()
+        self.primary_error = primary_error
+        self.count = 0
+        self.closed = []
+
+    def __call__(self):
+        self.count += 1
+        return self._stream('primary' if self.count == 1 else 'hedge')
+
+    def _stream(self, name):
+        try:
+            if name == 'primary':
+                self.release.wait(5)
+                if self.primary_error:
+                    raise self.primary_error
+            yield f'{name} 1'
+            yield f'{name} 2'
+        finally:
+            self.closed.append(name)
+
+
+def test_a_fast_primary_is_never_hedged():
+    calls = Calls()
+    calls.release.set()
+    assert list(hedged(calls, HedgePolicy(fixed_delay=1.0), 'hedge-fast')) == ['primary 1', 'primary 2']
+    assert calls.count == 1
+    assert hedges('hedge-fast', 'sent') == 0
+
+
+def test_the_hedge_wins_over_a_slow_primary_which_is_then_dropped():
+    calls = Calls()
+    policy = HedgePolicy(fixed_delay=0.01)
+    assert list(hedged(calls, policy, 'hedge-wins')) == ['hedge 1', 'hedge 2']
+    assert calls.count == 2
+    assert hedges('hedge-wins', 'sent') == 1
+    assert hedges('hedge-wins', 'won') == 1
+
+    # The primary can't be interrupted while it waits; it is closed once its first chunk arrives
+    calls.release.set()
+    for _ in range(500):
+        if 'primary' in calls.closed:
+            break
+        time.sleep(0.01)
+    assert calls.closed == ['hedge', 'primary']
+    # Its first-chunk time is still learned, although the hedge won
+    assert len(policy._samples['hedge-wins']) == 1
+
+
+def test_hedges_stop_once_the_budget_is_spent():
+    policy = HedgePolicy(fixed_delay=0.01, budget=0.0, burst=1.0)
+    first = Calls()
+    assert list(hedged(first, policy, 'hedge-budget'))[0] == 'hedge 1'
+
+    second = Calls()
+    threading.Timer(0.1, second.release.set).start()
+    # Over budget, the call waits for its slow primary instead
+    assert list(hedged(second, policy, 'hedge-budget')) == ['primary 1', 'primary 2']
+    assert second.count == 1
+    assert hedges('hedge-budget', 'sent') == 1
+    assert hedges('hedge-budget', 'over_budget') == 1
+    first.release.set()
+
+
+def test_the_budget_refills_with_every_call():
+    policy = HedgePolicy(budget=0.5, burst=1.0)
+    assert policy.spend()
+    assert not policy.spend()
+    policy.earn()
+    assert not policy.spend()
+    policy.earn()
+    assert policy.spend()
+
+
+def test_errors_are_raised_once_both_attempts_failed():
+    def start():
+        raise RuntimeError('unavailable')
+
+    with pytest.raises(RuntimeError):
+        hedged(start, HedgePolicy(fixed_delay=0.01), 'hedge-errors')
+
+
+def test_a_failed_primary_is_covered_by_the_hedge():
+    calls = Calls(primary_error=RuntimeError('primary failed'))
+    threading.Timer(0.1, calls.release.set).start()
+    assert list(hedged(calls, HedgePolicy(fixed_delay=0.01), 'hedge-covers')) == ['hedge 1', 'hedge 2']
+
+
+def test_the_delay_is_learned_from_first_chunk_times():
+    policy = HedgePolicy(percentile=0.9, min_samples=10, min_delay=0.05, initial_delay=2.0)
+    for n in range(9):
+        policy.observe('website', 0.1 * (n + 1))
+    assert policy.delay('website') == 2.0
+    policy.observe('website', 1.0)
+    assert policy.delay('website') == pytest.approx(0.9)
+    assert policy.delay('modify') == 2.0
+
+
+class AsyncCalls:
+    """
+    Async counterpart of Calls: every attempt waits for its own event in `release`
+    """
+
+    def __init__(self):
+        self.release = {'primary': asyncio.Event(), 'hedge': asyncio.Event()}
+        self.count = 0
+        self.cancelled = []
+        self.closed = []
+
+    async def __call__(self):
+        self.count += 1
+        return self._stream('primary' if self.count == 1 else 'hedge')
+
+    async def _stream(self, name):
+        try:
+            await self.release[name].wait()
+            yield f'{name} 1'
+            yield f'{name} 2'
+        except asyncio.CancelledError:
+            self.cancelled.append(name)
+            raise
+        finally:
+            self.closed.append(name)
+
+
+async def collect(chunks):
+    return [chunk async for chunk in chunks]
+
+
+async def settle(done):
+    for _ in range(100):
+        if done():
+            return
+        await asyncio.sleep(0.01)
+
+
+def test_async_hedge_wins_and_the_slow_primary_is_closed():
+    async def main():
+        calls = AsyncCalls()
+        calls.release['hedge'].set()
+        chunks = await ahedged(calls, HedgePolicy(fixed_delay=0.01), 'ahedge-wins')
+        assert await collect(chunks) == ['hedge 1', 'hedge 2']
+        # The primary runs on to its first chunk, so its time is learned, and is then closed
+        calls.release['primary'].set()
+        await settle(lambda: 'primary' in calls.closed)
+        return calls
+
+    calls = asyncio.run(main())
+    assert calls.count == 2
+    assert calls.closed == ['hedge', 'primary']
+    assert calls.cancelled == []
+    assert hedges('ahedge-wins', 'won') == 1
+
+
+def test_async_losing_hedge_is_cancelled():
+    async def main():
+        calls = AsyncCalls()
+        pending = asyncio.ensure_future(ahedged(calls, HedgePolicy(fixed_delay=0.01), 'ahedge-loses'))
+        await settle(lambda: calls.count == 2)
+        calls.release['primary'].set()
+        assert await collect(await pending) == ['primary 1', 'primary 2']
+        await settle(lambda: 'hedge' in calls.cancelled)
+        return calls
+
+    calls = asyncio.run(main())
+    assert calls.count == 2
+    assert calls.cancelled == ['hedge']
+    assert hedges('ahedge-loses', 'sent') == 1
+    assert hedges('ahedge-loses', 'won') == 0
+
+
+def test_async_hedges_stop_once_the_budget_is_spent():
+    async def main():
+        calls = AsyncCalls()
+        policy = HedgePolicy(fixed_delay=0.01, budget=0.0, burst=0.0)
+        pending = asyncio.ensure_future(ahedged(calls, policy, 'ahedge-budget'))
+        await asyncio.sleep(0.05)
+        calls.release['primary'].set()
+        assert await collect(await pending) == ['primary 1', 'primary 2']
+        return calls
+
+    assert asyncio.run(main()).count == 1
+    assert hedges('ahedge-budget', 'over_budget') == 1
@@ -0,0 +1,91 @@
+import sqlite3
+import threading
+
+import pytest
+
+import image_cache
+from image_cache import ImageCache
+
+PHOTOS = [{'url': 'https://images.example/1.jpg', 'photographer': 'A'}]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(image_cache.time, 'time', lambda: now[0])
+    return now
+
+
+def test_least_recently_used_entries_are_evicted(clock):
+    cache = ImageCache(max_entries=2)
+    cache.set('a', PHOTOS)
+    cache.set('b', PHOTOS)
+    assert cache.get('a') == (PHOTOS, 'fresh')
+    cache.set('c', PHOTOS)
+    assert cache.get('b') == (None, 'miss')
+    assert cache.get('a')[1] == 'fresh'
+    assert cache.get('c')[1] == 'fresh'
+
+
+def test_entries_go_stale_then_expire(clock):
+    cache = ImageCache(ttl=60, stale_ttl=600)
+    cache.set('cats|3', PHOTOS)
+    clock[0] += 61
+    assert cache.get('cats|3') == (PHOTOS, 'stale')
+    clock[0] += 600
+    assert cache.get('cats|3') == (None, 'miss')
+    stats = cache.stats()
+    assert (stats['stale_hits'], stats['misses'], stats['entries']) == (1, 1, 0)
+
+
+def test_stale_entries_refresh_once_in_the_background(clock):
+    cache = ImageCache(ttl=60)
+    cache.set('cats|3', PHOTOS)
+    clock[0] += 61
+    release = threading.Event()
+    loads = []
+
+    def loader():
+        loads.append(1)
+        release.wait(5)
+        return [{'url': 'https://images.example/2.jpg'}]
+
+    cache.refresh('cats|3', loader)
+    cache.refresh('cats|3', loader)
+    release.set()
+    for _ in range(500):
+        if cache.get('cats|3')[1] == 'fresh':
+            break
+        threading.Event().wait(0.01)
+    assert cache.get('cats|3') == ([{'url': 'https://images.example/2.jpg'}], 'fresh')
+    assert loads == [1]
+    assert cache.stats()['refreshes'] == 1
+
+
+def test_sqlite_tier_survives_a_restart(tmp_path, clock):
+    db_path = str(tmp_path / 'images.sqlite3')
+    ImageCache(db_path=db_path).set('cats|3', PHOTOS)
+    restarted = ImageCache(ttl=60, db_path=db_path)
+    assert restarted.get('cats|3') == (PHOTOS, 'fresh')
+    assert restarted.stats()['disk_hits'] == 1
+    clock[0] += 61
+    assert ImageCache(ttl=60, db_path=db_path).get('cats|3') == (PHOTOS, 'stale')
+
+
+def rows(db_path):
+    return [key for key, in sqlite3.connect(db_path).execute("SELECT key FROM image_cache ORDER BY key")]
+
+
+def test_sqlite_tier_drops_expired_and_excess_rows(tmp_path, clock):
+    db_path = str(tmp_path / 'images.sqlite3')
+    cache = ImageCache(stale_ttl=600, db_path=db_path, max_disk_entries=2)
+    for key in ('a', 'b', 'c'):
+        cache.set(key, PHOTOS)
+        clock[0] += 1
+    assert rows(db_path) == ['b', 'c']
+
+    # b was written at 1001 and c at 1002, so only b is past the stale TTL
+    clock[0] = 1602
+    reopened = ImageCache(stale_ttl=600, db_path=db_path)
+    assert rows(db_path) == ['c']
+    assert reopened.stats()['purged'] == 1
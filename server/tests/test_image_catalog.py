@@ -0,0 +1,92 @@
+import os
+
+import pytest
+
+from image_catalog import ImageCatalog, create_image_catalog_from_env
+
+
+def unsplash_result(image_id, alt, tags=()):
+    return {
+        'id': image_id,
+        'urls': {'small': f'https://images.example/{image_id}-s.jpg', 'regular': f'https://images.example/{image_id}.jpg',
+                 'thumb': f'https://images.example/{image_id}-t.jpg'},
+        'alt_description': alt,
+        'user': {'name': 'A'},
+        'links': {'download': f'https://images.example/{image_id}/download'},
+        'tags': [{'title': tag} for tag in tags],
+    }
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    catalog = ImageCatalog(str(tmp_path / 'catalog.sqlite3'))
+    catalog.add_results([unsplash_result('beach-alt', 'a dog walking past a mountain lake')], 'beach')
+    catalog.add_results([unsplash_result('hiking', 'people on a trail', tags=['outdoors'])], 'mountain hiking')
+    catalog.add_results([unsplash_result('peaks', 'snowy ridge at dawn', tags=['mountains', 'alps'])], 'landscape')
+    return catalog
+
+
+def ids(images):
+    return [image['download_url'].split('/')[-2] for image in images]
+
+
+def test_topic_and_tag_matches_rank_above_alt_text(catalog):
+    assert ids(catalog.search('mountain', 3))[-1] == 'beach-alt'
+    assert set(ids(catalog.search('mountain', 3))[:2]) == {'hiking', 'peaks'}
+
+
+def test_words_are_stemmed_and_any_of_them_matches(catalog):
+    # 'mountains' in the query and the tags both stem to 'mountain'
+    assert len(catalog.search('mountains', 5)) == 3
+    assert ids(catalog.search('alps outdoors', 5)) in (['peaks', 'hiking'], ['hiking', 'peaks'])
+
+
+def test_search_limits_results_and_reports_the_query_as_topic(catalog):
+    images = catalog.search('mountain', 2)
+    assert len(images) == 2
+    assert all(image['topic'] == 'mountain' for image in images)
+    assert catalog.search('submarine', 2) is None
+    assert catalog.search('', 2) is None
+    assert catalog.stats() == {'images': 3, 'hits': 1, 'misses': 1, 'available': True}
+
+
+def test_duplicates_are_not_added_twice(catalog):
+    assert catalog.add_results([unsplash_result('hiking', 'people on a trail')], 'trail') == 0
+    assert catalog.search('trail', 5) is not None
+    assert catalog.stats()['images'] == 3
+
+
+def test_a_missing_catalog_is_created_empty_and_seeded(tmp_path, monkeypatch, capsys):
+    db_path = tmp_path / 'new.sqlite3'
+    monkeypatch.setenv('IMAGE_CATALOG_DB', str(db_path))
+    catalog = create_image_catalog_from_env()
+    assert 'Warning: no image catalog' in capsys.readouterr().out
+    assert os.path.exists(db_path)
+    assert catalog.stats()['available'] is True
+    assert catalog.search('coffee', 1) is None
+
+    catalog.add_results([unsplash_result('latte', 'latte art in a cup')], 'coffee shop')
+    assert ids(ImageCatalog(str(db_path)).search('coffee', 1)) == ['latte']
+
+
+def test_an_unopenable_catalog_is_empty(tmp_path):
+    catalog = ImageCatalog(str(tmp_path / 'missing-dir' / 'catalog.sqlite3'))
+    assert catalog.search('mountain', 1) is None
+    assert catalog.add_results([unsplash_result('x', 'x')], 'x') == 0
+    assert catalog.stats()['available'] is False
+
+
+def test_live_searches_seed_the_catalog(tmp_path, monkeypatch):
+    import app
+
+    catalog = ImageCatalog(str(tmp_path / 'catalog.sqlite3'))
+    results = [unsplash_result('cafe', 'a bright cafe interior', tags=['coffee'])]
+
+    class Client:
+        def search_photos(self, clean_query, **kwargs):
+            return {'results': results}
+
+    monkeypatch.setattr(app, 'image_catalog', catalog)
+    monkeypatch.setattr(app, 'get_unsplash_client', lambda: Client())
+    assert len(app.search_unsplash('coffee shop', 1)) == 1
+    assert ids(catalog.search('coffee', 1)) == ['cafe']
@@ -0,0 +1,150 @@
+import json
+import threading
+
+import pytest
+
+from broadcast import ReplayStore
+from jobs import JobQueue, JobStore, QueueFull
+
+
+def event_frame(event):
+    return json.dumps(event)
+
+
+def finished(queue, job_id):
+    """
+    Wait for a job's broadcast to finish and return its record
+    """
+    record = queue.store.get(job_id)
+    broadcast = queue.replay_store.get(record['generation_id'])
+    frames = list(broadcast.subscribe())
+    return queue.store.get(job_id), [json.loads(frame.split('\n', 1)[1]) for frame in frames]
+
+
+def make_queue(execute, store=None, **kwargs):
+    return JobQueue(execute, store or JobStore(), ReplayStore(), event_frame, **kwargs)
+
+
+def test_jobs_run_and_publish_their_frames():
+    def execute(record, publish, cancelled):
+        publish(event_frame({'text': record['request']['description']}))
+        return {'html': '<p>done</p>'}
+
+    queue = make_queue(execute)
+    job = queue.submit('website', {'description': 'bakery'})
+    record, events = finished(queue, job['job_id'])
+    assert record['status'] == 'done'
+    assert record['result'] == {'html': '<p>done</p>'}
+    assert [event.get('status') or event.get('text') for event in events] == ['queued', 'running', 'bakery', 'done']
+
+
+def test_higher_priority_jobs_start_first():
+    started = threading.Event()
+    gate = threading.Event()
+    order = []
+
+    def execute(record, publish, cancelled):
+        started.set()
+        gate.wait(5)
+        order.append(record['request']['n'])
+
+    queue = make_queue(execute, workers=1)
+    first = queue.submit('website', {'n': 0})
+    assert started.wait(5)
+    jobs = [queue.submit('website', {'n': n}, priority) for n, priority in ((1, 'low'), (2, 'normal'), (3, 'high'))]
+    assert [queue.get(job['job_id'])['position'] for job in jobs] == [3, 2, 1]
+    gate.set()
+    for job in [first] + jobs:
+        finished(queue, job['job_id'])
+    assert order == [0, 3, 2, 1]
+
+
+def test_queued_jobs_cancel_on_the_spot_and_running_ones_stop():
+    started = threading.Event()
+
+    def execute(record, publish, cancelled):
+        started.set()
+        cancelled.wait(5)
+        return None
+
+    queue = make_queue(execute, workers=1)
+    running = queue.submit('website', {})
+    waiting = queue.submit('website', {})
+    assert started.wait(5)
+    assert queue.cancel(waiting['job_id']) == 'cancelled'
+    assert queue.cancel(running['job_id']) == 'cancelling'
+    assert finished(queue, running['job_id'])[0]['status'] == 'cancelled'
+    assert queue.store.get(waiting['job_id'])['status'] == 'cancelled'
+    assert queue.cancel('unknown') is None
+
+
+def test_failed_jobs_record_the_error():
+    def execute(record, publish, cancelled):
+        raise RuntimeError('model unavailable')
+
+    queue = make_queue(execute)
+    record, events = finished(queue, queue.submit('website', {})['job_id'])
+    assert record['status'] == 'failed'
+    assert record['error'] == 'model unavailable'
+    assert events[-1] == {'jobId': record['job_id'], 'status': 'failed', 'error': 'model unavailable'}
+
+
+def test_submit_rejects_when_the_queue_is_full():
+    started = threading.Event()
+    gate = threading.Event()
+
+    def execute(record, publish, cancelled):
+        started.set()
+        gate.wait(5)
+
+    queue = make_queue(execute, workers=1, max_queued=1)
+    queue.submit('website', {})
+    assert started.wait(5)
+    queue.submit('website', {})
+    with pytest.raises(QueueFull):
+        queue.submit('website', {})
+    with pytest.raises(ValueError):
+        queue.submit('website', {}, priority='urgent')
+    gate.set()
+
+
+def test_restart_requeues_queued_jobs_and_fails_running_ones(tmp_path):
+    db_path = str(tmp_path / 'jobs.sqlite3')
+    store = JobStore(db_path)
+    store.create('was-running', 'website', 'normal', {'description': 'a'}, 'old-generation')
+    store.update('was-running', status='running')
+    store.create('was-queued', 'application', 'high', {'description': 'b'}, 'old-generation')
+
+    ran = []
+
+    def execute(record, publish, cancelled):
+        ran.append(record['job_id'])
+        return {'ok': True}
+
+    queue = make_queue(execute, store=JobStore(db_path))
+    # Nothing is recovered and no worker starts until the server starts the queue
+    assert queue.store.get('was-running')['status'] == 'running'
+    assert queue.stats()['workers'] == 0
+
+    queue.start()
+    queue.start()
+    interrupted = queue.store.get('was-running')
+    assert interrupted['status'] == 'failed'
+    assert interrupted['error'] == 'Interrupted by a server restart'
+
+    record, events = finished(queue, 'was-queued')
+    assert record['status'] == 'done'
+    assert record['generation_id'] != 'old-generation'
+    assert ran == ['was-queued']
+    assert queue.stats()['persistent']
+
+
+def test_the_first_job_request_recovers_the_store(tmp_path):
+    db_path = str(tmp_path / 'jobs.sqlite3')
+    JobStore(db_path).create('was-queued', 'website', 'normal', {'description': 'a'}, 'old-generation')
+
+    queue = make_queue(lambda record, publish, cancelled: {'ok': True}, store=JobStore(db_path))
+    assert queue.stats()['workers'] == 0
+    assert queue.get('was-queued')['status'] in ('queued', 'running', 'done')
+    record, _ = finished(queue, 'was-queued')
+    assert record['status'] == 'done'
@@ -0,0 +1,111 @@
+import random
+
+import pytest
+
+from minify import MINIFIERS, FencedMinifier, compact_site, minify
+
+CSS = "/* theme */\nbody {\n  margin : 0 ;\n  content: \"a  /* b */\";\n}\n"
+JS = ("// note\nconst a = 1\nconst b = a / 2 // half\nconst r = /ab+c/g;\n"
+      "const s = 'x  // y';\nlet t = `a  ${ b }  c`\nreturn a\n+b\n")
+HTML = "<!-- c -->\n<div   class=\"a  b\">\n  <p>Hello   world</p>\n  <pre>  keep\n   this </pre>\n</div>\n"
+
+RESPONSE = f"Intro text  stays.\n```html\n{HTML}```\n```python\nx  =  1  # kept\n```\n```css\n{CSS}```\n```javascript\n{JS}```\n"
+
+
+def chunkings(text, count=200, seed=11):
+    rng = random.Random(seed)
+    for _ in range(count):
+        chunks, pos = [], 0
+        while pos < len(text):
+            size = rng.randint(1, 9)
+            chunks.append(text[pos:pos + size])
+            pos += size
+        yield chunks
+
+
+def run(minifier, chunks):
+    return ''.join(minifier.feed(chunk) for chunk in chunks) + minifier.close()
+
+
+def test_css_drops_comments_and_whitespace_but_not_strings():
+    assert minify('css', CSS) == 'body{margin :0;content:"a  /* b */"}'
+
+
+def test_js_keeps_strings_regexes_templates_and_line_breaks():
+    assert minify('js', JS) == "const a=1\nconst b=a / 2\nconst r=/ab+c/g;const s='x  // y';let t=`a  ${b}  c`\nreturn a\n+b"
+
+
+def test_html_collapses_whitespace_outside_pre():
+    assert minify('html', HTML) == '<div class="a  b"> <p>Hello world</p> <pre>  keep\n   this </pre> </div>'
+
+
+
+@pytest.mark.parametrize('source, expected', [
+    ("if (a) x(); else return /a  b/.test(s)", "if(a)x();else return /a  b/.test(s)"),
+    ("if (a) x(); else /* why */ return /a  b/.test(s)", "if(a)x();else return /a  b/.test(s)"),
+    ("do // loop\n  yield /a  b/g", "do\nyield /a  b/g"),
+    ("const elsereturn = 4 / 2 /  1", "const elsereturn=4 / 2 / 1"),
+])
+def test_js_regex_after_a_keyword_that_follows_another_word(source, expected):
+    assert minify('js', source) == expected
+    for split in range(1, len(source)):
+        assert run(MINIFIERS['js'](), [source[:split], source[split:]]) == expected, split
+    fenced = f"```javascript\n{source}\n```\n"
+    for split in range(1, len(fenced)):
+        assert run(FencedMinifier(), [fenced[:split], fenced[split:]]) == f"```javascript\n{expected}\n```\n", split
+
+@pytest.mark.parametrize('section, text', [('css', CSS), ('js', JS), ('html', HTML)])
+def test_section_minifiers_ignore_chunk_boundaries(section, text):
+    expected = minify(section, text)
+    for split in range(1, len(text)):
+        assert run(MINIFIERS[section](), [text[:split], text[split:]]) == expected, split
+    for chunks in chunkings(text):
+        assert run(MINIFIERS[section](), chunks) == expected
+
+
+def test_fenced_minifier_only_touches_known_blocks():
+    output = run(FencedMinifier(), [RESPONSE])
+    assert output.startswith("Intro text  stays.\n```html\n<div")
+    assert "```python\nx  =  1  # kept\n```\n" in output
+    assert f"```css\n{minify('css', CSS)}\n```\n" in output
+    assert output.endswith(f"```javascript\n{minify('js', JS)}\n```\n")
+
+
+def test_fenced_minifier_ignores_chunk_boundaries():
+    expected = run(FencedMinifier(), [RESPONSE])
+    for split in range(1, len(RESPONSE)):
+        assert run(FencedMinifier(), [RESPONSE[:split], RESPONSE[split:]]) == expected, split
+    for chunks in chunkings(RESPONSE):
+        assert run(FencedMinifier(), chunks) == expected
+
+
+def test_fenced_minifier_counts_bytes():
+    minifier = FencedMinifier()
+    output = run(minifier, list(RESPONSE))
+    assert minifier.bytes_in == len(RESPONSE.encode('utf-8'))
+    assert minifier.bytes_out == len(output.encode('utf-8'))
+    assert minifier.bytes_out < minifier.bytes_in
+
+
+def test_compact_site_reports_savings():
+    compacted = compact_site(HTML, CSS, JS)
+    assert compacted['css'] == minify('css', CSS)
+    stats = compacted['stats']
+    assert stats['original_chars'] == len(HTML) + len(CSS) + len(JS)
+    assert stats['compacted_chars'] < stats['original_chars']
+    assert stats['saved_pct'] > 0
+
+
+def test_streamed_code_is_minified_but_stored_as_generated(monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, 'STREAM_MINIFY', True)
+    encoder = app.StreamEncoder('sections')
+    frames = []
+    for start in range(0, len(RESPONSE), 7):
+        frames += encoder.feed(RESPONSE[start:start + 7])
+    frames += encoder.close()
+    assert encoder.sections['css'].strip() == minify('css', CSS)
+    site = app.artifact_store.get(encoder.site['site_id'])
+    assert (site['html'], site['css'], site['js']) == (HTML.strip(), CSS.strip(), JS.strip())
+    assert any('"minified"' in frame for frame in frames)
@@ -0,0 +1,96 @@
+from types import SimpleNamespace
+
+from routing import ModelProfile, Router, observed
+
+
+def make_router(fast=100000, default=100000, large=100000, **kwargs):
+    profiles = {
+        'fast': ModelProfile('fast', 'fast-model', fast),
+        'default': ModelProfile('default', 'default-model', default),
+        'large': ModelProfile('large', 'large-model', large)
+    }
+    return Router(profiles, **kwargs)
+
+
+def budget(router, task='website', input_tokens=0):
+    return router.route(task, input_tokens).max_output_tokens
+
+
+def chunk(text, reason=None):
+    return SimpleNamespace(text=text, candidates=[SimpleNamespace(finish_reason=reason)] if reason else [])
+
+
+def test_repeated_truncations_raise_the_budget_up_to_max_scale():
+    router = make_router(max_scale=2.0)
+    base = budget(router)
+    assert base == 2048
+
+    budgets = []
+    for _ in range(10):
+        router.observe(router.route('website'), truncated=True)
+        budgets.append(budget(router))
+    assert budgets == sorted(budgets)
+    assert budgets[-1] == 2 * base
+    assert router.snapshot()['tasks']['website']['scale'] == 2.0
+
+
+def test_a_rare_truncation_leaves_the_budget_alone():
+    router = make_router()
+    for _ in range(30):
+        router.observe(router.route('website'), truncated=False)
+    router.observe(router.route('website'), truncated=True)
+    assert budget(router) == 2048
+
+
+def test_successes_bring_the_budget_back_down_to_its_base():
+    router = make_router()
+    for _ in range(10):
+        router.observe(router.route('website'), truncated=True)
+    raised = budget(router)
+
+    budgets = []
+    for _ in range(200):
+        router.observe(router.route('website'), truncated=False)
+        budgets.append(budget(router))
+    # Nothing eases while the truncation rate is still above the target
+    assert budgets[0] == raised
+    assert budgets == sorted(budgets, reverse=True)
+    assert budgets[-1] == 2048
+    assert router.snapshot()['tasks']['website']['scale'] == 1.0
+
+
+def test_tasks_learn_their_budgets_separately():
+    router = make_router()
+    for _ in range(10):
+        router.observe(router.route('application'), truncated=True)
+    assert budget(router, 'application') == 2 * 4096
+    assert budget(router, 'website') == 2048
+
+
+def test_budgets_grow_with_the_input_and_stay_within_their_limits():
+    router = make_router(fast=1000, default=4096, large=8192, small_tokens=100)
+    assert budget(router, 'website', 100) == 2048 + 800
+    # A small patch prefers the fast profile, but its budget is more than that allows; budgets over
+    # the default profile's limit move up to the large one
+    assert router.route('patch', 50).profile == 'default'
+    assert router.route('topics').profile == 'fast'
+    assert router.route('website', 500).profile == 'large'
+    assert router.route('website', 10000).max_output_tokens == 8192
+    assert router.route('website', 500, ceiling=3000).max_output_tokens == 3000
+
+    for _ in range(10):
+        router.observe(router.route('website', 500), truncated=True)
+    assert router.route('website', 500).max_output_tokens == 8192
+
+
+def test_observed_streams_report_truncation():
+    router = make_router()
+    for _ in range(10):
+        route = router.route('website')
+        chunks = list(observed([chunk('a'), chunk('b', 'MAX_TOKENS')], router, route))
+        assert [c.text for c in chunks] == ['a', 'b']
+    assert budget(router) == 2 * 2048
+
+    route = router.route('topics')
+    list(observed([chunk('a'), chunk('', 'STOP')], router, route))
+    assert router.snapshot()['tasks']['topics'] == {'truncation_rate': 0.0, 'scale': 1.0}
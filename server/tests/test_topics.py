@@ -0,0 +1,25 @@
+from topics import evaluate_fixtures, extract_topics
+
+
+def test_fixture_quality_does_not_regress():
+    report = evaluate_fixtures()
+    assert report['cases'] >= 20
+    assert report['recall'] >= 0.885
+    assert report['precision'] >= 0.963
+    assert report['failures'] == []
+
+
+def test_extracts_the_scored_phrases_without_request_words():
+    topics = extract_topics('Create a landing page for a cozy coffee shop in Seattle with latte art photos')
+    assert topics == ['coffee shop', 'latte art', 'seattle']
+    assert extract_topics('Build a portfolio website for a wedding photographer') == ['wedding photographer', 'portfolio']
+
+
+def test_max_topics_keeps_the_best():
+    assert extract_topics('Create a landing page for a cozy coffee shop in Seattle with latte art photos',
+                          max_topics=2) == ['coffee shop', 'latte art']
+
+
+def test_nothing_to_extract():
+    assert extract_topics('') == []
+    assert extract_topics('the and of') == []
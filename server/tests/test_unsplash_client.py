@@ -0,0 +1,249 @@
+import threading
+import time
+
+import pytest
+import requests
+
+import unsplash_client
+from unsplash_client import CircuitBreaker, QuotaBucket, RetryBudget, UnsplashClient
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def json(self):
+        return {'results': []}
+
+
+class FakeSession:
+    """
+    Answers get() from a list of responses or exceptions, one per call
+    """
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def get(self, url, params=None, timeout=None):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    A settable time.time() for the breaker's reset timeout
+    """
+    now = [1000.0]
+    monkeypatch.setattr(unsplash_client.time, 'time', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def monotonic(monkeypatch):
+    """
+    A settable time.monotonic() for the quota bucket's refill
+    """
+    now = [1000.0]
+    monkeypatch.setattr(unsplash_client.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def make_client(outcomes, **kwargs):
+    kwargs.setdefault('backoff_base', 0.0)
+    client = UnsplashClient('test-key', **kwargs)
+    client.session = FakeSession(outcomes)
+    return client
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+    assert breaker.snapshot()['times_opened'] == 1
+
+
+def test_breaker_success_resets_the_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == 'closed'
+
+
+def test_half_open_lets_one_trial_through(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock[0] += 30
+    assert breaker.allow()
+    assert breaker.state == 'half_open'
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    assert breaker.allow()
+
+
+def test_failed_half_open_trial_opens_again(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock[0] += 30
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+    assert breaker.snapshot()['times_opened'] == 2
+
+
+def test_retry_budget_earns_a_fraction_per_request():
+    budget = RetryBudget(ratio=0.5, max_tokens=1.0)
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert budget.withdraw()
+
+
+def test_retry_budget_is_capped():
+    budget = RetryBudget(ratio=1.0, max_tokens=2.0)
+    for _ in range(5):
+        budget.deposit()
+    assert budget.tokens == 2.0
+
+
+def test_transient_errors_are_retried():
+    client = make_client([requests.ConnectionError('reset'), FakeResponse(200)], max_retries=2)
+    assert client._get('/search/photos', {}).status_code == 200
+    assert client.session.calls == 2
+    assert client.retries == 1
+    assert client.breaker.consecutive_failures == 0
+
+
+def test_server_errors_are_retried_up_to_max_retries():
+    client = make_client([FakeResponse(503)] * 3, max_retries=2)
+    assert client._get('/search/photos', {}).status_code == 503
+    assert client.session.calls == 3
+    assert client.failures == 1
+    assert client.breaker.consecutive_failures == 1
+
+
+def test_retries_stop_when_the_budget_is_spent():
+    client = make_client([FakeResponse(503)] * 3, max_retries=2, retry_budget=RetryBudget(ratio=0.0, max_tokens=0.0))
+    client._get('/search/photos', {})
+    assert client.session.calls == 1
+
+
+def test_other_request_errors_fail_without_a_retry():
+    client = make_client([requests.TooManyRedirects('loop')], max_retries=2)
+    assert client._get('/search/photos', {}) is None
+    assert client.session.calls == 1
+    assert client.breaker.consecutive_failures == 1
+
+
+def test_unexpected_errors_still_count_against_the_breaker(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock[0] += 30
+    client = make_client([ValueError('bad header')], breaker=breaker)
+    with pytest.raises(ValueError):
+        client._get('/search/photos', {})
+    assert breaker.state == 'open'
+
+
+def test_open_breaker_short_circuits():
+    breaker = CircuitBreaker(failure_threshold=1)
+    breaker.record_failure()
+    client = make_client([], breaker=breaker)
+    assert client.search_photos('cats') is None
+    assert client.short_circuited == 1
+    assert client.session.calls == 0
+
+
+def test_quota_bucket_refills_at_the_hourly_rate(monotonic):
+    quota = QuotaBucket(hourly_limit=3600, reserve=0.0)
+    quota.tokens = 0.0
+    assert not quota.acquire()
+    monotonic[0] += 1
+    assert quota.acquire()
+    assert not quota.acquire()
+    assert quota.throttled == 2
+
+
+def test_quota_bucket_keeps_a_reserve_from_background_work(monotonic):
+    quota = QuotaBucket(hourly_limit=10, reserve=0.2)
+    quota.tokens = 3.0
+    assert quota.acquire(background=True)
+    assert not quota.acquire(background=True)
+    assert quota.acquire()
+    assert quota.acquire()
+    assert not quota.acquire()
+
+
+def test_quota_bucket_follows_the_rate_limit_headers(monotonic):
+    quota = QuotaBucket(hourly_limit=50)
+    quota.observe({'X-Ratelimit-Limit': '1000', 'X-Ratelimit-Remaining': '7'})
+    assert quota.hourly_limit == 1000
+    assert quota.tokens == 7.0
+    quota.observe({'X-Ratelimit-Remaining': 'not a number'})
+    assert quota.tokens == 7.0
+    quota.exhaust()
+    assert not quota.acquire()
+
+
+def test_empty_quota_gives_the_half_open_trial_back(clock, monotonic):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock[0] += 30
+    quota = QuotaBucket(hourly_limit=10)
+    quota.tokens = 0.0
+    client = make_client([FakeResponse(200)], breaker=breaker, quota=quota)
+    assert client._get('/search/photos', {}) is None
+    assert client.session.calls == 0
+    assert breaker.state == 'half_open'
+
+    quota.tokens = 1.0
+    assert client._get('/search/photos', {}).status_code == 200
+    assert breaker.state == 'closed'
+
+
+def test_429_exhausts_the_quota_without_a_retry(monotonic):
+    client = make_client([FakeResponse(429, {'X-Ratelimit-Remaining': '5'})], max_retries=2)
+    assert client._get('/search/photos', {}).status_code == 429
+    assert client.session.calls == 1
+    assert client.quota.tokens == 0.0
+    assert client.breaker.consecutive_failures == 1
+
+
+def test_identical_searches_in_flight_share_one_request():
+    client = make_client([])
+    started = threading.Event()
+    release = threading.Event()
+
+    def search(path, params, background):
+        started.set()
+        release.wait(5)
+        return {'results': [params['query']]}
+
+    client._search = search
+    results = []
+    leader = threading.Thread(target=lambda: results.append(client.search_photos('cats')))
+    leader.start()
+    assert started.wait(5)
+    follower = threading.Thread(target=lambda: results.append(client.search_photos('cats')))
+    follower.start()
+    while client.coalesced == 0:
+        time.sleep(0.001)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert results == [{'results': ['cats']}] * 2
+    assert client.coalesced == 1
@@ -0,0 +1,172 @@
+import json
+import os
+import re
+import sys
+import time
+from collections import Counter
+
+# Words that never make a useful image search term on their own
+STOP_WORDS = frozenset("""
+a about above after again against all also am an and any are as at be because been before being below
+between both but by can could did do does doing down during each few for from further had has have having
+he her here hers herself him himself his how i if in into is it its itself just let like me more most my
+myself no nor not now of off on once only or other our ours ourselves out over own please same she should
+so some such than that the their theirs them themselves then there these they this those through to too
+under until up very was we were what when where which while who whom why will with would you your yours
+yourself yourselves want wants need needs using use used via include includes including show shows
+showing featuring feature features based one two three many much several every really kind lots
+""".split())
+
+# Verbs and web/UI vocabulary that describe the request rather than what should be pictured
+REQUEST_WORDS = frozenset("""
+create make build develop design generate add change modify update replace remove put set turn give
+website websites site sites web webpage webpages page pages landing homepage home section sections header
+footer navbar nav menu button buttons link links layout template theme style styles styled color colors
+colour background font fonts text title heading content form forms contact app application responsive
+modern simple clean nice beautiful cool minimal minimalist professional elegant stylish new good great best
+image images photo photos picture pictures gallery hero banner logo icon icons card cards slider
+business company online personal small big large local blog
+""".split())
+
+# Adjective-like suffixes that rarely stand alone as a picture
+_MODIFIER_SUFFIXES = ('ly', 'ful', 'ous', 'ive', 'able', 'ible')
+
+_WORD_RE = re.compile(r"[a-z][a-z'\-]*")
+_SPLIT_RE = re.compile(r"[.,;:!?()\[\]{}\"/|\n\r\t]+")
+
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'topic_fixtures.json')
+
+
+def _is_content_word(word):
+    return (
+        len(word) > 2
+        and word not in STOP_WORDS
+        and word not in REQUEST_WORDS
+    )
+
+
+def _candidate_phrases(text):
+    """
+    Split text into runs of content words (RAKE candidates).
+    Stop words, request words and punctuation act as phrase delimiters.
+    """
+    phrases = []
+    for fragment in _SPLIT_RE.split(text.lower()):
+        current = []
+        for word in _WORD_RE.findall(fragment):
+            word = word.strip("'-")
+            if word.endswith("'s"):
+                word = word[:-2]
+            if _is_content_word(word):
+                current.append(word)
+            elif current:
+                phrases.append(current)
+                current = []
+        if current:
+            phrases.append(current)
+    return phrases
+
+
+def _trim_phrase(words):
+    """
+    Noun-phrase heuristic: keep at most the last two words of a run, since
+    English noun phrases end in their head noun, and drop a leading modifier.
+    """
+    words = words[-2:]
+    if len(words) == 2 and words[0].endswith(_MODIFIER_SUFFIXES):
+        words = words[1:]
+    return words
+
+
+def extract_topics(text, max_topics=5):
+    """
+    Extract image search topics from a description with a RAKE-style scorer.
+
+    Each word is scored by degree / frequency over the candidate phrases,
+    a phrase scores the sum of its words, and earlier phrases win ties.
+    Runs in microseconds and needs no network access.
+    """
+    if not text:
+        return []
+
+    phrases = [_trim_phrase(words) for words in _candidate_phrases(text)]
+    if not phrases:
+        return []
+
+    frequency = Counter()
+    degree = Counter()
+    for words in phrases:
+        for word in words:
+            frequency[word] += 1
+            degree[word] += len(words)
+
+    word_score = {word: degree[word] / frequency[word] for word in frequency}
+
+    scored = {}
+    for position, words in enumerate(phrases):
+        phrase = ' '.join(words)
+        if phrase in scored:
+            continue
+        # Repeated words signal the main subject, so reward frequency a little
+        score = sum(word_score[word] + 0.5 * (frequency[word] - 1) for word in words)
+        scored[phrase] = (score, -position)
+
+    ranked = sorted(scored, key=lambda phrase: scored[phrase], reverse=True)
+
+    # Skip single words already covered by a higher ranked phrase
+    topics = []
+    for phrase in ranked:
+        if any(phrase in chosen.split() for chosen in topics):
+            continue
+        topics.append(phrase)
+        if len(topics) >= max_topics:
+            break
+    return topics
+
+
+def evaluate_fixtures(path=DEFAULT_FIXTURES, max_topics=5):
+    """
+    Score extract_topics against a labeled fixture file.
+
+    A case counts its labeled keywords found among the extracted topics
+    (word overlap is enough, e.g. "coffee" matches "coffee shop").
+    Returns a summary dict with recall, precision and timing.
+    """
+    with open(path) as f:
+        cases = json.load(f)
+
+    matched_labels = total_labels = relevant_topics = total_topics = 0
+    failures = []
+    started = time.perf_counter()
+    results = [(case, extract_topics(case['text'], max_topics)) for case in cases]
+    elapsed = time.perf_counter() - started
+
+    for case, topics in results:
+        topic_words = {word for topic in topics for word in topic.split()}
+        labels = case['keywords']
+        hits = [label for label in labels if set(label.split()) & topic_words]
+        matched_labels += len(hits)
+        total_labels += len(labels)
+
+        label_words = {word for label in labels for word in label.split()}
+        relevant_topics += sum(1 for topic in topics if set(topic.split()) & label_words)
+        total_topics += len(topics)
+
+        if not hits:
+            failures.append({'text': case['text'], 'topics': topics, 'keywords': labels})
+
+    return {
+        'cases': len(cases),
+        'recall': round(matched_labels / total_labels, 3) if total_labels else 0.0,
+        'precision': round(relevant_topics / total_topics, 3) if total_topics else 0.0,
+        'avg_ms': round(elapsed * 1000 / max(len(cases), 1), 4),
+        'failures': failures
+    }
+
+
+if __name__ == '__main__':
+    # python topics.py [fixtures.json] -- prints the fixture report, exits non-zero on a quality regression
+    report = evaluate_fixtures(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_FIXTURES)
+    print(json.dumps(report, indent=2))
+    ok = report['recall'] >= 0.6 and report['precision'] >= 0.6 and report['avg_ms'] < 1.0 and not report['failures']
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,365 @@
+import os
+import random
+import threading
+import time
+
+# Overridable so benchmarks can point the client at a local fake server
+UNSPLASH_API_URL = os.getenv('UNSPLASH_API_URL', "https://api.unsplash.com").rstrip('/')
+
+
+class CircuitBreaker:
+    """
+    Stops calling an unhealthy upstream for a while after repeated failures.
+
+    closed -> open after `failure_threshold` consecutive failures.
+    open -> half_open once `reset_timeout` seconds have passed; one trial call is let through.
+    half_open -> closed on success, back to open on failure.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.time() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+                self._trial_in_flight = False
+            if self.state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def release(self):
+        """
+        Give back a trial call that was allowed but never made, so the next caller can make it
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial_in_flight = False
+            if self.state == 'half_open' or self.consecutive_failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.times_opened += 1
+                self.state = 'open'
+                self.opened_at = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            retry_in = None
+            if self.state == 'open':
+                retry_in = max(0.0, round(self.reset_timeout - (time.time() - self.opened_at), 1))
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'times_opened': self.times_opened,
+                'retry_in': retry_in
+            }
+
+
+class RetryBudget:
+    """
+    Caps retries to a fraction of overall traffic so retries can't pile onto an outage.
+    Every request earns `ratio` of a retry, up to `max_tokens` saved up.
+    """
+
+    def __init__(self, ratio=0.2, max_tokens=10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return True
+            return False
+
+
+class QuotaBucket:
+    """
+    Token bucket sized to the API key's hourly request quota.
+
+    Holds up to `hourly_limit` tokens and refills at hourly_limit per hour.
+    acquire() never blocks: when the bucket is empty the caller goes without.
+    Background work (cache refreshes) only gets a token while more than
+    `reserve` of the bucket is left, so it can't starve live requests.
+
+    Unsplash reports the real quota on every response (X-Ratelimit-Limit and
+    X-Ratelimit-Remaining), counting every process that shares the key.
+    observe() adopts both, so the bucket follows what is actually left.
+    """
+
+    def __init__(self, hourly_limit=50, reserve=0.2):
+        self.hourly_limit = hourly_limit
+        self.reserve = reserve
+        self.tokens = float(hourly_limit)
+        self.remaining = None  # last X-Ratelimit-Remaining seen
+        self.throttled = 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, background=False):
+        with self._lock:
+            self._refill()
+            floor = self.hourly_limit * self.reserve if background else 0.0
+            if self.tokens - 1.0 < floor:
+                self.throttled += 1
+                return False
+            self.tokens -= 1.0
+            return True
+
+    def observe(self, headers):
+        limit = _int_header(headers, 'X-Ratelimit-Limit')
+        remaining = _int_header(headers, 'X-Ratelimit-Remaining')
+        with self._lock:
+            self._refill()
+            if limit:
+                self.hourly_limit = limit
+            if remaining is not None:
+                self.remaining = remaining
+                self.tokens = min(float(self.hourly_limit), float(remaining))
+
+    def exhaust(self):
+        """
+        The upstream answered 429, so nothing is left until the bucket refills
+        """
+        with self._lock:
+            self._refill()
+            self.tokens = 0.0
+            self.remaining = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(float(self.hourly_limit), self.tokens + (now - self._updated) * self.hourly_limit / 3600.0)
+        self._updated = now
+
+    def snapshot(self):
+        with self._lock:
+            self._refill()
+            return {
+                'tokens': round(self.tokens, 2),
+                'hourly_limit': self.hourly_limit,
+                'remaining': self.remaining,
+                'throttled': self.throttled
+            }
+
+
+def _int_header(headers, name):
+    try:
+        return int(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+class _PendingCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class UnsplashClient:
+    """
+    Unsplash API client with a pooled keep-alive session, timeouts,
+    jittered retries limited by a retry budget, a circuit breaker, and a
+    quota bucket that every request (retries included) must take a token
+    from. Identical searches that are already in flight share one request.
+    """
+
+    # Statuses worth retrying; 429 counts against the breaker but is never retried
+    RETRYABLE_STATUSES = {500, 502, 503, 504}
+
+    def __init__(self, access_key, connect_timeout=2.0, read_timeout=5.0, max_retries=2,
+                 backoff_base=0.2, pool_size=16, breaker=None, retry_budget=None, quota=None):
+        self.access_key = access_key
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.breaker = breaker or CircuitBreaker()
+        self.retry_budget = retry_budget or RetryBudget()
+        self.quota = quota or QuotaBucket()
+        self._pending = {}  # request key -> _PendingCall
+        self._pending_lock = threading.Lock()
+
+        # Imported here rather than at module level to keep the app's cold start short
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self._transient_errors = (requests.ConnectionError, requests.Timeout)
+        self._request_errors = requests.RequestException
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"Client-ID {access_key}",
+            "Accept-Version": "v1"
+        })
+        # Retries are handled here, not by urllib3, so they respect the budget
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.requests_made = 0
+        self.retries = 0
+        self.failures = 0
+        self.short_circuited = 0
+        self.coalesced = 0
+        self._stats_lock = threading.Lock()
+
+    def search_photos(self, query, per_page=10, background=False, **params):
+        """
+        Call /search/photos and return the decoded JSON, or None if the
+        upstream failed, the circuit is open or the quota is used up.
+        Background searches leave the last part of the quota to live requests.
+        """
+        params = dict(params, query=query, per_page=per_page)
+        key = tuple(sorted(params.items()))
+        with self._pending_lock:
+            call = self._pending.get(key)
+            leader = call is None
+            if leader:
+                call = self._pending[key] = _PendingCall()
+        if not leader:
+            with self._stats_lock:
+                self.coalesced += 1
+            call.done.wait()
+            return call.result
+
+        try:
+            call.result = self._search("/search/photos", params, background)
+        finally:
+            with self._pending_lock:
+                del self._pending[key]
+            call.done.set()
+        return call.result
+
+    def _search(self, path, params, background):
+        response = self._get(path, params, background)
+        if response is None:
+            return None
+
+        try:
+            data = response.json()
+        except ValueError:
+            print(f"Unsplash returned a non-JSON response ({response.status_code})")
+            return None
+
+        if response.status_code != 200:
+            print(f"Error fetching Unsplash images ({response.status_code}): {data}")
+            return None
+        return data
+
+    def _get(self, path, params, background=False):
+        if not self.breaker.allow():
+            with self._stats_lock:
+                self.short_circuited += 1
+            return None
+        if not self.quota.acquire(background):
+            # Out of quota: fail fast to no images instead of waiting for tokens. A half-open
+            # trial that was granted for this call goes back unused
+            self.breaker.release()
+            return None
+
+        self.retry_budget.deposit()
+        attempt = 0
+        recorded = False
+        try:
+            while True:
+                with self._stats_lock:
+                    self.requests_made += 1
+                try:
+                    response = self.session.get(UNSPLASH_API_URL + path, params=params, timeout=self.timeout)
+                    self.quota.observe(response.headers)
+                    if response.status_code == 429:
+                        self.quota.exhaust()
+                    retryable = response.status_code in self.RETRYABLE_STATUSES
+                    failed = retryable or response.status_code == 429
+                    error = f"status {response.status_code}"
+                except self._transient_errors as e:
+                    response = None
+                    retryable = failed = True
+                    error = str(e)
+                except self._request_errors as e:
+                    # Bad TLS, redirect loops, broken bodies and the like won't get better on a retry
+                    response = None
+                    retryable = False
+                    failed = True
+                    error = str(e)
+
+                if not failed:
+                    recorded = True
+                    self.breaker.record_success()
+                    return response
+
+                if (not retryable or attempt >= self.max_retries or not self.retry_budget.withdraw()
+                        or not self.quota.acquire(background)):
+                    recorded = True
+                    self.breaker.record_failure()
+                    with self._stats_lock:
+                        self.failures += 1
+                    print(f"Unsplash request failed after {attempt + 1} attempt(s): {error}")
+                    return response
+
+                # Full jitter backoff
+                attempt += 1
+                with self._stats_lock:
+                    self.retries += 1
+                time.sleep(random.uniform(0, self.backoff_base * (2 ** attempt)))
+        finally:
+            # Anything unexpected still counts against the breaker, so a half-open trial is never left hanging
+            if not recorded:
+                self.breaker.record_failure()
+
+    def snapshot(self):
+        with self._stats_lock:
+            stats = {
+                'requests': self.requests_made,
+                'retries': self.retries,
+                'failures': self.failures,
+                'short_circuited': self.short_circuited,
+                'coalesced': self.coalesced
+            }
+        stats['retry_budget'] = round(self.retry_budget.tokens, 2)
+        stats['quota'] = self.quota.snapshot()
+        stats['circuit'] = self.breaker.snapshot()
+        return stats
+
+
+def create_unsplash_client_from_env(access_key):
+    """
+    Build the process-wide client from UNSPLASH_* environment variables.
+    """
+    return UnsplashClient(
+        access_key,
+        connect_timeout=float(os.getenv('UNSPLASH_CONNECT_TIMEOUT', '2.0')),
+        read_timeout=float(os.getenv('UNSPLASH_READ_TIMEOUT', '5.0')),
+        max_retries=int(os.getenv('UNSPLASH_MAX_RETRIES', '2')),
+        breaker=CircuitBreaker(
+            failure_threshold=int(os.getenv('UNSPLASH_BREAKER_THRESHOLD', '5')),
+            reset_timeout=float(os.getenv('UNSPLASH_BREAKER_RESET', '30'))
+        ),
+        quota=QuotaBucket(
+            hourly_limit=int(os.getenv('UNSPLASH_HOURLY_LIMIT', '50')),
+            reserve=float(os.getenv('UNSPLASH_BACKGROUND_RESERVE', '0.2'))
+        )
+    )
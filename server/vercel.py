@@ -1,3 +1,8 @@
+import os
+
 from app import app
 
-# This file is used by Vercel to import the Flask app
+# This file is used by Vercel to import the Flask app.
+# SERVER_MODE=asgi serves the generation endpoints from the asyncio handlers in asgi.py instead.
+if os.getenv('SERVER_MODE', 'wsgi').lower() == 'asgi':
+    from asgi import asgi_app as app
@@ -3,25 +3,103 @@
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL || 'http://localhost:3001';
 console.log('Using backend URL:', BACKEND_URL);
 
+// Server-side id of the site currently shown, taken from the siteId event at the end of each stream.
+// Lets modifyWebsite send only the id instead of re-uploading the whole site.
+let currentSiteId = null;
+
+// How many times a dropped stream is resumed before giving up
+const MAX_RESUME_ATTEMPTS = 3;
+
+// Reconnect to a generation that is still running (or buffered) on the server,
+// receiving only the events after lastEventId
+async function resumeStream(generationId, lastEventId) {
+  const response = await fetch(`${BACKEND_URL}/api/streams/${generationId}`, {
+    headers: { 'Last-Event-ID': String(lastEventId) },
+  });
+  if (!response.ok) {
+    throw new Error(`Could not resume generation: ${response.status}`);
+  }
+  return response.body.getReader();
+}
+
 // Helper function to process streaming response for both website and application generation
 async function processStreamingResponse(response, onUpdate, initialState = { html: '', css: '', js: '' }) {
-  const reader = response.body.getReader();
+  let reader = response.body.getReader();
   const decoder = new TextDecoder();
   let accumulatedText = '';
   let lastUpdate = initialState;
+  // Section text received in 'sections' response mode, keyed by html/css/js. It is kept trimmed
+  // as it grows: leading whitespace is dropped, and trailing whitespace waits in pendingWhitespace
+  // until more text follows, so each delta only costs its own length
+  const sections = {};
+  const pendingWhitespace = {};
+  // The server keeps generating if the connection drops, so the stream can be resumed from the last event id
+  let generationId = null;
+  let pendingEventId = null;
+  let lastEventId = 0;
+  let resumeAttempts = 0;
 
   while (true) {
-    const { done, value } = await reader.read();
+    let result;
+    try {
+      result = await reader.read();
+    } catch (error) {
+      if (!generationId || resumeAttempts >= MAX_RESUME_ATTEMPTS) throw error;
+      resumeAttempts += 1;
+      console.warn(`Stream interrupted, resuming generation ${generationId} after event ${lastEventId}`);
+      reader = await resumeStream(generationId, lastEventId);
+      continue;
+    }
+    const { done, value } = result;
     if (done) break;
 
     const chunk = decoder.decode(value);
     const lines = chunk.split('\n');
 
     for (const line of lines) {
+      if (line.startsWith('id: ')) {
+        pendingEventId = parseInt(line.slice(4), 10);
+        continue;
+      }
+
       if (line.startsWith('data: ')) {
+        if (pendingEventId !== null) {
+          lastEventId = pendingEventId;
+          pendingEventId = null;
+        }
         const data = JSON.parse(line.slice(6));
         const { text } = data;
 
+        if (data.generationId) {
+          generationId = data.generationId;
+          continue;
+        }
+
+        if (data.siteId) {
+          currentSiteId = data.siteId;
+          continue;
+        }
+
+        // In 'sections' mode the server has already split the code blocks apart
+        if (data.section) {
+          if (typeof data.delta === 'string') {
+            const current = sections[data.section] || '';
+            let added = (pendingWhitespace[data.section] || '') + data.delta;
+            if (!current) added = added.trimStart();
+            const trimmed = added.trimEnd();
+            pendingWhitespace[data.section] = added.slice(trimmed.length);
+            if (trimmed) {
+              sections[data.section] = current + trimmed;
+              lastUpdate = { ...lastUpdate, [data.section]: sections[data.section] };
+              onUpdate(lastUpdate);
+            }
+          }
+          continue;
+        }
+
+        // Progress and status events carry no generated text
+        if (typeof text !== 'string') continue;
+
         // Accumulate the text
         accumulatedText += text;
 
@@ -106,13 +184,14 @@ async function processStreamingResponse(response, onUpdate, initialState = { htm
 }
 
 export async function generateWebsite(description, onUpdate) {
+  currentSiteId = null;
   try {
     const response = await fetch(`${BACKEND_URL}/api/generate-website`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
       },
-      body: JSON.stringify({ description }),
+      body: JSON.stringify({ description, responseMode: 'sections' }),
     });
 
     if (!response.ok) {
@@ -127,13 +206,14 @@ export async function generateWebsite(description, onUpdate) {
 }
 
 export async function generateApplication(description, onUpdate) {
+  currentSiteId = null;
   try {
     const response = await fetch(`${BACKEND_URL}/api/generate-application`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
       },
-      body: JSON.stringify({ description }),
+      body: JSON.stringify({ description, responseMode: 'sections' }),
     });
 
     if (!response.ok) {
@@ -162,21 +242,39 @@ export async function modifyWebsite(modificationDescription, currentHtml, curren
       modificationDescription: modificationDescription.trim(),
       currentHtml: currentHtml.trim(),
       currentCss: currentCss?.trim() || '',
-      currentJs: currentJs?.trim() || ''
+      currentJs: currentJs?.trim() || '',
+      responseMode: 'sections'
     };
 
-    console.log('Sending modification request to:', `${BACKEND_URL}/api/modify-website`);
-    console.log('Request payload:', payload);
-
-    const response = await fetch(`${BACKEND_URL}/api/modify-website`, {
+    const postModification = (body) => fetch(`${BACKEND_URL}/api/modify-website`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
         'Accept': 'text/event-stream',
       },
-      body: JSON.stringify(payload),
+      body: JSON.stringify(body),
     });
 
+    console.log('Sending modification request to:', `${BACKEND_URL}/api/modify-website`);
+
+    let response;
+    if (currentSiteId) {
+      // The server already has this site, so send only its id and the requested change
+      response = await postModification({
+        siteId: currentSiteId,
+        modificationDescription: payload.modificationDescription,
+        responseMode: payload.responseMode
+      });
+      if (response.status === 404) {
+        // The server no longer has the site (restart or expiry), upload it in full instead
+        currentSiteId = null;
+        response = await postModification(payload);
+      }
+    } else {
+      console.log('Request payload:', payload);
+      response = await postModification(payload);
+    }
+
     console.log('Response status:', response.status);
     console.log('Response headers:', Object.fromEntries(response.headers.entries()));
 